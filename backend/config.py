@@ -23,9 +23,14 @@ class Settings(BaseSettings):
     # SAM3 Model
     SAM3_MODEL_ID: str = "facebook/sam3"
     SAM3_DEVICE: str = "cuda"
-    SAM3_DTYPE: str = "float16"
-    SAM3_MAX_CONCURRENT_INFERENCE: int = 1  # Only 1 inference at a time on GPU
+    SAM3_DTYPE: str = "float16"  # Autocast dtype for CUDA inference ("bfloat16" is faster on Ampere and newer GPUs)
+    SAM3_MAX_CONCURRENT_INFERENCE: int = 1  # Inference threads on CUDA, each on its own stream; each extra thread adds peak VRAM (CPU always uses 1)
     SAM3_INFERENCE_WORKERS: int = 1  # Single inference worker to avoid GPU contention
+    SAM3_EMBED_CACHE_SIZE: int = 4  # Vision embeddings kept for re-queried frames (0 disables)
+    SAM3_EMBED_CACHE_TOLERANCE: int = 0  # Max gray-level change per 64x64 thumbnail cell to reuse a cached frame's embeddings (0 = exact repeats only)
+    SAM3_STREAMING_SKIP_TOLERANCE: int = 0  # Max gray-level change per 64x64 thumbnail cell since the last tracked frame to reuse its streaming results (0 disables)
+    SAM3_USE_COMPILE: bool = False  # torch.compile the vision encoder at startup (CUDA only, slow first start)
+    SAM3_JIT_TRACE: bool = False  # TorchScript-trace the vision encoder at startup (ignored when compiling)
     
     # Image processing (CPU-bound, can be parallel)
     IMAGE_PROCESSING_WORKERS: int = 8  # More workers for image encoding/decoding
@@ -39,8 +44,14 @@ class Settings(BaseSettings):
     RECORDING_PRE_ROLL_SECONDS: int = 5
     RECORDING_POST_ROLL_SECONDS: int = 3
     RECORDING_FPS: int = 15
+    RECORDING_OUTPUT_WIDTH: int = 1920  # Wider camera frames are downscaled before encoding (0 = keep native)
     RECORDING_MAX_DURATION_SECONDS: int = 300  # 5 minutes max
     RECORDING_INCLUDE_AUDIO: bool = True  # Record audio from RTSP stream
+    RECORDING_PREROLL_SEGMENTS: bool = False  # Audio mode: keep pre-roll as stream-copied segments (extra RTSP connection per camera)
+    RECORDING_QUEUE_MAX: int = 30  # Live frames buffered per recording before the oldest are dropped
+    RECORDING_MAX_CONCURRENT: int = 4  # Simultaneous recordings before new ones queue
+    RECORDING_WORKERS: int = 2  # Persistent ffmpeg workers for thumbnail/concat/transcode jobs
+    RECORDING_HW_ENCODER: str = "auto"  # auto, none, or an ffmpeg encoder (h264_nvenc, h264_qsv, h264_vaapi, h264_amf)
     
     # Frame buffer for pre-roll (ring buffer size)
     FRAME_BUFFER_SIZE: int = 150  # 5 seconds at 30fps
@@ -49,6 +60,8 @@ class Settings(BaseSettings):
     DETECTION_CONFIDENCE_THRESHOLD: float = 0.7
     DETECTION_SAMPLE_RATE: float = 0.5  # Samples per second (1 every 2 seconds to reduce GPU load)
     DETECTION_CONSECUTIVE_FRAMES: int = 2  # Consecutive detections required to trigger alert (1 = instant)
+    RULE_ENGINE_WORKERS: int = 4  # Threads for evaluating a camera's rules in parallel
+    DETECTION_DEBUG_LOGGING: bool = False  # Per-frame rule evaluation debug logs (hot path)
     
     # Discord
     DISCORD_WEBHOOK_URL: Optional[str] = None
@@ -71,6 +71,7 @@ async def lifespan(app: FastAPI) -> AsyncGenerator:
     logger.info("🐱 Purrimeter Defense shutting down...")
     await app.state.pipeline_manager.stop()
     logger.info("✅ Pipeline manager stopped")
+    await asyncio.to_thread(app.state.sam3_service.shutdown)
 
 
 app = FastAPI(
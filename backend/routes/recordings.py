@@ -146,7 +146,7 @@ async def get_recording_thumbnail(recording_id: str, db: AsyncSession = Depends(
     
     return FileResponse(
         path=thumbnail_path,
-        media_type="image/jpeg",
+        media_type="image/webp" if thumbnail_path.suffix == ".webp" else "image/jpeg",
     )
 
 
@@ -8,7 +8,7 @@ import asyncio
 from collections import deque
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Optional, Callable, AsyncIterator, Deque
+from typing import Optional, Callable, AsyncIterator, Deque, Tuple
 from enum import Enum
 import threading
 import time
@@ -18,9 +18,19 @@ import numpy as np
 from PIL import Image
 
 from backend.config import settings
+from backend.services.preroll_segmenter import PrerollSegmenter
 
 logger = structlog.get_logger()
 
+# Longest side of recording thumbnails, in pixels
+THUMBNAIL_MAX_SIDE = 320
+
+
+def compute_thumbnail_dims(width: int, height: int) -> Tuple[int, int]:
+    """Thumbnail size for a frame size, fitting THUMBNAIL_MAX_SIDE and keeping aspect ratio."""
+    scale = min(1.0, THUMBNAIL_MAX_SIDE / max(width, height, 1))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
 
 class StreamStatus(str, Enum):
     """Status of the camera stream connection."""
@@ -71,6 +81,10 @@ class CameraStream:
     _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
     _read_thread: Optional[threading.Thread] = field(default=None, repr=False)
     _subscribers: list = field(default_factory=list, repr=False)
+    _preroll_segmenter: Optional[PrerollSegmenter] = field(default=None, repr=False)
+    
+    # Recording thumbnail size for this camera's resolution (width, height)
+    thumbnail_dims: Tuple[int, int] = field(default=(THUMBNAIL_MAX_SIDE, THUMBNAIL_MAX_SIDE), repr=False)
     
     # Connection state tracking
     _status: StreamStatus = field(default=StreamStatus.DISCONNECTED, repr=False)
@@ -82,6 +96,7 @@ class CameraStream:
     def __post_init__(self):
         # Initialize frame buffer with configured size
         self._frame_buffer = deque(maxlen=settings.FRAME_BUFFER_SIZE)
+        self.thumbnail_dims = compute_thumbnail_dims(self.width, self.height)
     
     def _set_status(self, status: StreamStatus):
         """Thread-safe status update."""
@@ -132,6 +147,8 @@ class CameraStream:
             actual_width = int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH))
             actual_height = int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
             actual_fps = self._capture.get(cv2.CAP_PROP_FPS)
+            if actual_width > 0 and actual_height > 0:
+                self.thumbnail_dims = compute_thumbnail_dims(actual_width, actual_height)
             
             logger.info(
                 "Camera stream opened",
@@ -176,6 +193,11 @@ class CameraStream:
             )
             self._read_thread.start()
             
+            # Audio recordings can take their pre-roll from stream-copied segments
+            if settings.RECORDING_INCLUDE_AUDIO and settings.RECORDING_PREROLL_SEGMENTS:
+                self._preroll_segmenter = PrerollSegmenter(self.camera_id, self.rtsp_url)
+                await self._preroll_segmenter.start()
+            
             return True
             
         except Exception as e:
@@ -191,6 +213,10 @@ class CameraStream:
         
         if self._read_thread:
             self._read_thread.join(timeout=5.0)
+        
+        if self._preroll_segmenter:
+            await self._preroll_segmenter.stop()
+            self._preroll_segmenter = None
             
         if self._capture:
             try:
@@ -329,20 +355,28 @@ class CameraStream:
         with self._lock:
             return self._current_frame
     
-    def get_frame_as_pil(self) -> Optional[Image.Image]:
-        """Get the current frame as a PIL Image."""
+    def get_frame_rgb(self) -> Optional[np.ndarray]:
+        """Get the current frame as a new RGB array (no PIL conversion)."""
         frame = self.get_current_frame()
         if frame is None:
             return None
         
         # Convert BGR to RGB
-        rgb_frame = cv2.cvtColor(frame.frame, cv2.COLOR_BGR2RGB)
+        return cv2.cvtColor(frame.frame, cv2.COLOR_BGR2RGB)
+    
+    def get_frame_as_pil(self) -> Optional[Image.Image]:
+        """Get the current frame as a PIL Image."""
+        rgb_frame = self.get_frame_rgb()
+        if rgb_frame is None:
+            return None
         return Image.fromarray(rgb_frame)
     
     def get_pre_roll_frames(self, seconds: float = None) -> list[TimestampedFrame]:
         """
         Get frames from the buffer for pre-roll recording.
         
+        The frames are shared with the ring buffer, not copied.
+        
         Args:
             seconds: Number of seconds of pre-roll to get (default: config setting)
             
@@ -357,11 +391,11 @@ class CameraStream:
         with self._lock:
             # Get the last N frames from buffer
             available_frames = list(self._frame_buffer)
-            
-        if len(available_frames) <= frames_needed:
-            return available_frames
         
-        return available_frames[-frames_needed:]
+        if len(available_frames) > frames_needed:
+            available_frames = available_frames[-frames_needed:]
+        
+        return available_frames
     
     def subscribe(self, callback: Callable[[TimestampedFrame], None]):
         """Subscribe to new frames."""
@@ -408,6 +442,13 @@ class CameraStream:
         _, jpeg = cv2.imencode('.jpg', frame.frame, encode_param)
         return jpeg.tobytes()
     
+    @property
+    def preroll_segmenter(self) -> Optional[PrerollSegmenter]:
+        """Segment ring for audio pre-roll, if enabled and running."""
+        if self._preroll_segmenter and self._preroll_segmenter.is_running:
+            return self._preroll_segmenter
+        return None
+    
     @property
     def is_running(self) -> bool:
         """Check if stream is running."""
@@ -0,0 +1,180 @@
+"""
+Persistent worker pool for short-lived ffmpeg/ffprobe jobs.
+
+Every alert used to spawn several ffmpeg/ffprobe processes directly from the
+backend, paying fork/exec from a large (CUDA-holding) process each time. The
+pool keeps a few lightweight supervisor processes alive that accept
+newline-delimited JSON job specs on stdin, run the command, and reply with a
+JSON result line. The backend process is forked once per worker instead of
+once per job.
+"""
+
+import asyncio
+import json
+import sys
+from dataclasses import dataclass
+from typing import List, Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+# Fragmented MP4: seekable/streamable as written, so no +faststart moov
+# relocation pass over the finished file is needed
+WEB_MP4_MOVFLAGS = '+empty_moov+frag_keyframe+default_base_moof+omit_tfhd_offset'
+
+# Supervisor loop executed by each worker process
+_WORKER_SCRIPT = r"""
+import json, subprocess, sys
+for line in sys.stdin:
+    job = json.loads(line)
+    try:
+        proc = subprocess.run(
+            job["cmd"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE if job.get("capture_stdout") else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        result = {
+            "returncode": proc.returncode,
+            "stdout": proc.stdout.decode(errors="replace") if proc.stdout else "",
+            "stderr": proc.stderr.decode(errors="replace")[-4000:],
+        }
+    except Exception as e:
+        result = {"returncode": -1, "stdout": "", "stderr": str(e)}
+    sys.stdout.write(json.dumps(result) + "\n")
+    sys.stdout.flush()
+"""
+
+
+@dataclass
+class FFmpegResult:
+    """Outcome of a pooled ffmpeg/ffprobe job."""
+    returncode: int
+    stdout: str = ""
+    stderr: str = ""
+
+
+class FFmpegWorkerPool:
+    """
+    Pool of long-running supervisor processes that execute ffmpeg jobs.
+    
+    Workers are started lazily, up to `size`, and respawned if one dies.
+    At most `size` jobs run concurrently; extra callers wait for a worker.
+    """
+    
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._idle: List[asyncio.subprocess.Process] = []
+        self._spawned = 0
+        # Signalled whenever a worker goes idle or a worker slot frees up
+        self._available: Optional[asyncio.Condition] = None
+    
+    def _condition(self) -> asyncio.Condition:
+        if self._available is None:
+            self._available = asyncio.Condition()
+        return self._available
+    
+    async def _spawn_worker(self) -> asyncio.subprocess.Process:
+        return await asyncio.create_subprocess_exec(
+            sys.executable, "-u", "-c", _WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    
+    async def _acquire(self) -> asyncio.subprocess.Process:
+        available = self._condition()
+        async with available:
+            # Re-checked on every wakeup: a dead worker frees a slot instead of
+            # coming back to the idle list
+            while not self._idle and self._spawned >= self.size:
+                await available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._spawned += 1
+        
+        try:
+            return await self._spawn_worker()
+        except BaseException:
+            async with available:
+                self._spawned -= 1
+                available.notify()
+            raise
+    
+    async def warm_up(self):
+        """Spawn all workers up front so the first alert doesn't pay for process startup."""
+        available = self._condition()
+        async with available:
+            while self._spawned < self.size:
+                self._idle.append(await self._spawn_worker())
+                self._spawned += 1
+            available.notify_all()
+    
+    async def close(self):
+        """Stop idle workers (busy workers exit when their stdin closes)."""
+        if self._available is None:
+            return
+        
+        async with self._available:
+            idle, self._idle = self._idle, []
+            self._spawned -= len(idle)
+        
+        for worker in idle:
+            try:
+                worker.stdin.close()
+                await asyncio.wait_for(worker.wait(), timeout=2.0)
+            except (asyncio.TimeoutError, ProcessLookupError):
+                try:
+                    worker.kill()
+                except ProcessLookupError:
+                    pass
+                await worker.wait()
+    
+    async def _release(self, worker: asyncio.subprocess.Process):
+        available = self._condition()
+        async with available:
+            if worker.returncode is None:
+                self._idle.append(worker)
+            else:
+                # Worker died; free its slot so a waiter spawns a replacement
+                self._spawned -= 1
+            available.notify()
+    
+    async def run(self, cmd: List[str], capture_stdout: bool = False) -> FFmpegResult:
+        """
+        Run a command on a pooled worker.
+        
+        Args:
+            cmd: Command line (e.g. ['ffmpeg', '-y', ...])
+            capture_stdout: Return the command's stdout (for ffprobe)
+        
+        Returns:
+            FFmpegResult with the exit code and captured output
+        """
+        worker = await self._acquire()
+        try:
+            job = json.dumps({"cmd": cmd, "capture_stdout": capture_stdout}) + "\n"
+            worker.stdin.write(job.encode())
+            await worker.stdin.drain()
+            
+            line = await worker.stdout.readline()
+            if not line:
+                raise RuntimeError("ffmpeg worker exited unexpectedly")
+            
+            result = json.loads(line)
+            return FFmpegResult(
+                returncode=result["returncode"],
+                stdout=result.get("stdout", ""),
+                stderr=result.get("stderr", ""),
+            )
+        except (asyncio.CancelledError, Exception):
+            # The worker may still be mid-job; don't hand it to another caller
+            try:
+                worker.kill()
+            except ProcessLookupError:
+                pass
+            await worker.wait()
+            raise
+        finally:
+            await self._release(worker)
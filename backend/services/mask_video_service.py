@@ -5,16 +5,19 @@ Processes video recordings with SAM3 inference and overlays detection masks on e
 """
 
 import asyncio
+import concurrent.futures
+import queue
+import threading
 import cv2
 import numpy as np
 from pathlib import Path
 from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
 import structlog
-from PIL import Image
 
 from backend.config import settings
 from backend.services.sam3_service import SAM3Service, Detection
+from backend.services.ffmpeg_pool import WEB_MP4_MOVFLAGS
 
 logger = structlog.get_logger()
 
@@ -39,10 +42,16 @@ class MaskVideoService:
         confidence_threshold: float = 0.5,
         rule_name: str = "Detection",
         progress_callback: Optional[callable] = None,
+        prefetch: int = 4,
     ) -> Optional[str]:
         """
         Generate a mask video from an existing recording.
         
+        Runs as a three-stage pipeline: a reader thread decodes frames ahead,
+        this coroutine runs SAM3 on them in order, and a writer thread draws
+        the overlays and encodes. Decode and encode overlap inference instead
+        of leaving the GPU idle between frames.
+        
         Args:
             video_path: Path to source video
             output_path: Path for output mask video
@@ -51,6 +60,7 @@ class MaskVideoService:
             confidence_threshold: Minimum confidence for detections
             rule_name: Name of the rule for overlay text
             progress_callback: Optional callback(current_frame, total_frames)
+            prefetch: Frames buffered between stages
             
         Returns:
             Path to generated mask video, or None if failed
@@ -99,103 +109,115 @@ class MaskVideoService:
             if secondary_target:
                 prompts.append(secondary_target)
             
-            # Color scheme
-            primary_color = (0, 100, 255)  # Orange-red in BGR
-            secondary_color = (255, 150, 0)  # Blue in BGR
+            loop = asyncio.get_running_loop()
+            # Bounded hand-offs: reader -> inference (this coroutine) -> writer
+            decoded: asyncio.Queue = asyncio.Queue(maxsize=max(1, prefetch))
+            composed: queue.Queue = queue.Queue(maxsize=max(1, prefetch))
+            stop = threading.Event()
+            write_errors: List[BaseException] = []
+            
+            def hand_off(item) -> bool:
+                """Queue an item for inference, giving up if the pipeline is stopping."""
+                future = asyncio.run_coroutine_threadsafe(decoded.put(item), loop)
+                while True:
+                    try:
+                        future.result(timeout=0.5)
+                        return True
+                    except concurrent.futures.TimeoutError:
+                        if stop.is_set():
+                            future.cancel()
+                            return False
+            
+            def read_frames():
+                try:
+                    while not stop.is_set():
+                        ret, frame = cap.read()
+                        if not ret:
+                            break
+                        # SAM3 takes RGB arrays directly
+                        if not hand_off((frame, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))):
+                            return
+                except Exception as e:
+                    logger.error("Mask video decode failed", error=str(e))
+                hand_off(None)
+            
+            def write_frames():
+                while True:
+                    item = composed.get()
+                    if item is None:
+                        return
+                    if write_errors:
+                        # Keep draining so the inference loop never blocks on a dead writer
+                        continue
+                    frame, detections, index = item
+                    try:
+                        writer.write(self._compose_frame(
+                            frame, detections, primary_target, secondary_target,
+                            rule_name, index, total_frames,
+                        ))
+                    except Exception as e:
+                        write_errors.append(e)
+            
+            reader = threading.Thread(target=read_frames, name="mask-video-reader", daemon=True)
+            encoder = threading.Thread(target=write_frames, name="mask-video-writer", daemon=True)
+            reader.start()
+            encoder.start()
             
             frame_count = 0
             start_time = datetime.now()
             
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                frame_count += 1
-                
-                # Convert frame to PIL for SAM3
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                pil_image = Image.fromarray(frame_rgb)
-                
-                # Run SAM3 inference
-                detections = await self.sam3_service.detect_objects(
-                    pil_image,
-                    prompts,
-                    confidence_threshold=confidence_threshold,
-                )
-                
-                # Create overlay
-                overlay = frame.copy()
-                
-                # Draw primary target detections
-                primary_detections = detections.get(primary_target, [])
-                for detection in primary_detections:
-                    self._draw_detection(
-                        overlay, detection, primary_color, height, width
+            try:
+                while True:
+                    item = await decoded.get()
+                    if item is None:
+                        break
+                    frame, frame_rgb = item
+                    frame_count += 1
+                    
+                    # Run SAM3 inference
+                    detections = await self.sam3_service.detect_objects(
+                        frame_rgb,
+                        prompts,
+                        confidence_threshold=confidence_threshold,
                     )
-                
-                # Draw secondary target detections
-                if secondary_target:
-                    secondary_detections = detections.get(secondary_target, [])
-                    for detection in secondary_detections:
-                        self._draw_detection(
-                            overlay, detection, secondary_color, height, width,
-                            label_position="bottom"
-                        )
-                
-                # Blend overlay with original
-                result = cv2.addWeighted(frame, 0.3, overlay, 0.7, 0)
-                
-                # Add header info
-                cv2.putText(
-                    result, f"Rule: {rule_name}", 
-                    (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2
-                )
-                
-                # Add detection counts
-                counts = f"{primary_target}: {len(primary_detections)}"
-                if secondary_target:
-                    secondary_count = len(detections.get(secondary_target, []))
-                    counts += f" | {secondary_target}: {secondary_count}"
-                cv2.putText(
-                    result, counts,
-                    (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1
-                )
-                
-                # Add frame counter and progress
-                progress_text = f"Frame {frame_count}/{total_frames}"
-                cv2.putText(
-                    result, progress_text,
-                    (width - 200, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1
-                )
-                
-                # Write frame
-                writer.write(result)
-                
-                # Progress callback
-                if progress_callback and frame_count % 10 == 0:
+                    
+                    job = (frame, detections, frame_count)
                     try:
-                        progress_callback(frame_count, total_frames)
-                    except:
-                        pass
-                
-                # Log progress periodically
-                if frame_count % 30 == 0:
-                    elapsed = (datetime.now() - start_time).total_seconds()
-                    fps_actual = frame_count / elapsed if elapsed > 0 else 0
-                    eta = (total_frames - frame_count) / fps_actual if fps_actual > 0 else 0
-                    logger.info(
-                        "Mask video progress",
-                        frame=frame_count,
-                        total=total_frames,
-                        percent=f"{100*frame_count/total_frames:.1f}%",
-                        fps=f"{fps_actual:.1f}",
-                        eta_seconds=f"{eta:.0f}",
-                    )
+                        composed.put_nowait(job)
+                    except queue.Full:
+                        await asyncio.to_thread(composed.put, job)
+                    
+                    # Progress callback
+                    if progress_callback and frame_count % 10 == 0:
+                        try:
+                            progress_callback(frame_count, total_frames)
+                        except:
+                            pass
+                    
+                    # Log progress periodically
+                    if frame_count % 30 == 0:
+                        elapsed = (datetime.now() - start_time).total_seconds()
+                        fps_actual = frame_count / elapsed if elapsed > 0 else 0
+                        eta = (total_frames - frame_count) / fps_actual if fps_actual > 0 else 0
+                        logger.info(
+                            "Mask video progress",
+                            frame=frame_count,
+                            total=total_frames,
+                            percent=f"{100*frame_count/total_frames:.1f}%",
+                            fps=f"{fps_actual:.1f}",
+                            eta_seconds=f"{eta:.0f}",
+                        )
+            finally:
+                # Stop the reader, let the writer finish what's queued, then release
+                stop.set()
+                await asyncio.to_thread(composed.put, None)
+                await asyncio.to_thread(encoder.join)
+                await asyncio.to_thread(reader.join)
+                cap.release()
+                writer.release()
             
-            # Release resources
-            cap.release()
-            writer.release()
+            if write_errors:
+                raise write_errors[0]
             
             # Transcode to h264 for web compatibility
             logger.info("Transcoding to h264...")
@@ -222,6 +244,70 @@ class MaskVideoService:
             traceback.print_exc()
             return None
     
+    def _compose_frame(
+        self,
+        frame: np.ndarray,
+        detections: Dict[str, List[Detection]],
+        primary_target: str,
+        secondary_target: Optional[str],
+        rule_name: str,
+        frame_count: int,
+        total_frames: int,
+    ) -> np.ndarray:
+        """Draw detection overlays and header text for one output frame."""
+        height, width = frame.shape[:2]
+        
+        # Color scheme
+        primary_color = (0, 100, 255)  # Orange-red in BGR
+        secondary_color = (255, 150, 0)  # Blue in BGR
+        
+        # Create overlay
+        overlay = frame.copy()
+        
+        # Draw primary target detections
+        primary_detections = detections.get(primary_target, [])
+        for detection in primary_detections:
+            self._draw_detection(
+                overlay, detection, primary_color, height, width
+            )
+        
+        # Draw secondary target detections
+        if secondary_target:
+            secondary_detections = detections.get(secondary_target, [])
+            for detection in secondary_detections:
+                self._draw_detection(
+                    overlay, detection, secondary_color, height, width,
+                    label_position="bottom"
+                )
+        
+        # Blend overlay with original
+        result = cv2.addWeighted(frame, 0.3, overlay, 0.7, 0)
+        
+        # Add header info
+        cv2.putText(
+            result, f"Rule: {rule_name}", 
+            (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2
+        )
+        
+        # Add detection counts
+        counts = f"{primary_target}: {len(primary_detections)}"
+        if secondary_target:
+            secondary_count = len(detections.get(secondary_target, []))
+            counts += f" | {secondary_target}: {secondary_count}"
+        cv2.putText(
+            result, counts,
+            (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1
+        )
+        
+        # Add frame counter and progress
+        progress_text = f"Frame {frame_count}/{total_frames}"
+        cv2.putText(
+            result, progress_text,
+            (width - 200, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1
+        )
+        
+        return result
+    
     def _draw_detection(
         self,
         frame: np.ndarray,
@@ -234,13 +320,13 @@ class MaskVideoService:
         """Draw a detection on the frame with mask, bounding box, and label."""
         
         # Draw mask if available
-        if detection.mask is not None and detection.mask.size > 0:
-            mask = detection.mask
+        mask = detection.mask
+        if mask.size > 0:
             
             # Resize mask to frame size if needed
             if mask.shape[:2] != (frame_height, frame_width):
                 mask = cv2.resize(
-                    mask.astype(np.uint8), 
+                    mask.view(np.uint8), 
                     (frame_width, frame_height), 
                     interpolation=cv2.INTER_NEAREST
                 )
@@ -260,7 +346,7 @@ class MaskVideoService:
                 
                 # Draw mask contours for better visibility
                 contours, _ = cv2.findContours(
-                    mask.astype(np.uint8), 
+                    mask.view(np.uint8), 
                     cv2.RETR_EXTERNAL, 
                     cv2.CHAIN_APPROX_SIMPLE
                 )
@@ -304,7 +390,7 @@ class MaskVideoService:
             '-preset', 'fast',
             '-crf', '23',
             '-c:a', 'copy',
-            '-movflags', '+faststart',
+            '-movflags', WEB_MP4_MOVFLAGS,
             str(output_path),
         ]
         
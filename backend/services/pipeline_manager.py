@@ -70,6 +70,7 @@ class PipelineManager:
     async def start(self):
         """Start the pipeline manager."""
         self._running = True
+        await self.recording_service.start()
         logger.info("Pipeline manager started")
     
     async def stop(self):
@@ -80,6 +81,8 @@ class PipelineManager:
             for pipeline in self._pipelines.values():
                 await self._stop_pipeline(pipeline)
         
+        await self.recording_service.shutdown()
+        self.rule_engine.shutdown()
         logger.info("Pipeline manager stopped")
     
     async def add_camera(self, camera: Camera) -> bool:
@@ -142,7 +145,7 @@ class PipelineManager:
             logger.info("Camera removed from pipeline", camera_id=camera_id)
     
     async def _stop_pipeline(self, pipeline: PipelineState):
-        """Stop a single pipeline."""
+        """Stop a single pipeline, finalizing any recordings it has in progress."""
         pipeline.is_running = False
         
         if pipeline.processing_task:
@@ -152,6 +155,19 @@ class PipelineManager:
             except asyncio.CancelledError:
                 pass
         
+        # End open alerts now so their recordings are saved and their
+        # recording slots returned (no post-roll: the stream is stopping)
+        for alert_id, rule in self.rule_engine.clear_camera_alerts(pipeline.camera_id):
+            await self.rule_engine.fire_alert_end(alert_id, rule)
+        
+        # Recordings whose rule is already gone
+        for alert_id in list(pipeline.active_alerts):
+            recording_id = pipeline.active_alerts.pop(alert_id)
+            try:
+                await self.recording_service.stop_recording(recording_id, post_roll_seconds=0)
+            except Exception as e:
+                logger.error("Failed to stop recording", recording_id=recording_id, error=str(e))
+        
         await pipeline.camera_stream.stop()
     
     async def add_rule(self, rule: Rule):
@@ -166,7 +182,11 @@ class PipelineManager:
     
     async def remove_rule(self, rule_id: str, camera_id: str):
         """Remove a rule from its camera's pipeline."""
-        self.rule_engine.unregister_rule(rule_id)
+        was_in_alert, old_alert_id, old_rule = self.rule_engine.unregister_rule(rule_id)
+        
+        # End an active alert properly so its recording is finalized and saved
+        if was_in_alert and old_alert_id and old_rule:
+            await self.rule_engine.fire_alert_end(old_alert_id, old_rule)
         
         async with self._lock:
             if camera_id in self._pipelines:
@@ -214,10 +234,10 @@ class PipelineManager:
         
         while pipeline.is_running and self._running:
             try:
-                # Get current frame
-                pil_image = pipeline.camera_stream.get_frame_as_pil()
+                # Get current frame (RGB array; SAM3 takes it without a PIL round trip)
+                frame_rgb = pipeline.camera_stream.get_frame_rgb()
                 
-                if pil_image is None:
+                if frame_rgb is None:
                     await asyncio.sleep(0.1)
                     continue
                 
@@ -235,7 +255,7 @@ class PipelineManager:
                 
                 # Run detection (pass camera_id for streaming session)
                 detections = await self.sam3_service.detect_objects(
-                    pil_image,
+                    frame_rgb,
                     list(targets),
                     confidence_threshold=settings.DETECTION_CONFIDENCE_THRESHOLD,
                     camera_id=pipeline.camera_id,
@@ -377,8 +397,10 @@ class PipelineManager:
         
         if recording_id:
             try:
+                # No post-roll once the pipeline is stopping
                 recording_info = await self.recording_service.stop_recording(
-                    recording_id
+                    recording_id,
+                    None if pipeline.is_running else 0,
                 )
                 
                 if recording_info:
@@ -498,11 +520,11 @@ class PipelineManager:
             # Draw primary target masks and bounding boxes
             for detection in primary_detections:
                 # Draw mask if available
-                if detection.mask is not None and detection.mask.size > 0:
-                    mask = detection.mask
+                mask = detection.mask
+                if mask.size > 0:
                     # Resize mask to frame size if needed
                     if mask.shape[:2] != (height, width):
-                        mask = cv2.resize(mask.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
+                        mask = cv2.resize(mask.view(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
                     
                     # Apply colored mask overlay
                     mask_bool = mask > 0
@@ -524,10 +546,10 @@ class PipelineManager:
             # Draw secondary target masks and bounding boxes (if spatial rule)
             for detection in secondary_detections:
                 # Draw mask if available
-                if detection.mask is not None and detection.mask.size > 0:
-                    mask = detection.mask
+                mask = detection.mask
+                if mask.size > 0:
                     if mask.shape[:2] != (height, width):
-                        mask = cv2.resize(mask.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
+                        mask = cv2.resize(mask.view(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
                     
                     mask_bool = mask > 0
                     overlay[mask_bool] = cv2.addWeighted(
@@ -0,0 +1,198 @@
+"""
+Continuous pre-roll capture as already-encoded stream segments.
+
+Runs ffmpeg alongside the camera's decode loop, copying the RTSP stream
+(video and audio, no re-encode) into a small ring of MPEG-TS segments. At
+alert time the recording service snapshots the newest segments instead of
+re-encoding raw pre-roll frames, and the pre-roll keeps the camera's real
+audio.
+
+Stream copy can only cut at keyframes, so a segment lasts at least one
+keyframe interval (GOP) of the camera, often 2-4 seconds, not SEGMENT_SECONDS.
+Segments are therefore selected by the durations ffmpeg reports in its
+segment list, and the pre-roll is rounded up to whole GOPs.
+"""
+
+import asyncio
+import csv
+import math
+import shutil
+from pathlib import Path
+from typing import List, Optional
+
+import structlog
+
+from backend.config import settings
+
+logger = structlog.get_logger()
+
+# Requested segment length; actual segments end at the first keyframe after it
+SEGMENT_SECONDS = 1
+
+# CSV of completed segments (filename,start,end), rewritten by ffmpeg
+SEGMENT_LIST = 'segments.csv'
+
+
+class PrerollSegmenter:
+    """
+    Keeps a rolling window of the last few seconds of a camera's RTSP stream on disk.
+    """
+    
+    def __init__(self, camera_id: str, rtsp_url: str):
+        self.camera_id = camera_id
+        self.rtsp_url = rtsp_url
+        self.segment_dir = settings.RECORDINGS_PATH / ".preroll" / camera_id
+        # Segments are never shorter than SEGMENT_SECONDS on a regular GOP, so
+        # this many completed segments span at least the pre-roll (longer GOPs
+        # only make the ring span more time)
+        self.list_size = math.ceil(settings.RECORDING_PRE_ROLL_SECONDS / SEGMENT_SECONDS) + 2
+        # Plus the segment being written and slack so ffmpeg never rewrites a
+        # listed file while a snapshot copies it
+        self.segment_count = self.list_size + 3
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._monitor_task: Optional[asyncio.Task] = None
+        self._running = False
+    
+    @property
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.returncode is None
+    
+    async def start(self):
+        """Start the segmenting ffmpeg process (restarted automatically if it exits)."""
+        if self._running:
+            return
+        self._running = True
+        self._monitor_task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop segmenting and remove the segment ring."""
+        self._running = False
+        
+        if self._process and self._process.returncode is None:
+            self._process.terminate()
+            try:
+                await asyncio.wait_for(self._process.wait(), timeout=5.0)
+            except asyncio.TimeoutError:
+                self._process.kill()
+                await self._process.wait()
+        
+        if self._monitor_task:
+            self._monitor_task.cancel()
+            try:
+                await self._monitor_task
+            except asyncio.CancelledError:
+                pass
+            self._monitor_task = None
+        
+        await asyncio.to_thread(shutil.rmtree, self.segment_dir, ignore_errors=True)
+    
+    def _reset_segment_dir(self):
+        shutil.rmtree(self.segment_dir, ignore_errors=True)
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+    
+    async def _run(self):
+        """Run ffmpeg, restarting it with a delay if the stream drops."""
+        cmd = [
+            'ffmpeg', '-y',
+            '-loglevel', 'error',
+            '-rtsp_transport', 'tcp',
+            '-i', self.rtsp_url,
+            '-map', '0:v', '-map', '0:a?',
+            '-c', 'copy',
+            '-f', 'segment',
+            '-segment_time', str(SEGMENT_SECONDS),
+            '-segment_wrap', str(self.segment_count),
+            '-segment_list', str(self.segment_dir / SEGMENT_LIST),
+            '-segment_list_type', 'csv',
+            '-segment_list_size', str(self.list_size),
+            '-segment_format', 'mpegts',
+            '-reset_timestamps', '1',
+            str(self.segment_dir / 'preroll_%03d.ts'),
+        ]
+        
+        while self._running:
+            try:
+                # Start from an empty ring so no stale segment is mistaken for a new one
+                await asyncio.to_thread(self._reset_segment_dir)
+                self._process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+                logger.info("Pre-roll segmenter started", camera_id=self.camera_id)
+                await self._process.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Pre-roll segmenter failed", camera_id=self.camera_id, error=str(e))
+            
+            if self._running:
+                logger.warning("Pre-roll segmenter exited, restarting", camera_id=self.camera_id)
+                await asyncio.sleep(5.0)
+    
+    def _completed_segments(self) -> List[tuple]:
+        """(path, duration) of the listed completed segments, oldest first."""
+        try:
+            with open(self.segment_dir / SEGMENT_LIST, newline='') as f:
+                rows = list(csv.reader(f))
+        except FileNotFoundError:
+            return []
+        
+        segments = []
+        for row in rows:
+            try:
+                filename, start, end = row[:3]
+                segments.append((self.segment_dir / filename, float(end) - float(start)))
+            except ValueError:
+                continue
+        return segments
+    
+    def snapshot(self, seconds: float, dest_dir: Path) -> List[Path]:
+        """
+        Copy the newest segments covering `seconds` into dest_dir (blocking).
+        
+        Segments are copied so the ring can keep wrapping while the
+        recording is in progress.
+        
+        Returns:
+            Copied segment paths, oldest first (empty if none are available)
+        """
+        if not self.is_running:
+            return []
+        
+        completed = self._completed_segments()
+        if not completed:
+            return []
+        
+        # Newest completed segments until their durations cover the pre-roll
+        wanted = []
+        covered = 0.0
+        for path, duration in reversed(completed):
+            if covered >= seconds:
+                break
+            wanted.insert(0, path)
+            covered += duration
+        
+        # The segment being written follows the newest listed one in the ring
+        try:
+            newest_index = int(completed[-1][0].stem.rsplit('_', 1)[1])
+            in_progress = self.segment_dir / f"preroll_{(newest_index + 1) % self.segment_count:03d}.ts"
+            if in_progress.exists() and in_progress.stat().st_size > 0:
+                wanted.append(in_progress)
+        except (ValueError, IndexError, FileNotFoundError):
+            pass
+        
+        if covered < seconds:
+            logger.debug("Segment ring shorter than requested pre-roll", camera_id=self.camera_id, covered=covered)
+        
+        copies = []
+        for i, segment in enumerate(wanted):
+            dest = dest_dir / f"preroll_{i:03d}.ts"
+            try:
+                shutil.copyfile(segment, dest)
+                copies.append(dest)
+            except FileNotFoundError:
+                # Removed between listing and copying (segmenter restart)
+                continue
+        return copies
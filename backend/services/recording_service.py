@@ -2,29 +2,139 @@
 Recording service for capturing alert videos with pre-roll.
 
 Supports two recording modes:
-1. Video-only (cv2.VideoWriter) - when audio is disabled
+1. Video-only (PyAV H.264 writer) - when audio is disabled
 2. Video+Audio (FFmpeg) - when audio is enabled, records directly from RTSP
 """
 
 import asyncio
 import os
+import queue
+import shutil
 import subprocess
 import signal
+import tempfile
+import threading
+import time
 from dataclasses import dataclass, field
 from datetime import datetime
+from fractions import Fraction
 from pathlib import Path
-from typing import Optional, List, Union
+from typing import Iterable, Iterator, Optional, List, Union
 import uuid
 import structlog
+import av
 import cv2
 import numpy as np
 
 from backend.config import settings
 from backend.services.camera_stream import CameraStream, TimestampedFrame
+from backend.services.ffmpeg_pool import FFmpegWorkerPool, WEB_MP4_MOVFLAGS
+from backend.services.preroll_segmenter import PrerollSegmenter
 from backend.utils import to_utc_isoformat
 
 logger = structlog.get_logger()
 
+# Hardware H.264 encoders, in order of preference
+HW_H264_ENCODERS = ('h264_nvenc', 'h264_qsv', 'h264_vaapi', 'h264_amf')
+
+
+def output_size(width: int, height: int) -> Optional[tuple]:
+    """
+    Encoded size for a camera resolution, or None to encode at native size.
+    
+    Frames wider than RECORDING_OUTPUT_WIDTH are scaled down (keeping the
+    aspect ratio, even dimensions for yuv420p) so 4K cameras don't pay 4x
+    the encode cost and bitrate for a web recording.
+    """
+    max_width = settings.RECORDING_OUTPUT_WIDTH
+    if max_width <= 0 or width <= max_width:
+        return None
+    out_w = max_width - max_width % 2
+    out_h = max(2, round(height * out_w / width / 2) * 2)
+    return out_w, out_h
+
+
+class H264Writer:
+    """
+    Encodes BGR frames straight to a web-ready (fragmented) H.264 MP4 using PyAV.
+    
+    Runs libavcodec in-process, so no mp4v intermediate file or transcode
+    subprocess is needed. Mirrors the cv2.VideoWriter interface used here
+    (write / release / isOpened).
+    """
+    
+    def __init__(self, filepath: Path, fps: int, width: int, height: int):
+        self._container = av.open(str(filepath), mode='w', options={'movflags': WEB_MP4_MOVFLAGS})
+        self._stream = self._container.add_stream('libx264', rate=fps)
+        self._stream.width = width
+        self._stream.height = height
+        self._stream.pix_fmt = 'yuv420p'
+        self._stream.options = {'preset': 'faster', 'crf': '23'}
+        self._frame_index = 0
+        self._closed = False
+        # I420 needs even dimensions; otherwise let libswscale convert
+        self._use_i420 = width % 2 == 0 and height % 2 == 0
+        self._yuv: Optional[np.ndarray] = None
+        self._yuv_frame: Optional[av.VideoFrame] = None
+        if self._use_i420:
+            # Reused for every frame: cvtColor writes into _yuv and the bytes
+            # are copied into _yuv_frame's planes through memoryviews, so the
+            # write path allocates neither an ndarray nor a VideoFrame
+            self._yuv = np.empty((height * 3 // 2, width), dtype=np.uint8)
+            yuv_frame = av.VideoFrame(width, height, 'yuv420p')
+            # Plane-wise updates need unpadded planes
+            if all(plane.line_size == plane.width for plane in yuv_frame.planes):
+                self._yuv_frame = yuv_frame
+    
+    def isOpened(self) -> bool:
+        return not self._closed
+    
+    def write(self, frame: np.ndarray):
+        self._container.mux(self._encode(frame))
+    
+    def write_batch(self, frames: Iterable[np.ndarray]):
+        """Encode several frames, muxing all resulting packets in one call."""
+        packets = []
+        for frame in frames:
+            packets.extend(self._encode(frame))
+        self._container.mux(packets)
+    
+    def _encode(self, frame: np.ndarray) -> list:
+        if self._use_i420 and frame.shape[1] == self._stream.width and frame.shape[0] == self._stream.height:
+            # OpenCV's SIMD BGR->I420 is much cheaper than the encoder-side
+            # swscale conversion, and hands libx264 its native input format
+            cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420, dst=self._yuv)
+            if self._yuv_frame is not None:
+                video_frame = self._fill_yuv_frame()
+            else:
+                video_frame = av.VideoFrame.from_ndarray(self._yuv, format='yuv420p')
+        else:
+            video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+        video_frame.pts = self._frame_index
+        self._frame_index += 1
+        return self._stream.encode(video_frame)
+    
+    def _fill_yuv_frame(self) -> av.VideoFrame:
+        # The encoder copies non-refcounted frames on submit, so reuse is safe
+        data = memoryview(self._yuv).cast('B')
+        luma = self._stream.width * self._stream.height
+        chroma = luma // 4
+        y_plane, u_plane, v_plane = self._yuv_frame.planes
+        y_plane.update(data[:luma])
+        u_plane.update(data[luma:luma + chroma])
+        v_plane.update(data[luma + chroma:])
+        return self._yuv_frame
+    
+    def release(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            # Flush buffered frames out of the encoder
+            self._container.mux(self._stream.encode(None))
+        finally:
+            self._container.close()
+
 
 @dataclass
 class ActiveRecording:
@@ -34,14 +144,31 @@ class ActiveRecording:
     alert_id: str
     filepath: Path
     started_at: datetime
-    writer: Optional[cv2.VideoWriter] = None
+    writer: Optional[Union[H264Writer, cv2.VideoWriter]] = None
     ffmpeg_process: Optional[asyncio.subprocess.Process] = None
     pre_roll_filepath: Optional[Path] = None  # Temp file for pre-roll frames
     main_filepath: Optional[Path] = None  # Main recording with audio
+    temp_dir: Optional[Path] = None  # Holds all intermediate files of an audio recording
+    pre_roll_from_segments: bool = False  # pre_roll_filepath is a concat list of stream segments
     rtsp_url: Optional[str] = None
     frame_count: int = 0
     pre_roll_written: bool = False
     use_audio: bool = False
+    needs_transcode: bool = False  # Written as mp4v by the OpenCV fallback writer
+    thumbnail_path: Optional[Path] = None  # Set when produced as part of finalization
+    frame_queue: Optional[queue.Queue] = None  # Live frames waiting for the writer thread
+    writer_thread: Optional[threading.Thread] = None
+    stopped: bool = False  # Set once stopping begins; checked by the frame callback
+    dropped_frames: int = 0  # Live frames discarded because the writer fell behind
+    stop_requested: bool = False  # Claimed by the first stop_recording call (post-roll may still be running)
+    slot_released: bool = False  # The recording's concurrency slot has been returned
+    thumbnail_dims: Optional[tuple] = None  # (width, height) precomputed for the camera
+    output_size: Optional[tuple] = None  # (width, height) frames are downscaled to, None = native
+    started_monotonic: float = field(default_factory=time.monotonic)
+    deadline_monotonic: float = field(init=False)  # Max-duration cutoff on the monotonic clock
+    
+    def __post_init__(self):
+        self.deadline_monotonic = self.started_monotonic + settings.RECORDING_MAX_DURATION_SECONDS
 
 
 class RecordingService:
@@ -59,6 +186,27 @@ class RecordingService:
     def __init__(self):
         self._active_recordings: dict[str, ActiveRecording] = {}
         self._lock = asyncio.Lock()
+        # Warm workers for the short-lived ffmpeg/ffprobe jobs around each recording
+        self._ffmpeg_pool = FFmpegWorkerPool(settings.RECORDING_WORKERS)
+        # Each active recording holds a slot until it is fully finalized
+        self._recording_slots = asyncio.Semaphore(settings.RECORDING_MAX_CONCURRENT)
+        # H.264 encoder for transcodes, resolved on first use
+        self._encoder: Optional[str] = None
+        # Whether OpenCV's writer can encode H.264 itself (None = not yet tried)
+        self._cv2_h264: Optional[bool] = None
+    
+    async def start(self):
+        """Warm up the ffmpeg workers and resolve the transcode encoder before the first alert."""
+        try:
+            await self._ffmpeg_pool.warm_up()
+            await self._get_encoder()
+        except Exception as e:
+            # Workers are spawned lazily again on first use
+            logger.warning("Failed to warm up ffmpeg workers", error=str(e))
+    
+    async def shutdown(self):
+        """Stop the persistent ffmpeg workers."""
+        await self._ffmpeg_pool.close()
     
     async def start_recording(
         self,
@@ -75,7 +223,7 @@ class RecordingService:
         3. At stop, files are concatenated
         
         When audio is disabled:
-        - Uses cv2.VideoWriter (original behavior)
+        - Encodes camera frames in-process (H.264 via PyAV)
         
         Args:
             camera_stream: The camera stream to record from
@@ -84,10 +232,42 @@ class RecordingService:
             
         Returns:
             Recording ID
+            
+        Raises:
+            RuntimeError: If no recording slot frees up within the pre-roll window
         """
         if pre_roll_seconds is None:
             pre_roll_seconds = settings.RECORDING_PRE_ROLL_SECONDS
         
+        # Back-pressure: queue behind other recordings, but give up once the
+        # wait would outlast the pre-roll we're trying to capture
+        try:
+            await asyncio.wait_for(
+                self._recording_slots.acquire(),
+                timeout=max(pre_roll_seconds, 1),
+            )
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Too many concurrent recordings, skipping",
+                camera_id=camera_stream.camera_id,
+                alert_id=alert_id,
+                max_concurrent=settings.RECORDING_MAX_CONCURRENT,
+            )
+            raise RuntimeError("Too many concurrent recordings")
+        
+        try:
+            return await self._start_recording(camera_stream, alert_id, pre_roll_seconds)
+        except BaseException:
+            self._recording_slots.release()
+            raise
+    
+    async def _start_recording(
+        self,
+        camera_stream: CameraStream,
+        alert_id: str,
+        pre_roll_seconds: float,
+    ) -> str:
+        """Start a recording once a recording slot has been acquired."""
         recording_id = str(uuid.uuid4())
         timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         filename = f"{camera_stream.camera_id}_{timestamp}_{recording_id[:8]}.mp4"
@@ -103,17 +283,27 @@ class RecordingService:
             audio_enabled=use_audio,
         )
         
+        # Audio recordings take their pre-roll from the segment ring when available
+        preroll_segmenter = camera_stream.preroll_segmenter if use_audio else None
+        
         # Get pre-roll frames
-        pre_roll_frames = camera_stream.get_pre_roll_frames(pre_roll_seconds)
-        logger.info(f"Got {len(pre_roll_frames)} pre-roll frames")
+        if preroll_segmenter:
+            pre_roll_frames = []
+        else:
+            pre_roll_frames = camera_stream.get_pre_roll_frames(pre_roll_seconds)
+            logger.info(f"Got {len(pre_roll_frames)} pre-roll frames")
         
-        # Determine video dimensions from first frame
+        # Determine video dimensions from first frame; the thumbnail comes from
+        # the frame ~1 second into the recording (or the live frame)
+        thumbnail_source = None
         if pre_roll_frames:
             height, width = pre_roll_frames[0].frame.shape[:2]
+            thumbnail_source = pre_roll_frames[min(camera_stream.fps, len(pre_roll_frames) - 1)].frame
         else:
             current = camera_stream.get_current_frame()
             if current:
                 height, width = current.frame.shape[:2]
+                thumbnail_source = current.frame
             else:
                 width, height = camera_stream.width, camera_stream.height
         
@@ -128,9 +318,12 @@ class RecordingService:
                 pre_roll_frames=pre_roll_frames,
                 width=width,
                 height=height,
+                preroll_segmenter=preroll_segmenter,
+                pre_roll_seconds=pre_roll_seconds,
+                scaled_size=output_size(width, height),
             )
         else:
-            # Video-only mode: Use cv2.VideoWriter
+            # Video-only mode: Encode camera frames in-process
             recording = await self._start_video_only_recording(
                 recording_id=recording_id,
                 camera_stream=camera_stream,
@@ -139,8 +332,19 @@ class RecordingService:
                 pre_roll_frames=pre_roll_frames,
                 width=width,
                 height=height,
+                scaled_size=output_size(width, height),
             )
         
+        recording.thumbnail_dims = camera_stream.thumbnail_dims
+        
+        # Thumbnail straight from memory, so stopping needs no decode pass
+        if thumbnail_source is not None:
+            thumbnail_path = filepath.with_suffix('.webp')
+            if await asyncio.to_thread(
+                self._write_thumbnail, thumbnail_source, thumbnail_path, recording.thumbnail_dims,
+            ):
+                recording.thumbnail_path = thumbnail_path
+        
         async with self._lock:
             self._active_recordings[recording_id] = recording
         
@@ -156,56 +360,47 @@ class RecordingService:
         pre_roll_frames: List[TimestampedFrame],
         width: int,
         height: int,
+        preroll_segmenter: Optional[PrerollSegmenter] = None,
+        pre_roll_seconds: float = 0,
+        scaled_size: Optional[tuple] = None,
     ) -> ActiveRecording:
         """Start recording with audio using FFmpeg."""
+        out_width, out_height = scaled_size or (width, height)
         
-        # File paths for temp files
-        pre_roll_filepath = filepath.with_stem(filepath.stem + "_preroll")
-        main_filepath = filepath.with_stem(filepath.stem + "_main")
+        # All intermediate files live in one directory that is removed in a
+        # single rmtree once the final file has been moved into place
+        temp_dir = Path(await asyncio.to_thread(
+            tempfile.mkdtemp, prefix=f".{filepath.stem}_", dir=settings.RECORDINGS_PATH,
+        ))
+        pre_roll_filepath = temp_dir / "preroll.mp4"
+        main_filepath = temp_dir / "main.mp4"
         
-        # Write pre-roll frames to temp video (silent)
-        if pre_roll_frames:
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            pre_roll_writer = cv2.VideoWriter(
-                str(pre_roll_filepath),
-                fourcc,
-                settings.RECORDING_FPS,
-                (width, height),
-            )
-            
-            if not pre_roll_writer.isOpened():
-                logger.error("Failed to create pre-roll video writer")
-                raise RuntimeError(f"Failed to create pre-roll video writer: {pre_roll_filepath}")
+        pre_roll_from_segments = False
+        
+        if preroll_segmenter:
+            # Stream-copied segments already hold the pre-roll (with audio);
+            # snapshot them and list them for the concat demuxer
+            segments = await asyncio.to_thread(preroll_segmenter.snapshot, pre_roll_seconds, temp_dir)
+            if segments:
+                pre_roll_filepath = temp_dir / "preroll.txt"
+                await asyncio.to_thread(
+                    pre_roll_filepath.write_text,
+                    ''.join(f"file '{segment}'\n" for segment in segments),
+                )
+                pre_roll_from_segments = True
+                logger.info(f"Using {len(segments)} pre-roll segments", camera_id=camera_id)
+        
+        # Write pre-roll frames to temp video (silent). The concat step needs
+        # H.264, so transcode only if we had to fall back to mp4v.
+        elif pre_roll_frames:
+            pre_roll_writer, needs_transcode = self._open_writer(pre_roll_filepath, out_width, out_height)
             
-            for frame in pre_roll_frames:
-                pre_roll_writer.write(frame.frame)
+            await asyncio.to_thread(self._write_pre_roll, pre_roll_writer, pre_roll_frames, scaled_size)
             
-            pre_roll_writer.release()
+            await asyncio.to_thread(pre_roll_writer.release)
             
-            # Transcode pre-roll to H.264 for proper concatenation
-            pre_roll_h264 = pre_roll_filepath.with_stem(pre_roll_filepath.stem + "_h264")
-            transcode_cmd = [
-                'ffmpeg', '-y',
-                '-i', str(pre_roll_filepath),
-                '-c:v', 'libx264',
-                '-preset', 'ultrafast',
-                '-crf', '23',
-                '-an',  # No audio for pre-roll
-                str(pre_roll_h264),
-            ]
-            
-            process = await asyncio.create_subprocess_exec(
-                *transcode_cmd,
-                stdout=asyncio.subprocess.DEVNULL,
-                stderr=asyncio.subprocess.PIPE,
-            )
-            _, stderr = await process.communicate()
-            
-            if process.returncode == 0:
-                os.remove(pre_roll_filepath)
-                os.rename(pre_roll_h264, pre_roll_filepath)
-            else:
-                logger.warning("Pre-roll transcode failed", stderr=stderr.decode()[:500])
+            if needs_transcode:
+                await self._transcode_pre_roll(pre_roll_filepath)
             
             logger.info(f"Wrote {len(pre_roll_frames)} pre-roll frames to {pre_roll_filepath}")
         
@@ -214,12 +409,13 @@ class RecordingService:
             'ffmpeg', '-y',
             '-rtsp_transport', 'tcp',
             '-i', rtsp_url,
+            *(['-vf', f'scale={out_width}:{out_height}'] if scaled_size else []),
             '-c:v', 'libx264',
             '-preset', 'ultrafast',
             '-crf', '23',
             '-c:a', 'aac',  # Audio codec
             '-b:a', '128k',  # Audio bitrate
-            '-movflags', '+faststart',
+            '-movflags', WEB_MP4_MOVFLAGS,
             '-t', str(settings.RECORDING_MAX_DURATION_SECONDS),
             str(main_filepath),
         ]
@@ -239,12 +435,15 @@ class RecordingService:
             filepath=filepath,
             started_at=datetime.utcnow(),
             ffmpeg_process=ffmpeg_process,
-            pre_roll_filepath=pre_roll_filepath if pre_roll_frames else None,
+            pre_roll_filepath=pre_roll_filepath if (pre_roll_frames or pre_roll_from_segments) else None,
             main_filepath=main_filepath,
+            temp_dir=temp_dir,
+            pre_roll_from_segments=pre_roll_from_segments,
             rtsp_url=rtsp_url,
             frame_count=len(pre_roll_frames),
             pre_roll_written=True,
             use_audio=True,
+            output_size=scaled_size,
         )
         
         return recording
@@ -258,21 +457,11 @@ class RecordingService:
         pre_roll_frames: List[TimestampedFrame],
         width: int,
         height: int,
+        scaled_size: Optional[tuple] = None,
     ) -> ActiveRecording:
-        """Start video-only recording using cv2.VideoWriter."""
+        """Start video-only recording, encoding H.264 directly when possible."""
         
-        # Create video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        writer = cv2.VideoWriter(
-            str(filepath),
-            fourcc,
-            settings.RECORDING_FPS,
-            (width, height),
-        )
-        
-        if not writer.isOpened():
-            logger.error("Failed to create video writer", filepath=str(filepath))
-            raise RuntimeError(f"Failed to create video writer: {filepath}")
+        writer, needs_transcode = self._open_writer(filepath, *(scaled_size or (width, height)))
         
         recording = ActiveRecording(
             recording_id=recording_id,
@@ -282,18 +471,32 @@ class RecordingService:
             started_at=datetime.utcnow(),
             writer=writer,
             use_audio=False,
+            needs_transcode=needs_transcode,
+            output_size=scaled_size,
         )
         
         # Write pre-roll frames
-        for frame in pre_roll_frames:
-            writer.write(frame.frame)
-            recording.frame_count += 1
+        recording.frame_count += await asyncio.to_thread(
+            self._write_pre_roll, writer, pre_roll_frames, scaled_size,
+        )
         
         recording.pre_roll_written = True
         
-        # Subscribe to new frames
-        def frame_callback(frame: TimestampedFrame):
-            self._write_frame(recording_id, frame)
+        # Encode live frames on a dedicated thread so a slow encoder or disk
+        # never blocks the camera's read loop
+        recording.frame_queue = queue.Queue(maxsize=settings.RECORDING_QUEUE_MAX)
+        recording.writer_thread = threading.Thread(
+            target=self._writer_loop,
+            args=(recording,),
+            daemon=True,
+            name=f"recording-{recording_id[:8]}",
+        )
+        recording.writer_thread.start()
+        
+        # Subscribe to new frames (the callback holds the recording itself so
+        # the per-frame path never goes through _active_recordings)
+        def frame_callback(frame: TimestampedFrame, _rec: ActiveRecording = recording):
+            self._write_frame_direct(_rec, frame)
         
         camera_stream.subscribe(frame_callback)
         
@@ -303,33 +506,177 @@ class RecordingService:
         
         return recording
     
-    def _write_frame(self, recording_id: str, frame: TimestampedFrame):
-        """Write a frame to the recording (called from camera thread). Only for video-only mode."""
-        if recording_id not in self._active_recordings:
-            return
+    def _open_writer(self, filepath: Path, width: int, height: int) -> tuple:
+        """
+        Open a video writer for raw frames.
         
-        recording = self._active_recordings[recording_id]
+        Prefers the in-process H.264 writer, then OpenCV's own H.264 (avc1)
+        writer; only falls back to mp4v (which needs a later transcode) if
+        neither can encode H.264.
         
-        # Audio recordings use FFmpeg, not frame callbacks
-        if recording.use_audio:
-            return
+        Returns:
+            (writer, needs_transcode)
+        """
+        try:
+            return H264Writer(filepath, settings.RECORDING_FPS, width, height), False
+        except Exception as e:
+            logger.warning("H.264 writer unavailable, falling back to OpenCV", error=str(e))
         
-        # Check max duration
-        elapsed = (datetime.utcnow() - recording.started_at).total_seconds()
-        if elapsed > settings.RECORDING_MAX_DURATION_SECONDS:
-            logger.warning(
-                "Recording max duration reached",
-                recording_id=recording_id,
-                elapsed=elapsed,
+        if self._cv2_h264 is not False:
+            writer = cv2.VideoWriter(
+                str(filepath),
+                cv2.VideoWriter_fourcc(*'avc1'),
+                settings.RECORDING_FPS,
+                (width, height),
             )
+            # Remember the outcome so unsupported builds don't retry every recording
+            self._cv2_h264 = writer.isOpened()
+            if self._cv2_h264:
+                return writer, False
+            writer.release()
+            logger.warning("OpenCV has no H.264 encoder, falling back to mp4v")
+        
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        writer = cv2.VideoWriter(
+            str(filepath),
+            fourcc,
+            settings.RECORDING_FPS,
+            (width, height),
+        )
+        
+        if not writer.isOpened():
+            logger.error("Failed to create video writer", filepath=str(filepath))
+            raise RuntimeError(f"Failed to create video writer: {filepath}")
+        
+        return writer, True
+    
+    async def _transcode_pre_roll(self, pre_roll_filepath: Path):
+        """Transcode an mp4v pre-roll file to H.264 in place for concatenation."""
+        pre_roll_h264 = pre_roll_filepath.with_stem(pre_roll_filepath.stem + "_h264")
+        transcode_cmd = [
+            'ffmpeg', '-y',
+            '-i', str(pre_roll_filepath),
+            '-c:v', 'libx264',
+            '-preset', 'ultrafast',
+            '-crf', '23',
+            '-an',  # No audio for pre-roll
+            str(pre_roll_h264),
+        ]
+        
+        result = await self._ffmpeg_pool.run(transcode_cmd)
+        
+        if result.returncode == 0:
+            await asyncio.to_thread(os.replace, pre_roll_h264, pre_roll_filepath)
+        else:
+            logger.warning("Pre-roll transcode failed", stderr=result.stderr[:500])
+    
+    @staticmethod
+    def _write_pre_roll(
+        writer,
+        pre_roll_frames: List[TimestampedFrame],
+        scaled_size: Optional[tuple] = None,
+    ) -> int:
+        """
+        Encode pre-roll frames back to back (run in a worker thread).
+        
+        Keeps the event loop free while a few seconds of video are encoded.
+        
+        Returns:
+            Number of frames written
+        """
+        frames = RecordingService._scaled_frames(
+            (frame.frame for frame in pre_roll_frames), scaled_size,
+        )
+        if isinstance(writer, H264Writer):
+            writer.write_batch(frames)
+        else:
+            for frame in frames:
+                writer.write(frame)
+        return len(pre_roll_frames)
+    
+    @staticmethod
+    def _scaled_frames(frames: Iterable[np.ndarray], scaled_size: Optional[tuple]) -> Iterator[np.ndarray]:
+        """
+        Yield frames downscaled to scaled_size (or unchanged if None).
+        
+        Every scaled frame is written into the same buffer, so each one must
+        be consumed (encoded) before the next is requested.
+        """
+        if scaled_size is None:
+            yield from frames
             return
         
-        try:
-            if recording.writer:
-                recording.writer.write(frame.frame)
-                recording.frame_count += 1
-        except Exception as e:
-            logger.error("Error writing frame", recording_id=recording_id, error=str(e))
+        out_w, out_h = scaled_size
+        buf = None
+        for frame in frames:
+            if buf is None:
+                buf = np.empty((out_h, out_w) + frame.shape[2:], dtype=frame.dtype)
+            # INTER_AREA is OpenCV's SIMD path for downscaling and avoids aliasing
+            yield cv2.resize(frame, (out_w, out_h), dst=buf, interpolation=cv2.INTER_AREA)
+    
+    def _write_frame_direct(self, recording: ActiveRecording, frame: TimestampedFrame):
+        """Queue a frame for the recording's writer thread (called from camera thread). Only for video-only mode."""
+        # Audio recordings use FFmpeg, not frame callbacks
+        if recording.stopped or recording.use_audio or recording.frame_queue is None:
+            return
+        
+        if self._enqueue_frame(recording.frame_queue, frame):
+            recording.dropped_frames += 1
+    
+    @staticmethod
+    def _enqueue_frame(frame_queue: queue.Queue, item) -> bool:
+        """
+        Put an item on a bounded queue, dropping the oldest entry if it is full.
+        
+        Returns:
+            True if an entry had to be dropped
+        """
+        dropped = False
+        while True:
+            try:
+                frame_queue.put_nowait(item)
+                return dropped
+            except queue.Full:
+                try:
+                    frame_queue.get_nowait()
+                    dropped = True
+                except queue.Empty:
+                    pass
+    
+    def _writer_loop(self, recording: ActiveRecording):
+        """Drain the recording's frame queue into its writer until the stop sentinel arrives."""
+        max_duration_reached = False
+        scaled = None
+        if recording.output_size:
+            out_w, out_h = recording.output_size
+            scaled = np.empty((out_h, out_w, 3), dtype=np.uint8)
+        while True:
+            frame = recording.frame_queue.get()
+            if frame is None:
+                break
+            
+            if max_duration_reached:
+                continue
+            
+            # Check max duration
+            if time.monotonic() > recording.deadline_monotonic:
+                logger.warning(
+                    "Recording max duration reached",
+                    recording_id=recording.recording_id,
+                    elapsed=time.monotonic() - recording.started_monotonic,
+                )
+                max_duration_reached = True
+                continue
+            
+            try:
+                if recording.writer:
+                    image = frame.frame
+                    if scaled is not None:
+                        image = cv2.resize(image, recording.output_size, dst=scaled, interpolation=cv2.INTER_AREA)
+                    recording.writer.write(image)
+                    recording.frame_count += 1
+            except Exception as e:
+                logger.error("Error writing frame", recording_id=recording.recording_id, error=str(e))
     
     async def stop_recording(
         self,
@@ -354,70 +701,94 @@ class RecordingService:
         if post_roll_seconds is None:
             post_roll_seconds = settings.RECORDING_POST_ROLL_SECONDS
         
-        async with self._lock:
-            if recording_id not in self._active_recordings:
-                logger.warning("Recording not found", recording_id=recording_id)
-                return None
-            
-            recording = self._active_recordings[recording_id]
+        recording = self._active_recordings.get(recording_id)
+        if recording is None:
+            logger.warning("Recording not found", recording_id=recording_id)
+            return None
+        # The recording stays registered through the post-roll, so claim it
+        # before the first await; a second stop for the same id is a no-op
+        if recording.stop_requested:
+            logger.warning("Recording already stopping", recording_id=recording_id)
+            return None
+        recording.stop_requested = True
         
-        # Wait for post-roll
-        if post_roll_seconds > 0:
+        try:
+            # Wait for post-roll
+            if post_roll_seconds > 0:
+                logger.info(
+                    "Recording post-roll",
+                    recording_id=recording_id,
+                    seconds=post_roll_seconds,
+                )
+                await asyncio.sleep(post_roll_seconds)
+            
+            if recording.use_audio:
+                # Stop FFmpeg and finalize audio recording
+                await self._stop_audio_recording(recording)
+            else:
+                # Stop video-only recording
+                await self._stop_video_only_recording(recording)
+            
+            ended_at = datetime.utcnow()
+            duration = (ended_at - recording.started_at).total_seconds()
+            
+            async with self._lock:
+                self._active_recordings.pop(recording_id, None)
+            
+            # Get file size
+            file_size = await asyncio.to_thread(self._file_size, recording.filepath)
+            
+            # Generate thumbnail (unless finalization already produced one)
+            thumbnail_path = recording.thumbnail_path or await self._generate_thumbnail(
+                recording.filepath, recording.thumbnail_dims,
+            )
+            
+            # Transcode to web-compatible format (only needed for the mp4v fallback writer)
+            if recording.needs_transcode:
+                web_filepath = await self._transcode_for_web(recording.filepath)
+            else:
+                web_filepath = recording.filepath  # Already in good format
+            
             logger.info(
-                "Recording post-roll",
+                "Recording stopped",
                 recording_id=recording_id,
-                seconds=post_roll_seconds,
+                duration=duration,
+                frames=recording.frame_count,
+                file_size=file_size,
+                audio_enabled=recording.use_audio,
             )
-            await asyncio.sleep(post_roll_seconds)
-        
-        if recording.use_audio:
-            # Stop FFmpeg and finalize audio recording
-            await self._stop_audio_recording(recording)
-        else:
-            # Stop video-only recording
-            await self._stop_video_only_recording(recording)
-        
-        ended_at = datetime.utcnow()
-        duration = (ended_at - recording.started_at).total_seconds()
-        
-        async with self._lock:
-            del self._active_recordings[recording_id]
-        
-        # Get file size
-        file_size = recording.filepath.stat().st_size if recording.filepath.exists() else 0
-        
-        # Generate thumbnail
-        thumbnail_path = await self._generate_thumbnail(recording.filepath)
-        
-        # Transcode to web-compatible format (only for video-only recordings)
-        if not recording.use_audio:
-            web_filepath = await self._transcode_for_web(recording.filepath)
-        else:
-            web_filepath = recording.filepath  # Already in good format
-        
-        logger.info(
-            "Recording stopped",
-            recording_id=recording_id,
-            duration=duration,
-            frames=recording.frame_count,
-            file_size=file_size,
-            audio_enabled=recording.use_audio,
-        )
-        
-        return {
-            "recording_id": recording_id,
-            "camera_id": recording.camera_id,
-            "alert_id": recording.alert_id,
-            "filename": recording.filepath.name,
-            "filepath": str(web_filepath or recording.filepath),
-            "duration_seconds": duration,
-            "file_size_bytes": file_size,
-            "frame_count": recording.frame_count,
-            "started_at": to_utc_isoformat(recording.started_at),
-            "ended_at": to_utc_isoformat(ended_at),
-            "thumbnail_path": str(thumbnail_path) if thumbnail_path else None,
-            "has_audio": recording.use_audio,
-        }
+            
+            return {
+                "recording_id": recording_id,
+                "camera_id": recording.camera_id,
+                "alert_id": recording.alert_id,
+                "filename": recording.filepath.name,
+                "filepath": str(web_filepath or recording.filepath),
+                "duration_seconds": duration,
+                "file_size_bytes": file_size,
+                "frame_count": recording.frame_count,
+                "dropped_frames": recording.dropped_frames,
+                "started_at": to_utc_isoformat(recording.started_at),
+                "ended_at": to_utc_isoformat(ended_at),
+                "thumbnail_path": str(thumbnail_path) if thumbnail_path else None,
+                "has_audio": recording.use_audio,
+            }
+        finally:
+            self._release_slot(recording)
+    
+    def _release_slot(self, recording: ActiveRecording):
+        """Return a recording's concurrency slot (at most once per recording)."""
+        if not recording.slot_released:
+            recording.slot_released = True
+            self._recording_slots.release()
+    
+    @staticmethod
+    def _file_size(path: Path) -> int:
+        """Size of a file in bytes, or 0 if it doesn't exist."""
+        try:
+            return path.stat().st_size
+        except FileNotFoundError:
+            return 0
     
     async def _stop_audio_recording(self, recording: ActiveRecording):
         """Stop FFmpeg recording and concatenate with pre-roll."""
@@ -447,196 +818,336 @@ class RecordingService:
                 except:
                     pass
         
-        # Concatenate pre-roll with main recording
-        if recording.pre_roll_filepath and recording.pre_roll_filepath.exists():
-            await self._concatenate_recordings(
-                pre_roll_path=recording.pre_roll_filepath,
-                main_path=recording.main_filepath,
-                output_path=recording.filepath,
-            )
-        elif recording.main_filepath and recording.main_filepath.exists():
-            # No pre-roll, just rename main to final
-            os.rename(recording.main_filepath, recording.filepath)
+        try:
+            # Concatenate pre-roll with main recording
+            if recording.pre_roll_filepath and await asyncio.to_thread(recording.pre_roll_filepath.exists):
+                thumbnail_path = await self._concatenate_recordings(
+                    pre_roll_path=recording.pre_roll_filepath,
+                    main_path=recording.main_filepath,
+                    output_path=recording.filepath,
+                    pre_roll_duration=recording.frame_count / settings.RECORDING_FPS,
+                    pre_roll_from_segments=recording.pre_roll_from_segments,
+                    thumbnail_dims=recording.thumbnail_dims,
+                    scaled_size=recording.output_size,
+                    with_thumbnail=recording.thumbnail_path is None,
+                )
+                recording.thumbnail_path = recording.thumbnail_path or thumbnail_path
+            elif recording.main_filepath and await asyncio.to_thread(recording.main_filepath.exists):
+                # No pre-roll, just move main to final
+                await asyncio.to_thread(os.replace, recording.main_filepath, recording.filepath)
+        finally:
+            if recording.temp_dir:
+                await asyncio.to_thread(shutil.rmtree, recording.temp_dir, ignore_errors=True)
     
     async def _stop_video_only_recording(self, recording: ActiveRecording):
-        """Stop video-only recording using cv2.VideoWriter."""
+        """Stop video-only recording and finalize its writer."""
+        recording.stopped = True
         
         # Unsubscribe from frames
         if hasattr(recording, '_camera_stream') and hasattr(recording, '_frame_callback'):
             recording._camera_stream.unsubscribe(recording._frame_callback)
         
-        # Close writer
+        # Let the writer thread flush queued frames, then stop it
+        if recording.writer_thread:
+            self._enqueue_frame(recording.frame_queue, None)
+            await asyncio.to_thread(recording.writer_thread.join)
+        
+        # Close writer (flushes the encoder and finalizes the file)
         if recording.writer:
-            recording.writer.release()
+            await asyncio.to_thread(recording.writer.release)
     
     async def _concatenate_recordings(
         self,
         pre_roll_path: Path,
         main_path: Path,
         output_path: Path,
-    ):
+        pre_roll_duration: float,
+        pre_roll_from_segments: bool = False,
+        thumbnail_dims: Optional[tuple] = None,
+        scaled_size: Optional[tuple] = None,
+        with_thumbnail: bool = True,
+    ) -> Optional[Path]:
         """Concatenate pre-roll video with main recording using FFmpeg.
         
-        Since pre-roll has no audio and main recording has audio, we need to
-        add a silent audio track to pre-roll before concatenation.
+        Runs as a single ffmpeg invocation: the silent pre-roll gets a
+        generated silent audio track, both parts are joined with the concat
+        filter and encoded once, and the joined stream is split to also emit
+        the thumbnail.
+        
+        Pre-roll taken from stream segments is read through the concat
+        demuxer and already carries the camera's audio.
+        
+        Returns:
+            Path to the thumbnail if it was produced, otherwise None
         """
         
-        if not main_path.exists():
+        if not await asyncio.to_thread(main_path.exists):
             logger.warning("Main recording file not found, using pre-roll only", main_path=str(main_path))
-            if pre_roll_path.exists():
-                os.rename(pre_roll_path, output_path)
-            return
+            if not pre_roll_from_segments and await asyncio.to_thread(pre_roll_path.exists):
+                await asyncio.to_thread(os.replace, pre_roll_path, output_path)
+            return None
         
         # If no pre-roll, just use main recording
-        if not pre_roll_path or not pre_roll_path.exists():
-            os.rename(main_path, output_path)
-            return
+        if not pre_roll_path or not await asyncio.to_thread(pre_roll_path.exists):
+            await asyncio.to_thread(os.replace, main_path, output_path)
+            return None
         
-        # First, add silent audio track to pre-roll to match main recording's audio
-        pre_roll_with_audio = pre_roll_path.with_stem(pre_roll_path.stem + "_audio")
-        concat_list_path = output_path.with_suffix('.txt')
+        # Encode next to the inputs and move into place once complete
+        joined_path = pre_roll_path.with_name("joined.mp4")
+        thumbnail_path = output_path.with_suffix('.jpg')
         
-        try:
-            # Get pre-roll duration
-            probe_cmd = [
-                'ffprobe', '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                str(pre_roll_path)
+        # Inputs: 0 = pre-roll, 1 = main recording, 2 = generated silence (frame pre-roll only)
+        pre_roll_video = '[0:v]'
+        if pre_roll_from_segments:
+            inputs = [
+                '-f', 'concat', '-safe', '0', '-i', str(pre_roll_path),
+                '-i', str(main_path),
             ]
-            
-            probe_process = await asyncio.create_subprocess_exec(
-                *probe_cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-            )
-            stdout, _ = await probe_process.communicate()
-            pre_roll_duration = float(stdout.decode().strip()) if stdout else 5.0
-            
-            # Add silent audio to pre-roll (matching AAC format of main recording)
-            add_audio_cmd = [
-                'ffmpeg', '-y',
+            input_filters = []
+            pre_roll_audio = '[0:a]'
+            if scaled_size:
+                # Segments are stream copies at camera resolution; match the downscaled main recording
+                input_filters.append(f'[0:v]scale={scaled_size[0]}:{scaled_size[1]}[pre_v]')
+                pre_roll_video = '[pre_v]'
+        else:
+            inputs = [
                 '-i', str(pre_roll_path),
-                '-f', 'lavfi', '-i', f'anullsrc=r=8000:cl=mono:d={pre_roll_duration}',
-                '-c:v', 'copy',
-                '-c:a', 'aac',
-                '-b:a', '128k',
-                '-shortest',
-                str(pre_roll_with_audio),
+                '-i', str(main_path),
+                '-f', 'lavfi', '-i', 'anullsrc=r=44100:cl=mono',
             ]
-            
-            logger.info("Adding silent audio to pre-roll", duration=pre_roll_duration)
-            
-            process = await asyncio.create_subprocess_exec(
-                *add_audio_cmd,
-                stdout=asyncio.subprocess.DEVNULL,
-                stderr=asyncio.subprocess.PIPE,
-            )
-            _, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                logger.warning("Failed to add silent audio to pre-roll", stderr=stderr.decode()[:300])
-                # Fall back to main recording only
-                os.rename(main_path, output_path)
-                return
-            
-            # Now concatenate with matching audio streams
-            with open(concat_list_path, 'w') as f:
-                f.write(f"file '{pre_roll_with_audio}'\n")
-                f.write(f"file '{main_path}'\n")
-            
-            # Use FFmpeg concat demuxer
-            concat_cmd = [
-                'ffmpeg', '-y',
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', str(concat_list_path),
-                '-c:v', 'libx264',
-                '-preset', 'fast',
-                '-crf', '23',
-                '-c:a', 'aac',
-                '-b:a', '128k',
-                '-movflags', '+faststart',
-                str(output_path),
+            # Silent audio exactly as long as the pre-roll video
+            input_filters = [f'[2:a]atrim=duration={pre_roll_duration:.3f}[pre_a]']
+            pre_roll_audio = '[pre_a]'
+        
+        filters = input_filters + [
+            f'{pre_roll_video}{pre_roll_audio}[1:v][1:a]concat=n=2:v=1:a=1[joined_v][out_a]',
+        ]
+        if with_thumbnail:
+            filters += [
+                '[joined_v]split=2[out_v][thumb_src]',
+                # Thumbnail from ~1 second in, max 320px on the long side
+                f'[thumb_src]select=gte(n\\,{settings.RECORDING_FPS}),{self._thumbnail_scale(thumbnail_dims)}[thumb]',
             ]
-            
-            logger.info("Concatenating recordings", pre_roll=str(pre_roll_with_audio), main=str(main_path))
-            
-            process = await asyncio.create_subprocess_exec(
-                *concat_cmd,
-                stdout=asyncio.subprocess.DEVNULL,
-                stderr=asyncio.subprocess.PIPE,
-            )
-            
-            _, stderr = await process.communicate()
-            
-            if process.returncode == 0:
-                logger.info("Recordings concatenated successfully with audio")
-            else:
-                logger.error("Concatenation failed", stderr=stderr.decode()[:500])
-                # Fall back to main recording (which has audio)
-                if main_path.exists():
-                    os.rename(main_path, output_path)
-            
-        finally:
-            # Clean up temp files
-            for temp_file in [concat_list_path, pre_roll_path, main_path, pre_roll_with_audio]:
-                try:
-                    if temp_file and temp_file.exists():
-                        os.remove(temp_file)
-                except Exception as e:
-                    logger.warning(f"Failed to remove temp file {temp_file}: {e}")
+            thumbnail_outputs = ['-map', '[thumb]', '-frames:v', '1', str(thumbnail_path)]
+        else:
+            filters.append('[joined_v]null[out_v]')
+            thumbnail_outputs = []
+        filter_graph = ';'.join(filters)
+        
+        cmd = [
+            'ffmpeg', '-y',
+            *inputs,
+            '-filter_complex', filter_graph,
+            '-map', '[out_v]', '-map', '[out_a]',
+            '-c:v', 'libx264',
+            '-preset', 'fast',
+            '-crf', '23',
+            '-c:a', 'aac',
+            '-b:a', '128k',
+            '-movflags', WEB_MP4_MOVFLAGS,
+            str(joined_path),
+            *thumbnail_outputs,
+        ]
+        
+        logger.info(
+            "Concatenating recordings",
+            pre_roll=str(pre_roll_path),
+            main=str(main_path),
+            pre_roll_duration=pre_roll_duration,
+        )
+        
+        result = await self._ffmpeg_pool.run(cmd)
+        
+        if result.returncode == 0:
+            await asyncio.to_thread(os.replace, joined_path, output_path)
+            logger.info("Recordings concatenated successfully with audio")
+            if with_thumbnail and await asyncio.to_thread(thumbnail_path.exists):
+                return thumbnail_path
+            return None
+        
+        logger.error("Concatenation failed", stderr=result.stderr[:500])
+        # Fall back to main recording (which has audio)
+        if await asyncio.to_thread(main_path.exists):
+            await asyncio.to_thread(os.replace, main_path, output_path)
+        return None
+    
+    @staticmethod
+    def _write_thumbnail(frame: np.ndarray, thumbnail_path: Path, thumbnail_dims: tuple) -> bool:
+        """Downscale a frame and save it as a WebP thumbnail (blocking)."""
+        try:
+            thumb = cv2.resize(frame, thumbnail_dims, interpolation=cv2.INTER_AREA)
+            return cv2.imwrite(str(thumbnail_path), thumb, [cv2.IMWRITE_WEBP_QUALITY, 80])
+        except Exception as e:
+            logger.error("Thumbnail write failed", error=str(e))
+            return False
     
-    async def _generate_thumbnail(self, video_path: Path) -> Optional[Path]:
+    @staticmethod
+    def _thumbnail_scale(thumbnail_dims: Optional[tuple]) -> str:
+        """ffmpeg scale filter for a thumbnail, using the camera's precomputed size when known."""
+        if thumbnail_dims:
+            return f'scale={thumbnail_dims[0]}:{thumbnail_dims[1]}'
+        return 'scale=320:320:force_original_aspect_ratio=decrease'
+    
+    async def _generate_thumbnail(self, video_path: Path, thumbnail_dims: Optional[tuple] = None) -> Optional[Path]:
         """Generate a thumbnail from the video."""
         try:
             thumbnail_path = video_path.with_suffix('.jpg')
             
             # Extract frame at 1 second (or first frame if video is shorter)
-            cap = cv2.VideoCapture(str(video_path))
-            
-            # Try to seek to 1 second
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            cap.set(cv2.CAP_PROP_POS_FRAMES, int(fps))
-            
-            ret, frame = cap.read()
-            if not ret:
-                # Try first frame
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                ret, frame = cap.read()
-            
-            cap.release()
-            
-            if ret:
-                # Resize for thumbnail
-                height, width = frame.shape[:2]
-                max_dim = 320
-                scale = max_dim / max(width, height)
-                new_width = int(width * scale)
-                new_height = int(height * scale)
+            for seek_seconds in (1, 0):
+                cmd = [
+                    'ffmpeg', '-y',
+                    '-ss', str(seek_seconds),
+                    '-i', str(video_path),
+                    '-frames:v', '1',
+                    '-vf', self._thumbnail_scale(thumbnail_dims),
+                    str(thumbnail_path),
+                ]
+                result = await self._ffmpeg_pool.run(cmd)
                 
-                thumbnail = cv2.resize(frame, (new_width, new_height))
-                cv2.imwrite(str(thumbnail_path), thumbnail)
-                
-                return thumbnail_path
+                if result.returncode == 0 and await asyncio.to_thread(thumbnail_path.exists):
+                    return thumbnail_path
                 
         except Exception as e:
             logger.error("Thumbnail generation failed", error=str(e))
         
         return None
     
+    async def _get_encoder(self) -> str:
+        """Resolve the H.264 encoder for transcodes, probing ffmpeg for hardware encoders once."""
+        if self._encoder is not None:
+            return self._encoder
+        
+        configured = settings.RECORDING_HW_ENCODER.strip().lower()
+        encoder = 'libx264'
+        if configured == 'auto':
+            try:
+                result = await self._ffmpeg_pool.run(
+                    ['ffmpeg', '-hide_banner', '-encoders'], capture_stdout=True,
+                )
+                available = {
+                    line.split()[1] for line in result.stdout.splitlines()
+                    if len(line.split()) > 1
+                }
+                encoder = next((e for e in HW_H264_ENCODERS if e in available), 'libx264')
+            except Exception as e:
+                logger.warning("Encoder probe failed, using libx264", error=str(e))
+        elif configured not in ('', 'none'):
+            encoder = configured
+        
+        self._encoder = encoder
+        logger.info("Selected transcode encoder", encoder=encoder)
+        return encoder
+    
+    @staticmethod
+    def _encoder_args(encoder: str) -> tuple:
+        """
+        ffmpeg arguments for an H.264 encoder.
+        
+        Returns:
+            (arguments before -i, video encoding arguments after -i)
+        """
+        if encoder == 'h264_nvenc':
+            return (
+                ['-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda'],
+                ['-c:v', 'h264_nvenc', '-preset', 'p4', '-tune', 'll',
+                 '-rc', 'vbr', '-cq', '23', '-b:v', '0', '-vsync', '0'],
+            )
+        if encoder == 'h264_qsv':
+            return (
+                ['-hwaccel', 'qsv'],
+                ['-c:v', 'h264_qsv', '-global_quality', '23', '-preset', 'veryfast', '-vsync', '0'],
+            )
+        if encoder == 'h264_vaapi':
+            return (
+                ['-hwaccel', 'vaapi', '-hwaccel_output_format', 'vaapi'],
+                ['-vf', 'format=nv12|vaapi,hwupload', '-c:v', 'h264_vaapi', '-qp', '23', '-vsync', '0'],
+            )
+        if encoder == 'h264_amf':
+            return (
+                [],
+                ['-c:v', 'h264_amf', '-quality', 'speed', '-rc', 'cqp',
+                 '-qp_i', '23', '-qp_p', '23', '-vsync', '0'],
+            )
+        return [], ['-c:v', 'libx264', '-preset', 'fast', '-crf', '23']
+    
     async def _transcode_for_web(self, video_path: Path, preserve_audio: bool = True) -> Optional[Path]:
         """Transcode video to web-compatible H.264 format, preserving audio if present."""
         try:
             output_path = video_path.with_stem(video_path.stem + "_web").with_suffix('.mp4')
+            encoder = await self._get_encoder()
+            
+            # Software encodes run in-process through PyAV; hardware encoders
+            # need the ffmpeg CLI's hwaccel/hwupload plumbing
+            transcoded = encoder == 'libx264' and await asyncio.to_thread(
+                self._transcode_in_process, video_path, output_path,
+            )
+            if not transcoded:
+                transcoded = await self._transcode_with_ffmpeg(video_path, output_path, encoder, preserve_audio)
+            
+            if transcoded:
+                # Atomically swap the transcoded file over the original
+                await asyncio.to_thread(os.replace, output_path, video_path)
+                return video_path
+                
+        except Exception as e:
+            logger.error("Transcoding error", error=str(e))
+        
+        return None
+    
+    @staticmethod
+    def _transcode_in_process(video_path: Path, output_path: Path) -> bool:
+        """
+        Re-encode a video-only file to H.264 with PyAV (blocking).
+        
+        Avoids spawning ffmpeg for the common case (mp4v from the OpenCV
+        fallback writer, which never has audio). Returns False when the
+        input has audio or PyAV can't do the encode, so the caller can fall
+        back to the ffmpeg CLI.
+        """
+        try:
+            with av.open(str(video_path)) as src:
+                if src.streams.audio or not src.streams.video:
+                    return False
+                in_stream = src.streams.video[0]
+                in_stream.thread_type = 'AUTO'
+                
+                with av.open(str(output_path), mode='w', options={'movflags': WEB_MP4_MOVFLAGS}) as dst:
+                    rate = Fraction(in_stream.average_rate or settings.RECORDING_FPS)
+                    out_stream = dst.add_stream('libx264', rate=rate)
+                    out_stream.width = in_stream.codec_context.width
+                    out_stream.height = in_stream.codec_context.height
+                    out_stream.pix_fmt = 'yuv420p'
+                    out_stream.options = {'preset': 'fast', 'crf': '23'}
+                    
+                    # Renumber frames in the output's 1/rate time base
+                    for index, frame in enumerate(src.decode(in_stream)):
+                        frame.pts = index
+                        frame.time_base = 1 / rate
+                        dst.mux(out_stream.encode(frame))
+                    dst.mux(out_stream.encode(None))
+            return True
+        except Exception as e:
+            logger.warning("In-process transcode failed, using ffmpeg", error=str(e))
+            return False
+    
+    async def _transcode_with_ffmpeg(
+        self,
+        video_path: Path,
+        output_path: Path,
+        encoder: str,
+        preserve_audio: bool = True,
+    ) -> bool:
+        """Transcode with the ffmpeg CLI, falling back from a failing hardware encoder to libx264."""
+        while True:
+            input_args, video_args = self._encoder_args(encoder)
             
             # Use ffmpeg for transcoding, include audio codec
             cmd = [
                 'ffmpeg', '-y',
+                *input_args,
                 '-i', str(video_path),
-                '-c:v', 'libx264',
-                '-preset', 'fast',
-                '-crf', '23',
+                *video_args,
             ]
             
             if preserve_audio:
@@ -644,28 +1155,24 @@ class RecordingService:
             else:
                 cmd.extend(['-an'])  # No audio
             
-            cmd.extend(['-movflags', '+faststart', str(output_path)])
+            cmd.extend(['-movflags', WEB_MP4_MOVFLAGS, str(output_path)])
             
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.DEVNULL,
-                stderr=asyncio.subprocess.PIPE,
-            )
+            result = await self._ffmpeg_pool.run(cmd)
             
-            _, stderr = await process.communicate()
+            if result.returncode == 0:
+                return True
             
-            if process.returncode == 0:
-                # Remove original, rename transcoded
-                os.remove(video_path)
-                os.rename(output_path, video_path)
-                return video_path
-            else:
-                logger.error("Transcoding failed", stderr=stderr.decode()[:500])
-                
-        except Exception as e:
-            logger.error("Transcoding error", error=str(e))
-        
-        return None
+            if encoder == 'libx264':
+                logger.error("Transcoding failed", stderr=result.stderr[:500])
+                return False
+            
+            # Encoder is compiled in but the device isn't usable; stop trying it
+            logger.warning(
+                "Hardware transcode failed, falling back to libx264",
+                encoder=encoder,
+                stderr=result.stderr[-300:],
+            )
+            encoder = self._encoder = 'libx264'
     
     def get_active_recordings(self) -> List[dict]:
         """Get list of active recordings."""
@@ -3,19 +3,29 @@ Rule engine for evaluating detection rules and triggering alerts.
 """
 
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any, Callable
+from typing import Optional, List, Dict, Any, Callable, FrozenSet, Tuple
 import uuid
+import numpy as np
 import structlog
 
 from backend.database import Rule, RuleConditionType, Alert, AlertState
 from backend.services.sam3_service import SAM3Service, Detection
+from backend.services import spatial_kernels
 from backend.config import settings
 from backend.utils import to_utc_isoformat
 
 logger = structlog.get_logger()
 
+# Checked before building per-frame debug events; structlog would otherwise
+# construct the event dict even when debug output is filtered out
+_DEBUG = settings.DETECTION_DEBUG_LOGGING
+
+# Below this many rules per frame, thread hand-off costs more than it saves
+_PARALLEL_MIN_RULES = 4
+
 
 @dataclass
 class RuleEvaluation:
@@ -27,6 +37,71 @@ class RuleEvaluation:
     message: str
 
 
+class DetectionArrays:
+    """
+    Per-frame NumPy views of a detections dict, built lazily per label.
+    
+    Several rules usually look at the same labels, so each array is built
+    at most once per evaluate_rules() call and shared between them.
+    """
+    
+    def __init__(self, detections: Dict[str, List[Detection]]):
+        self._detections = detections
+        self._confidences: Dict[str, np.ndarray] = {}
+        self._bboxes: Dict[str, np.ndarray] = {}
+        self._centers: Dict[str, np.ndarray] = {}
+    
+    def confidences(self, label: str) -> np.ndarray:
+        """Confidence of every detection of a label, shape (N,)."""
+        arr = self._confidences.get(label)
+        if arr is None:
+            dets = self._detections.get(label, ())
+            arr = np.fromiter((d.confidence for d in dets), dtype=np.float32, count=len(dets))
+            self._confidences[label] = arr
+        return arr
+    
+    def bboxes(self, label: str) -> np.ndarray:
+        """(x1, y1, x2, y2) of every detection of a label, shape (N, 4)."""
+        arr = self._bboxes.get(label)
+        if arr is None:
+            dets = self._detections.get(label, ())
+            arr = np.asarray([d.bbox for d in dets], dtype=np.float32).reshape(len(dets), 4)
+            self._bboxes[label] = arr
+        return arr
+    
+    def centers(self, label: str) -> np.ndarray:
+        """(cx, cy) of every detection of a label, shape (N, 2)."""
+        arr = self._centers.get(label)
+        if arr is None:
+            dets = self._detections.get(label, ())
+            arr = np.asarray([d.center for d in dets], dtype=np.float32).reshape(len(dets), 2)
+            self._centers[label] = arr
+        return arr
+
+
+@dataclass(frozen=True, slots=True)
+class ParsedCondition:
+    """A rule's condition_params, parsed once when the rule is (re)registered."""
+    zone: Tuple[int, int, int, int] = (0, 0, 9999, 9999)  # x1, y1, x2, y2 (OBJECT_IN_ZONE)
+    threshold: int = 1  # OBJECT_COUNT
+    relationship: str = "over"  # OBJECT_OVER_OBJECT
+    
+    @classmethod
+    def from_params(cls, params: Optional[Dict[str, Any]]) -> "ParsedCondition":
+        params = params or {}
+        zone = params.get("zone", {})
+        return cls(
+            zone=(
+                zone.get("x1", 0),
+                zone.get("y1", 0),
+                zone.get("x2", 9999),
+                zone.get("y2", 9999),
+            ),
+            threshold=params.get("threshold", 1),
+            relationship=params.get("relationship", "over"),
+        )
+
+
 @dataclass
 class RuleState:
     """State tracking for a rule."""
@@ -36,6 +111,22 @@ class RuleState:
     is_in_alert: bool = False
     consecutive_detections: int = 0
     required_consecutive: int = 1  # Require N consecutive detections to trigger (1 = instant)
+    cond: ParsedCondition = field(default_factory=ParsedCondition)
+    enabled: bool = True  # Mirror of rule.enabled (rules are replaced, not mutated, on update)
+    primary_target: str = ""
+    secondary_target: Optional[str] = None
+    # False only for rules that can trigger with no primary detections (count threshold <= 0)
+    requires_primary: bool = True
+    cooldown: timedelta = timedelta(0)
+    
+    def __post_init__(self):
+        self.enabled = bool(self.rule.enabled)
+        self.cooldown = timedelta(seconds=self.rule.cooldown_seconds or 0)
+        self.primary_target = self.rule.primary_target
+        self.secondary_target = self.rule.secondary_target
+        self.cond = ParsedCondition.from_params(self.rule.condition_params)
+        if self.rule.condition_type == RuleConditionType.OBJECT_COUNT:
+            self.requires_primary = self.cond.threshold > 0
 
 
 class RuleEngine:
@@ -52,29 +143,104 @@ class RuleEngine:
     def __init__(self, sam3_service: SAM3Service):
         self.sam3_service = sam3_service
         self._rule_states: Dict[str, RuleState] = {}
+        # camera_id -> states of that camera's rules, so evaluation skips other
+        # cameras. Tuples are replaced, never mutated, so a running evaluation
+        # is unaffected by rules changing while it awaits callbacks.
+        self._rules_by_camera: Dict[str, Tuple[RuleState, ...]] = {}
+        # camera_id -> primary targets of its enabled rules
+        self._targets_by_camera: Dict[str, FrozenSet[str]] = {}
         self._on_alert_callbacks: List[Callable] = []
         self._on_alert_end_callbacks: List[Callable] = []
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.RULE_ENGINE_WORKERS,
+            thread_name_prefix="rule-eval",
+        )
+        # Compile the pairwise spatial kernels up front (no-op without Numba)
+        spatial_kernels.warm_up()
+    
+    def shutdown(self):
+        """Stop the rule evaluation threads (an in-flight evaluation finishes on its own)."""
+        self._executor.shutdown(wait=False)
+    
+    def _index_state(self, state: RuleState):
+        """Store a rule state, replacing any previous state for the same rule."""
+        self._unindex_state(state.rule.id)
+        self._rule_states[state.rule.id] = state
+        camera_id = state.rule.camera_id
+        self._rules_by_camera[camera_id] = self._rules_by_camera.get(camera_id, ()) + (state,)
+        self._update_camera_targets(camera_id)
+    
+    def _unindex_state(self, rule_id: str):
+        """Remove a rule's state from the per-camera index."""
+        old_state = self._rule_states.pop(rule_id, None)
+        if old_state is None:
+            return
+        camera_id = old_state.rule.camera_id
+        camera_states = tuple(s for s in self._rules_by_camera.get(camera_id, ()) if s is not old_state)
+        if camera_states:
+            self._rules_by_camera[camera_id] = camera_states
+        else:
+            self._rules_by_camera.pop(camera_id, None)
+        self._update_camera_targets(camera_id)
+    
+    def _update_camera_targets(self, camera_id: str):
+        """Rebuild the set of labels any enabled rule on the camera depends on."""
+        states = self._rules_by_camera.get(camera_id, ())
+        if any(s.enabled and not s.requires_primary for s in states):
+            # Some rule can trigger without detections; never short-circuit
+            self._targets_by_camera.pop(camera_id, None)
+            return
+        self._targets_by_camera[camera_id] = frozenset(
+            s.primary_target for s in states if s.enabled
+        )
     
     def register_rule(self, rule: Rule):
         """Register a rule for evaluation."""
-        self._rule_states[rule.id] = RuleState(
+        self._index_state(RuleState(
             rule=rule,
             required_consecutive=settings.DETECTION_CONSECUTIVE_FRAMES,
-        )
+        ))
         logger.info("Rule registered", rule_id=rule.id, name=rule.name, required_consecutive=settings.DETECTION_CONSECUTIVE_FRAMES)
     
     def unregister_rule(self, rule_id: str):
-        """Unregister a rule and clear any active alert."""
-        if rule_id in self._rule_states:
-            state = self._rule_states[rule_id]
-            # Clear any active alert state
-            if state.is_in_alert:
-                logger.info("Clearing active alert on rule unregister", rule_id=rule_id, alert_id=state.current_alert_id)
-                state.is_in_alert = False
-                state.current_alert_id = None
-                state.consecutive_detections = 0
-            del self._rule_states[rule_id]
-            logger.info("Rule unregistered", rule_id=rule_id)
+        """
+        Unregister a rule and clear any active alert.
+        
+        Returns:
+            (was_in_alert, alert_id, rule) so the caller can end the alert
+            (and its recording) properly
+        """
+        if rule_id not in self._rule_states:
+            return False, None, None
+        
+        state = self._rule_states[rule_id]
+        was_in_alert = state.is_in_alert
+        alert_id = state.current_alert_id
+        # Clear any active alert state
+        if was_in_alert:
+            logger.info("Clearing active alert on rule unregister", rule_id=rule_id, alert_id=alert_id)
+            state.is_in_alert = False
+            state.current_alert_id = None
+            state.consecutive_detections = 0
+        self._unindex_state(rule_id)
+        logger.info("Rule unregistered", rule_id=rule_id)
+        return was_in_alert, alert_id, state.rule
+    
+    def clear_camera_alerts(self, camera_id: str) -> List[Tuple[str, Rule]]:
+        """
+        Clear the active alerts of a camera's rules (the camera is going away).
+        
+        Returns:
+            (alert_id, rule) for every alert that was active
+        """
+        ended = []
+        for state in self._rules_by_camera.get(camera_id, ()):
+            if state.is_in_alert and state.current_alert_id:
+                ended.append((state.current_alert_id, state.rule))
+            state.is_in_alert = False
+            state.current_alert_id = None
+            state.consecutive_detections = 0
+        return ended
     
     def update_rule(self, rule: Rule):
         """Update an existing rule and reset its alert state."""
@@ -86,13 +252,13 @@ class RuleEngine:
             old_alert_id = old_state.current_alert_id
             
             # Create new state with fresh rule but preserve cooldown
-            self._rule_states[rule.id] = RuleState(
+            self._index_state(RuleState(
                 rule=rule,
                 last_triggered=old_state.last_triggered,
                 is_in_alert=False,  # Reset alert state
                 current_alert_id=None,
                 consecutive_detections=0,
-            )
+            ))
             
             logger.info(
                 "Rule updated", 
@@ -116,11 +282,21 @@ class RuleEngine:
             rule_id=rule.id,
         )
         
-        for callback in self._on_alert_end_callbacks:
-            try:
-                await callback(alert_id=alert_id, rule=rule)
-            except Exception as e:
-                logger.error("Alert end callback error", error=str(e))
+        await self._run_callbacks(
+            self._on_alert_end_callbacks, "Alert end callback error",
+            alert_id=alert_id, rule=rule,
+        )
+    
+    @staticmethod
+    async def _run_callbacks(callbacks: List[Callable], error_message: str, **kwargs):
+        """Run callbacks concurrently; a failing callback is logged without affecting the others."""
+        results = await asyncio.gather(
+            *(callback(**kwargs) for callback in list(callbacks)),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(error_message, error=str(result))
     
     def on_alert(self, callback: Callable):
         """Register callback for alert start."""
@@ -146,22 +322,59 @@ class RuleEngine:
             List of RuleEvaluation results
         """
         results = []
+        states = self._rules_by_camera.get(camera_id, ())
+        arrays = DetectionArrays(detections)
+        targets = self._targets_by_camera.get(camera_id)
+        # SAM3 returns a key for every prompt, even with no detections
+        present = {label for label, dets in detections.items() if dets}
         
-        for rule_id, state in self._rule_states.items():
-            rule = state.rule
+        # Nothing any rule looks for was detected: only rules that are mid-alert
+        # or counting consecutive detections need to see the empty frame
+        if targets is not None and targets.isdisjoint(present) and not any(
+            s.is_in_alert or s.consecutive_detections for s in states
+        ):
+            return results
+        
+        to_evaluate = []
+        now = None
+        for state in states:
+            if not state.enabled:
+                continue
             
-            # Skip if not for this camera or disabled
-            if rule.camera_id != camera_id or not rule.enabled:
+            # Absent primary target can't trigger; skip unless there is state to reset
+            if (
+                state.requires_primary
+                and state.primary_target not in present
+                and not (state.is_in_alert or state.consecutive_detections)
+            ):
                 continue
             
             # Check cooldown
-            if state.last_triggered:
-                cooldown_end = state.last_triggered + timedelta(seconds=rule.cooldown_seconds)
-                if datetime.utcnow() < cooldown_end and not state.is_in_alert:
+            if state.last_triggered and not state.is_in_alert:
+                if now is None:
+                    now = datetime.utcnow()
+                if now < state.last_triggered + state.cooldown:
                     continue
             
-            # Evaluate the rule
-            evaluation = await self._evaluate_single_rule(rule, state, detections)
+            to_evaluate.append(state)
+        
+        # Evaluation is pure CPU work (NumPy releases the GIL), so many rules
+        # can run side by side; alert state transitions stay sequential
+        if len(to_evaluate) >= _PARALLEL_MIN_RULES:
+            loop = asyncio.get_running_loop()
+            evaluations = await asyncio.gather(*(
+                loop.run_in_executor(
+                    self._executor, self._evaluate_single_rule, state.rule, state, detections, arrays,
+                )
+                for state in to_evaluate
+            ))
+        else:
+            evaluations = [
+                self._evaluate_single_rule(state.rule, state, detections, arrays)
+                for state in to_evaluate
+            ]
+        
+        for state, evaluation in zip(to_evaluate, evaluations):
             results.append(evaluation)
             
             # Handle alert state transitions
@@ -169,16 +382,19 @@ class RuleEngine:
         
         return results
     
-    async def _evaluate_single_rule(
+    def _evaluate_single_rule(
         self,
         rule: Rule,
         state: RuleState,
         detections: Dict[str, List[Detection]],
+        arrays: Optional[DetectionArrays] = None,
     ) -> RuleEvaluation:
         """Evaluate a single rule against detections."""
+        if arrays is None:
+            arrays = DetectionArrays(detections)
         
-        primary_detections = detections.get(rule.primary_target, [])
-        secondary_detections = detections.get(rule.secondary_target, []) if rule.secondary_target else []
+        primary_detections = detections.get(state.primary_target, [])
+        secondary_detections = detections.get(state.secondary_target, []) if state.secondary_target else []
         
         triggered = False
         confidence = 0.0
@@ -189,7 +405,7 @@ class RuleEngine:
             # Simple object presence
             if primary_detections:
                 triggered = True
-                confidence = max(d.confidence for d in primary_detections)
+                confidence = float(arrays.confidences(state.primary_target).max())
                 detected_objects = [
                     {"label": d.label, "confidence": d.confidence, "bbox": d.bbox}
                     for d in primary_detections
@@ -198,15 +414,17 @@ class RuleEngine:
         
         elif rule.condition_type == RuleConditionType.OBJECT_IN_ZONE:
             # Object within defined zone
-            zone = rule.condition_params.get("zone", {})
-            x1 = zone.get("x1", 0)
-            y1 = zone.get("y1", 0)
-            x2 = zone.get("x2", 9999)
-            y2 = zone.get("y2", 9999)
+            x1, y1, x2, y2 = state.cond.zone
             
-            for detection in primary_detections:
-                cx, cy = detection.center
-                if x1 <= cx <= x2 and y1 <= cy <= y2:
+            if primary_detections:
+                centers = arrays.centers(state.primary_target)
+                in_zone = (
+                    (centers[:, 0] >= x1) & (centers[:, 0] <= x2)
+                    & (centers[:, 1] >= y1) & (centers[:, 1] <= y2)
+                )
+                
+                for i in np.flatnonzero(in_zone):
+                    detection = primary_detections[i]
                     triggered = True
                     confidence = max(confidence, detection.confidence)
                     detected_objects.append({
@@ -221,52 +439,57 @@ class RuleEngine:
         
         elif rule.condition_type == RuleConditionType.OBJECT_OVER_OBJECT:
             # Spatial relationship between objects
-            relationship = rule.condition_params.get("relationship", "over")
+            relationship = state.cond.relationship
             
-            logger.debug(
-                "Evaluating object_over_object rule",
-                rule_name=rule.name,
-                primary_target=rule.primary_target,
-                secondary_target=rule.secondary_target,
-                primary_count=len(primary_detections),
-                secondary_count=len(secondary_detections),
-                relationship=relationship,
+            if _DEBUG:
+                logger.debug(
+                    "Evaluating object_over_object rule",
+                    rule_name=rule.name,
+                    primary_target=rule.primary_target,
+                    secondary_target=rule.secondary_target,
+                    primary_count=len(primary_detections),
+                    secondary_count=len(secondary_detections),
+                    relationship=relationship,
+                )
+            
+            related = self.sam3_service.spatial_relationship_matrix(
+                primary_detections, secondary_detections, relationship,
+                a_boxes=arrays.bboxes(state.primary_target),
+                b_boxes=arrays.bboxes(state.secondary_target),
+                a_centers=arrays.centers(state.primary_target),
+                b_centers=arrays.centers(state.secondary_target),
             )
             
-            for primary in primary_detections:
-                for secondary in secondary_detections:
-                    is_related = self.sam3_service.check_spatial_relationship(
-                        primary, secondary, relationship
-                    )
-                    
-                    logger.debug(
-                        "Checking spatial relationship",
-                        primary_bbox=primary.bbox,
-                        secondary_bbox=secondary.bbox,
-                        relationship=relationship,
-                        result=is_related,
-                    )
-                    
-                    if is_related:
-                        triggered = True
-                        confidence = max(confidence, primary.confidence, secondary.confidence)
-                        detected_objects.append({
-                            "primary": {
-                                "label": primary.label,
-                                "confidence": primary.confidence,
-                                "bbox": primary.bbox,
-                            },
-                            "secondary": {
-                                "label": secondary.label,
-                                "confidence": secondary.confidence,
-                                "bbox": secondary.bbox,
-                            },
-                            "relationship": relationship,
-                        })
+            for i, j in np.argwhere(related):
+                primary = primary_detections[i]
+                secondary = secondary_detections[j]
+                triggered = True
+                confidence = max(confidence, primary.confidence, secondary.confidence)
+                detected_objects.append({
+                    "primary": {
+                        "label": primary.label,
+                        "confidence": primary.confidence,
+                        "bbox": primary.bbox,
+                    },
+                    "secondary": {
+                        "label": secondary.label,
+                        "confidence": secondary.confidence,
+                        "bbox": secondary.bbox,
+                    },
+                    "relationship": relationship,
+                })
+            
+            if _DEBUG:
+                logger.debug(
+                    "Checked spatial relationships",
+                    relationship=relationship,
+                    pairs=related.size,
+                    matches=len(detected_objects),
+                )
             
             if triggered:
                 message = f"🚨 {rule.primary_target} {relationship} {rule.secondary_target}!"
-            else:
+            elif _DEBUG:
                 logger.debug(
                     "Object over object rule not triggered",
                     rule_name=rule.name,
@@ -276,12 +499,12 @@ class RuleEngine:
         
         elif rule.condition_type == RuleConditionType.OBJECT_COUNT:
             # Count exceeds threshold
-            threshold = rule.condition_params.get("threshold", 1)
+            threshold = state.cond.threshold
             count = len(primary_detections)
             
             if count >= threshold:
                 triggered = True
-                confidence = sum(d.confidence for d in primary_detections) / count if count > 0 else 0
+                confidence = float(arrays.confidences(state.primary_target).mean()) if count > 0 else 0
                 detected_objects = [
                     {"label": d.label, "confidence": d.confidence, "bbox": d.bbox}
                     for d in primary_detections
@@ -322,15 +545,12 @@ class RuleEngine:
                     )
                     
                     # Notify callbacks
-                    for callback in self._on_alert_callbacks:
-                        try:
-                            await callback(
-                                alert_id=state.current_alert_id,
-                                rule=state.rule,
-                                evaluation=evaluation,
-                            )
-                        except Exception as e:
-                            logger.error("Alert callback error", error=str(e))
+                    await self._run_callbacks(
+                        self._on_alert_callbacks, "Alert callback error",
+                        alert_id=state.current_alert_id,
+                        rule=state.rule,
+                        evaluation=evaluation,
+                    )
         else:
             state.consecutive_detections = 0
             
@@ -347,14 +567,11 @@ class RuleEngine:
                 state.current_alert_id = None
                 
                 # Notify callbacks
-                for callback in self._on_alert_end_callbacks:
-                    try:
-                        await callback(
-                            alert_id=alert_id,
-                            rule=state.rule,
-                        )
-                    except Exception as e:
-                        logger.error("Alert end callback error", error=str(e))
+                await self._run_callbacks(
+                    self._on_alert_end_callbacks, "Alert end callback error",
+                    alert_id=alert_id,
+                    rule=state.rule,
+                )
     
     def get_rule_states(self) -> Dict[str, dict]:
         """Get current state of all rules."""
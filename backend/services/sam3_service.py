@@ -5,10 +5,15 @@ Uses streaming video inference for real-time performance.
 """
 
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from typing import Optional, List, Dict, Any, Tuple
+import contextlib
+import hashlib
+import inspect
+from collections import OrderedDict
+import queue
+from typing import Optional, List, Dict, Any, Tuple, Callable, Union
 from dataclasses import dataclass, field
 import structlog
+import cv2
 import numpy as np
 from PIL import Image
 import torch
@@ -16,25 +21,286 @@ import threading
 import time
 
 from backend.config import settings
+from backend.services import spatial_kernels
 
 logger = structlog.get_logger()
 
-# Dedicated thread pool for inference - isolated from the main async pool
-_inference_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sam3-inference")
+# Checked before per-frame timing and debug events; structlog would otherwise
+# build the event dict even when debug output is filtered out
+_DEBUG = settings.DETECTION_DEBUG_LOGGING
 
-# Semaphore to limit concurrent GPU inference (prevents OOM)
-_inference_semaphore = threading.Semaphore(1)
 
+def _rainbow_lut(size: int = 256) -> np.ndarray:
+    """RGB lookup table of matplotlib's "rainbow" colormap (gnuplot 33, 13, 10)."""
+    x = np.linspace(0.0, 1.0, size)
+    rgb = np.stack([
+        np.abs(2 * x - 0.5),
+        np.sin(np.pi * x),
+        np.cos(np.pi * x / 2),
+    ], axis=1)
+    return (np.clip(rgb, 0.0, 1.0) * 255).astype(np.uint8)
 
-@dataclass
+
+# Mask overlay colors, indexed by position along the rainbow
+_RAINBOW_LUT = _rainbow_lut()
+
+
+def _expand_batch(value: Any, batch_size: int) -> Any:
+    """Broadcast batch-1 tensors (inside model outputs, tuples, lists) to batch_size without copying."""
+    if isinstance(value, torch.Tensor):
+        if value.dim() == 0 or value.shape[0] != 1:
+            return value
+        return value.expand(batch_size, *value.shape[1:])
+    if isinstance(value, (tuple, list)):
+        return type(value)(_expand_batch(v, batch_size) for v in value)
+    if isinstance(value, dict):
+        # transformers ModelOutput subclasses are dicts of their set fields
+        return type(value)(**{k: _expand_batch(v, batch_size) for k, v in value.items()})
+    return value
+
+
+# Side length of the grayscale thumbnail compared for near-identical frames
+_SIGNATURE_SIZE = 64
+
+# Distinct prompt lists whose text inputs are kept (targets repeat heavily)
+_PROMPT_CACHE_SIZE = 32
+
+
+def _as_rgb_array(image: Union[Image.Image, np.ndarray]) -> np.ndarray:
+    """C-contiguous RGB uint8 (H, W, 3) view of a frame; arrays are passed through without a copy."""
+    if isinstance(image, np.ndarray):
+        return np.ascontiguousarray(image)
+    return np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+
+
+def _frame_signature(frame: np.ndarray) -> np.ndarray:
+    """
+    Coarse grayscale thumbnail of an RGB frame for near-duplicate matching.
+    
+    Each cell is the area average of a block of the frame (~30x17 px at
+    1080p), so sensor noise averages out while anything object-sized
+    moving into view changes at least one cell by a lot.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+    thumb = cv2.resize(gray, (_SIGNATURE_SIZE, _SIGNATURE_SIZE), interpolation=cv2.INTER_AREA)
+    return thumb.astype(np.int16)
+
+
+def _iter_tensors(value: Any):
+    """Yield every tensor inside a model output / tuple / list / dict."""
+    if isinstance(value, torch.Tensor):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            yield from _iter_tensors(v)
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _iter_tensors(v)
+
+
+def _resolve_future(future: asyncio.Future, result: Any, error: Optional[BaseException]):
+    """Complete an inference future on its event loop (unless the caller gave up)."""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+_BIT_WEIGHTS = (128, 64, 32, 16, 8, 4, 2, 1)
+
+
+def _pack_masks(masks: torch.Tensor) -> torch.Tensor:
+    """Bit-pack (N, H, W) binary masks along W on the device, in np.packbits layout."""
+    bits = masks.to(torch.uint8)
+    pad = -bits.shape[-1] % 8
+    if pad:
+        bits = torch.nn.functional.pad(bits, (0, pad))
+    weights = torch.tensor(_BIT_WEIGHTS, dtype=torch.uint8, device=bits.device)
+    return (bits.unflatten(-1, (-1, 8)) * weights).sum(dim=-1, dtype=torch.uint8)
+
+
+def _mask_extents(masks: torch.Tensor) -> torch.Tensor:
+    """(N, 4) x1, y1, x2, y2 (end-exclusive) bounding rectangles of (N, H, W) binary masks; zeros if empty."""
+    def span(occupied: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        flags = occupied.to(torch.uint8)
+        first = flags.argmax(dim=1)
+        end = flags.shape[1] - flags.flip(1).argmax(dim=1)
+        empty = ~occupied.any(dim=1)
+        return first.masked_fill(empty, 0), end.masked_fill(empty, 0)
+    
+    x1, x2 = span(masks.any(dim=1))
+    y1, y2 = span(masks.any(dim=2))
+    return torch.stack((x1, y1, x2, y2), dim=1).to(torch.int32)
+
+
+def _unpack_window(bits: np.ndarray, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+    """Unpack rows [y1:y2] and columns [x1:x2] of a row-packed bitmap, touching only the bytes covering them."""
+    first_byte = x1 // 8
+    unpacked = np.unpackbits(bits[y1:y2, first_byte:(x2 + 7) // 8], axis=1)
+    return unpacked[:, x1 - first_byte * 8:x2 - first_byte * 8]
+
+
+@dataclass(slots=True, frozen=True)
 class Detection:
-    """Represents a detected object with its mask and bounding box."""
+    """
+    Represents a detected object with its mask and bounding box.
+    
+    The mask is stored cropped to the tight bounding rectangle of its set
+    pixels and bit-packed along rows (`mask_bits`, `mask_size` at
+    `mask_origin`) - typically a small fraction of the frame at 1 bit per
+    pixel. `mask` rebuilds the full-frame uint8 array on access. Build
+    instances from a full-frame mask with `Detection.from_mask()`.
+    """
     label: str
     confidence: float
-    mask: np.ndarray  # Binary mask
+    mask_bits: np.ndarray  # Mask region packed 8 pixels per byte along rows (np.packbits)
+    mask_origin: Tuple[int, int]  # x, y of the mask region within the frame
+    mask_size: Tuple[int, int]  # height, width of the mask region
+    frame_shape: Tuple[int, int]  # height, width of the full mask
     bbox: Tuple[int, int, int, int]  # x1, y1, x2, y2
     center: Tuple[int, int]  # Center point of bounding box
     area: int  # Pixel area of mask
+    
+    @classmethod
+    def from_mask(
+        cls,
+        label: str,
+        confidence: float,
+        mask: np.ndarray,
+        bbox: Tuple[int, int, int, int],
+        center: Tuple[int, int],
+        area: int,
+    ) -> "Detection":
+        """Create a detection from a full-frame binary (bool or 0/1 uint8) mask, keeping only its occupied region."""
+        if mask.ndim > 2:
+            mask = mask.reshape(-1, *mask.shape[-2:]).max(axis=0)
+        if mask.dtype == np.bool_:
+            # Same bytes; OpenCV just doesn't take bool arrays
+            mask = mask.view(np.uint8)
+        elif mask.dtype != np.uint8:
+            mask = (mask > 0).view(np.uint8)
+        x, y, w, h = cv2.boundingRect(mask)
+        return cls(
+            label=label,
+            confidence=confidence,
+            # packbits returns a new array, so the full-frame mask can be freed
+            mask_bits=np.packbits(mask[y:y + h, x:x + w], axis=1),
+            mask_origin=(x, y),
+            mask_size=(h, w),
+            frame_shape=mask.shape[:2],
+            bbox=bbox,
+            center=center,
+            area=area,
+        )
+    
+    @classmethod
+    def from_packed(
+        cls,
+        label: str,
+        confidence: float,
+        bits: np.ndarray,
+        frame_shape: Tuple[int, int],
+        region: Tuple[int, int, int, int],
+        bbox: Tuple[int, int, int, int],
+        center: Tuple[int, int],
+        area: int,
+    ) -> "Detection":
+        """
+        Create a detection from a full-frame row-packed mask and its occupied region.
+        
+        `region` (x1, y1, x2, y2, end-exclusive) must be the tight bounding
+        rectangle of the set pixels, as computed by `_mask_extents()`.
+        """
+        x1, y1, x2, y2 = region
+        if x1 % 8 == 0:
+            # Byte-aligned: nothing is set to the right of x2, so the bytes can be kept as-is
+            mask_bits = bits[y1:y2, x1 // 8:(x2 + 7) // 8].copy()
+        else:
+            mask_bits = np.packbits(_unpack_window(bits, x1, y1, x2, y2), axis=1)
+        return cls(
+            label=label,
+            confidence=confidence,
+            mask_bits=mask_bits,
+            mask_origin=(x1, y1),
+            mask_size=(y2 - y1, x2 - x1),
+            frame_shape=frame_shape,
+            bbox=bbox,
+            center=center,
+            area=area,
+        )
+    
+    @property
+    def mask_roi(self) -> np.ndarray:
+        """Unpacked bool mask region."""
+        h, w = self.mask_size
+        if h == 0 or w == 0:
+            return np.zeros((h, w), dtype=np.bool_)
+        # unpackbits yields 0/1 bytes, which are valid bools as-is
+        return np.unpackbits(self.mask_bits, axis=1, count=w).view(np.bool_)
+    
+    @property
+    def mask(self) -> np.ndarray:
+        """
+        Full-frame bool mask, rebuilt from the stored region.
+        
+        Use `mask.view(np.uint8)` (no copy) where OpenCV needs uint8.
+        """
+        if self.mask_size == self.frame_shape:
+            return self.mask_roi
+        full = np.zeros(self.frame_shape, dtype=np.bool_)
+        x, y = self.mask_origin
+        h, w = self.mask_size
+        full[y:y + h, x:x + w] = self.mask_roi
+        return full
+    
+    def mask_window(self, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+        """Unpacked mask over frame coords [y1:y2, x1:x2], which must lie inside the region."""
+        x, y = self.mask_origin
+        return _unpack_window(self.mask_bits, x1 - x, y1 - y, x2 - x, y2 - y)
+
+
+def mask_area(mask: np.ndarray) -> int:
+    """Number of set pixels in a bool or uint8 mask."""
+    if mask.ndim == 2 and mask.dtype in (np.bool_, np.uint8):
+        return cv2.countNonZero(mask.view(np.uint8))
+    return int(np.count_nonzero(mask))
+
+
+def masks_overlap(a: Detection, b: Detection) -> bool:
+    """True if two detections' masks share any pixel."""
+    # Masks can only overlap where their occupied regions intersect
+    ax, ay = a.mask_origin
+    bx, by = b.mask_origin
+    ah, aw = a.mask_size
+    bh, bw = b.mask_size
+    x1, y1 = max(ax, bx), max(ay, by)
+    x2, y2 = min(ax + aw, bx + bw), min(ay + ah, by + bh)
+    if x2 <= x1 or y2 <= y1:
+        return False
+    
+    return bool(np.any(a.mask_window(x1, y1, x2, y2) & b.mask_window(x1, y1, x2, y2)))
+
+
+def _mask_regions(detections: List[Detection]) -> np.ndarray:
+    """(N, 4) x1, y1, x2, y2 (end-exclusive) of each detection's stored mask region."""
+    regions = np.empty((len(detections), 4), dtype=np.int32)
+    for i, detection in enumerate(detections):
+        x, y = detection.mask_origin
+        h, w = detection.mask_size
+        regions[i] = (x, y, x + w, y + h)
+    return regions
+
+
+def _mask_regions_intersect(objects_a: List[Detection], objects_b: List[Detection]) -> np.ndarray:
+    """Boolean (N, M) matrix: the mask regions of a and b intersect."""
+    a = _mask_regions(objects_a)[:, None, :]
+    b = _mask_regions(objects_b)[None, :, :]
+    return (
+        (np.maximum(a[..., 0], b[..., 0]) < np.minimum(a[..., 2], b[..., 2]))
+        & (np.maximum(a[..., 1], b[..., 1]) < np.minimum(a[..., 3], b[..., 3]))
+    )
 
 
 @dataclass
@@ -43,8 +309,27 @@ class StreamingSession:
     camera_id: str
     inference_session: Any  # The SAM3 streaming session object
     active_prompts: List[str] = field(default_factory=list)
+    prompts_key: frozenset = frozenset()  # Order-insensitive active_prompts, built once
     frame_count: int = 0
     last_update: float = 0
+    # (signature, frame size, confidence threshold, results) of the last frame run through the model
+    last_tracked: Optional[Tuple] = None
+    # Serializes use of inference_session, which carries tracker state between
+    # frames, when several inference threads get frames for the same camera
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+
+class _TracedVisionEncoder(torch.nn.Module):
+    """Runs a traced vision encoder and rebuilds the output object the model expects."""
+    
+    def __init__(self, traced: torch.jit.ScriptModule, output_cls: type):
+        super().__init__()
+        self.traced = traced
+        self.output_cls = output_cls
+    
+    def forward(self, pixel_values: torch.Tensor, **kwargs):
+        # The trace returns a plain dict of the encoder's output fields
+        return self.output_cls(**self.traced(pixel_values))
 
 
 class SAM3Service:
@@ -65,13 +350,30 @@ class SAM3Service:
         self.device = settings.SAM3_DEVICE
         self._lock = asyncio.Lock()
         self._initialized = False
-        self._inference_lock = threading.Lock()
+        # LRU of vision encoder outputs keyed by image content hash
+        self._embed_cache: "OrderedDict[bytes, Tuple[Any, List, Optional[np.ndarray], Optional[Any]]]" = OrderedDict()
+        self._batch_prompts = True  # Cleared if the model rejects batched prompt decoding
+        # Tokenized (and, where supported, text-encoded) prompt lists keyed by
+        # the prompt tuple; _text_features is None until probed on first use
+        self._prompt_cache: "OrderedDict[Tuple[str, ...], Tuple[Dict[str, Any], Optional[Any]]]" = OrderedDict()
+        self._text_features: Optional[bool] = None
         self._use_streaming = False  # Will be set during init based on model capabilities
         
+        self._embed_cache_lock = threading.Lock()
+        
+        # Fixed-size preprocessing parameters (see _init_pixel_buffer); the
+        # staging buffer, its upload event and the copy stream are per thread
+        self._pixel_size: Optional[Tuple[int, int]] = None
+        self._local = threading.local()
+        
         # Streaming sessions per camera
         self._streaming_sessions: Dict[str, StreamingSession] = {}
         self._session_lock = threading.Lock()
         
+        # Persistent inference threads fed by a job queue (see _worker_loop)
+        self._jobs: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._workers: List[threading.Thread] = []
+        
     async def initialize(self):
         """Initialize the SAM3 model."""
         if self._initialized:
@@ -83,6 +385,11 @@ class SAM3Service:
                 
             logger.info("Loading SAM3 model...", model_id=settings.SAM3_MODEL_ID)
             
+            if self.device == "cuda":
+                # Let any remaining float32 matmuls/convs use TF32 tensor cores
+                torch.backends.cuda.matmul.allow_tf32 = True
+                torch.backends.cudnn.allow_tf32 = True
+            
             # Try official sam3 package first, then transformers
             try:
                 # Try official Meta sam3 package
@@ -119,9 +426,18 @@ class SAM3Service:
                 self.model = Sam3Model.from_pretrained(
                     settings.SAM3_MODEL_ID,
                     token=settings.HF_TOKEN,
+                    torch_dtype=self._inference_dtype,
                 ).to(self.device)
                 
                 self.model.eval()
+                
+                self._init_pixel_buffer()
+                
+                if settings.SAM3_USE_COMPILE and self.device == "cuda":
+                    self._compile_vision_encoder()
+                elif settings.SAM3_JIT_TRACE:
+                    self._trace_vision_encoder()
+                
                 self._use_official_sam3 = False
                 self._initialized = True
                 
@@ -142,6 +458,226 @@ class SAM3Service:
                 self._use_official_sam3 = False
                 self._use_streaming = False
     
+    @property
+    def _inference_dtype(self) -> torch.dtype:
+        """Weight/activation dtype: SAM3_DTYPE on CUDA, float32 elsewhere."""
+        if self.device != "cuda":
+            return torch.float32
+        return getattr(torch, settings.SAM3_DTYPE, torch.float16)
+    
+    def _autocast(self):
+        """Mixed-precision context for model forward passes (no-op off CUDA)."""
+        if self.device != "cuda":
+            return contextlib.nullcontext()
+        return torch.autocast("cuda", dtype=self._inference_dtype)
+    
+    def _upload(self, tensors: List[torch.Tensor]) -> List[torch.Tensor]:
+        """
+        Copy CPU tensors to the GPU on a dedicated copy stream.
+        
+        Copies are staged through pinned memory and issued non-blocking, so
+        the calling thread can keep doing CPU work (e.g. tokenization) while
+        they run; kernels queued afterwards on the compute stream wait for them.
+        """
+        copy_stream = getattr(self._local, "copy_stream", None)
+        if copy_stream is None:
+            copy_stream = self._local.copy_stream = torch.cuda.Stream()
+        
+        with torch.cuda.stream(copy_stream):
+            uploaded = [t.pin_memory().to(self.device, non_blocking=True) for t in tensors]
+        
+        compute_stream = torch.cuda.current_stream()
+        compute_stream.wait_stream(copy_stream)
+        for tensor in uploaded:
+            # Allocated on the copy stream but consumed on the compute stream
+            tensor.record_stream(compute_stream)
+        return uploaded
+    
+    def _download(self, tensors: List[torch.Tensor]) -> List[np.ndarray]:
+        """
+        Copy device tensors to the host with a single synchronization.
+        
+        On CUDA each tensor is copied non-blocking into a persistent,
+        per-thread pinned buffer (grown as needed), so the transfers are DMA
+        without a pageable staging copy or a fresh pinned allocation per
+        frame. The returned arrays are views of those buffers and are only
+        valid until this thread's next download - copy anything kept longer.
+        """
+        if self.device != "cuda":
+            return [t.cpu().numpy() for t in tensors]
+        
+        buffers = getattr(self._local, "host_buffers", None)
+        if buffers is None:
+            buffers = self._local.host_buffers = []
+        
+        staged = []
+        for i, tensor in enumerate(tensors):
+            if i == len(buffers):
+                buffers.append(None)
+            buffer = buffers[i]
+            if buffer is None or buffer.dtype != tensor.dtype or buffer.numel() < tensor.numel():
+                buffer = buffers[i] = torch.empty(tensor.numel(), dtype=tensor.dtype, pin_memory=True)
+            host = buffer[:tensor.numel()].view(tensor.shape)
+            host.copy_(tensor, non_blocking=True)
+            staged.append(host)
+        
+        # Wait once, on this thread's stream, for all of the copies. A
+        # blocking-sync event puts the worker to sleep until the GPU signals
+        # instead of spinning a core, leaving the CPU to the other workers'
+        # kernel launches and the event loop.
+        done = getattr(self._local, "download_done", None)
+        if done is None:
+            done = self._local.download_done = torch.cuda.Event(blocking=True)
+        done.record()
+        done.synchronize()
+        return [t.numpy() for t in staged]
+    
+    def _to_device(self, inputs):
+        """Move processor outputs to the device, tensor by tensor on the copy stream."""
+        if self.device != "cuda":
+            return inputs.to(self.device)
+        keys = [key for key, value in inputs.items() if isinstance(value, torch.Tensor)]
+        for key, tensor in zip(keys, self._upload([inputs[key] for key in keys])):
+            inputs[key] = tensor
+        return inputs
+    
+    def _init_pixel_buffer(self):
+        """
+        Set up reusable (pinned) pixel_values buffers for the processor's fixed input size.
+        
+        Frames are then resized with OpenCV and normalized in place into a
+        per-thread buffer instead of the processor allocating and filling a
+        new tensor per call. Processors without a fixed height/width keep the
+        processor path.
+        """
+        try:
+            image_processor = self.processor.image_processor
+            height = int(image_processor.size["height"])
+            width = int(image_processor.size["width"])
+            scale = image_processor.rescale_factor if image_processor.do_rescale else 1.0
+            mean = image_processor.image_mean if image_processor.do_normalize else [0.0, 0.0, 0.0]
+            std = image_processor.image_std if image_processor.do_normalize else [1.0, 1.0, 1.0]
+        except (AttributeError, KeyError, TypeError):
+            logger.info("Processor has no fixed input size, using processor preprocessing")
+            return
+        
+        mean = torch.tensor(mean, dtype=torch.float32).view(3, 1, 1)
+        std = torch.tensor(std, dtype=torch.float32).view(3, 1, 1)
+        # (x * scale - mean) / std folded into one multiply and one subtract
+        self._pixel_gain = scale / std
+        self._pixel_offset = mean / std
+        self._pixel_size = (width, height)
+    
+    def _image_inputs(self, frame: np.ndarray) -> Tuple[torch.Tensor, List]:
+        """Preprocess an RGB frame; returns (pixel_values on the device, original_sizes)."""
+        if self._pixel_size is None:
+            inputs = self._to_device(self.processor(images=frame, return_tensors="pt"))
+            pixel_values = inputs['pixel_values'].to(self._inference_dtype)
+            return pixel_values, inputs.get("original_sizes").tolist()
+        
+        width, height = self._pixel_size
+        buffer = getattr(self._local, "pixel_buffer", None)
+        if buffer is None:
+            buffer = self._local.pixel_buffer = torch.empty(
+                (1, 3, height, width),
+                dtype=torch.float32,
+                pin_memory=self.device == "cuda",
+            )
+        
+        copy_done = getattr(self._local, "pixel_copy_done", None)
+        if copy_done is not None:
+            # The previous frame's async upload must finish before the buffer is rewritten
+            copy_done.synchronize()
+        
+        original_sizes = [list(frame.shape[:2])]
+        shrinking = frame.shape[1] > width or frame.shape[0] > height
+        resized = cv2.resize(
+            frame,
+            self._pixel_size,
+            interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR,
+        )
+        
+        pixels = buffer[0]
+        pixels.copy_(torch.from_numpy(resized).permute(2, 0, 1))
+        pixels.mul_(self._pixel_gain).sub_(self._pixel_offset)
+        
+        if self.device != "cuda":
+            return buffer.to(self.device), original_sizes
+        
+        pixel_values, = self._upload([buffer])
+        self._local.pixel_copy_done = torch.cuda.Event(blocking=True)
+        self._local.pixel_copy_done.record(self._local.copy_stream)
+        
+        # Normalized in float32 on the host, narrowed on the device
+        return pixel_values.to(self._inference_dtype), original_sizes
+    
+    def _compile_vision_encoder(self):
+        """
+        Compile the vision encoder with torch.compile and warm it up.
+        
+        The processor always resizes to the same input resolution, so one
+        static-shape compile (with CUDA graphs via max-autotune) covers every
+        frame. The warm-up pass pays the compile cost here instead of on the
+        first detection.
+        """
+        try:
+            compile_start = time.time()
+            self.model.vision_encoder = torch.compile(
+                self.model.vision_encoder,
+                mode="max-autotune",
+                dynamic=False,
+            )
+            
+            # Same preprocessing (and dtype) as real frames, so the graph is reused
+            dummy, _ = self._image_inputs(np.zeros((480, 640, 3), dtype=np.uint8))
+            with torch.inference_mode(), self._autocast():
+                self.model.vision_encoder(dummy)
+            
+            logger.info(
+                "SAM3 vision encoder compiled",
+                compile_s=round(time.time() - compile_start, 1),
+            )
+        except Exception as e:
+            # Eager mode still works; compilation is only an optimization
+            self.model.vision_encoder = getattr(
+                self.model.vision_encoder, "_orig_mod", self.model.vision_encoder
+            )
+            logger.warning("torch.compile failed, using eager vision encoder", error=str(e))
+    
+    def _trace_vision_encoder(self):
+        """
+        Replace the vision encoder with a TorchScript trace optimized for inference.
+        
+        The processor always produces the same input resolution, so a trace
+        taken on a dummy frame is valid for every frame. Variants that can't
+        be traced keep the eager module.
+        """
+        encoder = self.model.vision_encoder
+        try:
+            trace_start = time.time()
+            # Input shape never changes: allow a single static specialization so
+            # the executor keeps one optimized graph instead of a chain of
+            # profiled/bailout variants
+            torch.jit.set_fusion_strategy([("STATIC", 1)])
+            dummy, _ = self._image_inputs(np.zeros((480, 640, 3), dtype=np.uint8))
+            
+            with torch.no_grad():
+                expected = encoder(dummy)
+                traced = torch.jit.trace(encoder, dummy, strict=False)
+                traced = torch.jit.optimize_for_inference(traced)
+                wrapped = _TracedVisionEncoder(traced, type(expected))
+                # Fail here, not on the first frame, if the trace doesn't run
+                wrapped(dummy)
+            
+            self.model.vision_encoder = wrapped
+            logger.info(
+                "SAM3 vision encoder traced",
+                trace_s=round(time.time() - trace_start, 1),
+            )
+        except Exception as e:
+            self.model.vision_encoder = encoder
+            logger.warning("TorchScript trace failed, using eager vision encoder", error=str(e))
+    
     def _get_or_create_streaming_session(
         self,
         camera_id: str,
@@ -154,8 +690,14 @@ class SAM3Service:
         with self._session_lock:
             session = self._streaming_sessions.get(camera_id)
             
-            # Check if prompts changed - need to recreate session
-            if session and set(session.active_prompts) != set(prompts):
+            # Check if prompts changed - need to recreate session. The same
+            # prompts in the same order (the usual case) compare element-wise
+            # without building a set
+            if (
+                session
+                and prompts != session.active_prompts
+                and session.prompts_key != frozenset(prompts)
+            ):
                 logger.info(
                     "Prompts changed, recreating streaming session",
                     camera_id=camera_id,
@@ -171,7 +713,7 @@ class SAM3Service:
                         inference_device=self.device,
                         processing_device="cpu",
                         video_storage_device="cpu",
-                        dtype=torch.bfloat16 if self.device == "cuda" else torch.float32,
+                        dtype=self._inference_dtype,
                     )
                     
                     # Add all text prompts
@@ -185,6 +727,7 @@ class SAM3Service:
                         camera_id=camera_id,
                         inference_session=inference_session,
                         active_prompts=list(prompts),
+                        prompts_key=frozenset(prompts),
                         last_update=time.time(),
                     )
                     self._streaming_sessions[camera_id] = session
@@ -205,6 +748,20 @@ class SAM3Service:
             
             return session
     
+    def _release_device_memory(self):
+        """
+        Drop cached device tensors and return freed blocks to the driver after an OOM.
+        
+        The embedding and prompt caches are rebuilt on demand; emptying the
+        allocator cache also undoes fragmentation left by the failed pass.
+        """
+        with self._embed_cache_lock:
+            self._embed_cache.clear()
+            self._prompt_cache.clear()
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+        logger.warning("Out of GPU memory, released cached tensors")
+    
     def _reset_streaming_session(self, camera_id: str):
         """Reset a streaming session (useful after long pauses)."""
         with self._session_lock:
@@ -214,7 +771,7 @@ class SAM3Service:
     
     async def detect_objects(
         self,
-        image: Image.Image,
+        image: Union[Image.Image, np.ndarray],
         text_prompts: List[str],
         confidence_threshold: float = 0.5,
         camera_id: Optional[str] = None,
@@ -223,7 +780,7 @@ class SAM3Service:
         Detect objects in an image using text prompts.
         
         Args:
-            image: PIL Image to process
+            image: PIL Image, or an RGB uint8 (H, W, 3) array (skips the PIL round trip)
             text_prompts: List of text prompts describing objects to detect
             confidence_threshold: Minimum confidence for detection
             camera_id: Optional camera ID for streaming session (enables faster inference)
@@ -237,12 +794,9 @@ class SAM3Service:
         if self.model is None:
             return {prompt: [] for prompt in text_prompts}
         
-        loop = asyncio.get_running_loop()
-        
         # Use streaming mode if available and camera_id provided
         if self._use_streaming and camera_id:
-            results = await loop.run_in_executor(
-                _inference_executor,
+            results = await self._submit(
                 self._detect_streaming,
                 image,
                 text_prompts,
@@ -251,8 +805,7 @@ class SAM3Service:
             )
         else:
             # Use single-frame mode with caching for static objects
-            results = await loop.run_in_executor(
-                _inference_executor,
+            results = await self._submit(
                 self._detect_all_prompts,
                 image,
                 text_prompts,
@@ -262,9 +815,64 @@ class SAM3Service:
         
         return results
     
+    async def _submit(self, fn: Callable, *args) -> Any:
+        """Run fn(*args) on an inference thread and await its result."""
+        # One thread on CPU (extra threads only contend for cores); on CUDA a
+        # few, each with its own stream, so one camera's copies and decoder
+        # kernels can overlap another's vision encoder
+        workers = max(1, settings.SAM3_MAX_CONCURRENT_INFERENCE) if self.device == "cuda" else 1
+        self._workers = [w for w in self._workers if w.is_alive()]
+        while len(self._workers) < workers:
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"sam3-inference-{len(self._workers)}",
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._jobs.put((loop, future, fn, args))
+        return await future
+    
+    def _worker_loop(self):
+        """
+        Inference thread body: runs queued jobs one at a time.
+        
+        Each long-lived worker issues its GPU work on its own CUDA stream and
+        keeps its own staging buffer and copy stream; only the embedding
+        cache is shared (under _embed_cache_lock).
+        """
+        if self.device == "cuda":
+            torch.cuda.set_stream(torch.cuda.Stream())
+        
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            
+            loop, future, fn, args = job
+            if future.cancelled():
+                continue
+            try:
+                result = fn(*args)
+            except Exception as e:
+                loop.call_soon_threadsafe(_resolve_future, future, None, e)
+            else:
+                loop.call_soon_threadsafe(_resolve_future, future, result, None)
+    
+    def shutdown(self):
+        """Stop the inference threads after any queued jobs finish."""
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join(timeout=30.0)
+        self._workers = []
+    
     def _detect_streaming(
         self,
-        image: Image.Image,
+        image: Union[Image.Image, np.ndarray],
         text_prompts: List[str],
         confidence_threshold: float,
         camera_id: str,
@@ -273,68 +881,90 @@ class SAM3Service:
         Run detection using streaming video inference.
         Much faster for continuous video as prompts are encoded once.
         """
-        start_time = time.time()
+        start_time = time.perf_counter() if _DEBUG else 0.0
+        frame = _as_rgb_array(image)
         
-        with _inference_semaphore:
-            session = self._get_or_create_streaming_session(camera_id, text_prompts)
-            
-            if session is None:
-                # Fall back to single-frame mode
-                return self._detect_all_prompts(image, text_prompts, confidence_threshold)
+        session = self._get_or_create_streaming_session(camera_id, text_prompts)
+        
+        if session is None:
+            # Fall back to single-frame mode
+            return self._detect_all_prompts(frame, text_prompts, confidence_threshold)
+        
+        # Skip the model for frames that barely differ from the last tracked
+        # one. Comparing against the last tracked frame (not the previous
+        # frame) means slow drift still adds up to a model run.
+        tolerance = settings.SAM3_STREAMING_SKIP_TOLERANCE
+        signature = _frame_signature(frame) if tolerance > 0 else None
+        if signature is not None and session.last_tracked is not None:
+            last_signature, last_size, last_threshold, last_results = session.last_tracked
+            if (
+                last_size == frame.shape
+                and last_threshold == confidence_threshold
+                and np.abs(last_signature - signature).max() <= tolerance
+            ):
+                return {prompt: list(detections) for prompt, detections in last_results.items()}
+        
+        try:
+            # Process the frame into this thread's reusable pixel buffer
+            pixel_values, original_sizes = self._image_inputs(frame)
             
-            try:
-                with self._inference_lock:
-                    # Process the frame
-                    inputs = self.processor(
-                        images=image,
-                        device=self.device,
-                        return_tensors="pt",
-                    )
-                    
-                    # Run streaming inference
-                    with torch.inference_mode():
-                        model_outputs = self.model(
-                            inference_session=session.inference_session,
-                            frame=inputs.pixel_values[0],
-                            reverse=False,
-                        )
-                    
-                    # Post-process outputs
-                    processed_outputs = self.processor.postprocess_outputs(
-                        session.inference_session,
-                        model_outputs,
-                        original_sizes=inputs.original_sizes,
+            # Only the stateful session steps hold the per-camera lock; other
+            # cameras' sessions (and this frame's preprocessing and
+            # conversion) proceed on other threads in parallel
+            with session.lock:
+                # Run streaming inference
+                with torch.inference_mode():
+                    model_outputs = self.model(
+                        inference_session=session.inference_session,
+                        frame=pixel_values[0],
+                        reverse=False,
                     )
                 
+                # Post-process outputs
+                processed_outputs = self.processor.postprocess_outputs(
+                    session.inference_session,
+                    model_outputs,
+                    original_sizes=torch.tensor(original_sizes),
+                )
+                
                 session.frame_count += 1
                 session.last_update = time.time()
-                
-                # Convert to our Detection format
-                results = self._outputs_to_detections(
-                    processed_outputs,
-                    text_prompts,
+            
+            # Convert to our Detection format
+            results = self._outputs_to_detections(
+                processed_outputs,
+                text_prompts,
+                confidence_threshold,
+            )
+            if signature is not None:
+                session.last_tracked = (
+                    signature,
+                    frame.shape,
                     confidence_threshold,
+                    {prompt: list(detections) for prompt, detections in results.items()},
                 )
-                
-                elapsed = time.time() - start_time
+            
+            if _DEBUG:
                 logger.debug(
                     "Streaming inference complete",
                     camera_id=camera_id,
                     frame_count=session.frame_count,
-                    elapsed_ms=int(elapsed * 1000),
-                )
-                
-                return results
-                
-            except Exception as e:
-                logger.error(
-                    "Streaming inference failed, resetting session",
-                    camera_id=camera_id,
-                    error=str(e),
+                    elapsed_ms=int((time.perf_counter() - start_time) * 1000),
                 )
-                self._reset_streaming_session(camera_id)
-                # Fall back to single-frame
-                return self._detect_all_prompts(image, text_prompts, confidence_threshold)
+            
+            return results
+            
+        except Exception as e:
+            logger.error(
+                "Streaming inference failed, resetting session",
+                camera_id=camera_id,
+                error=str(e),
+            )
+            self._reset_streaming_session(camera_id)
+            if isinstance(e, torch.cuda.OutOfMemoryError):
+                self._release_device_memory()
+            # Fall back to single-frame
+            return self._detect_all_prompts(frame, text_prompts, confidence_threshold)
     
     def _outputs_to_detections(
         self,
@@ -355,47 +985,110 @@ class SAM3Service:
             if not object_ids:
                 return results
             
-            # Convert tensors to numpy
-            if hasattr(masks, 'cpu'):
-                masks = masks.cpu().numpy()
-            if hasattr(boxes, 'cpu'):
-                boxes = boxes.cpu().numpy()
-            if hasattr(scores, 'cpu'):
-                scores = scores.cpu().numpy()
-            
-            for i, obj_id in enumerate(object_ids):
-                score = float(scores[i]) if i < len(scores) else 1.0
-                if score < confidence_threshold:
-                    continue
-                
-                mask = masks[i] if i < len(masks) else np.zeros((1, 1), dtype=np.uint8)
-                box = boxes[i] if i < len(boxes) else [0, 0, 1, 1]
-                
-                # Get the label for this detection
-                label = labels[i] if i < len(labels) else prompts[0] if prompts else "object"
-                
-                x1, y1, x2, y2 = map(int, box)
-                center = ((x1 + x2) // 2, (y1 + y2) // 2)
-                area = int(np.sum(mask)) if mask.size > 0 else 0
-                
-                detection = Detection(
-                    label=label,
-                    confidence=score,
-                    mask=mask.astype(np.uint8) if mask.size > 0 else np.zeros((1, 1), dtype=np.uint8),
-                    bbox=(x1, y1, x2, y2),
-                    center=center,
-                    area=area,
-                )
-                
-                # Add to appropriate prompt results
-                if label in results:
-                    results[label].append(detection)
-                elif prompts:
-                    # If label doesn't match prompts exactly, try to match
-                    for prompt in prompts:
-                        if prompt.lower() in label.lower() or label.lower() in prompt.lower():
-                            results[prompt].append(detection)
-                            break
+            n = len(object_ids)
+            
+            # A dense (N, ..., H, W) mask tensor is binarized, measured and
+            # bit-packed on the device, as in _process_detection_results, so
+            # only 1 bit per pixel crosses PCIe
+            packed_masks = (
+                isinstance(masks, torch.Tensor)
+                and masks.dim() >= 3
+                and masks.shape[0] == n
+                and masks[0].numel() > 0
+            )
+            fields = [boxes, scores]
+            if packed_masks:
+                binary = masks.reshape(n, -1, *masks.shape[-2:]).amax(dim=1) > 0
+                frame_shape = tuple(binary.shape[-2:])
+                fields += [_pack_masks(binary), binary.sum(dim=(1, 2)), _mask_extents(binary)]
+            else:
+                fields.append(masks)
+            
+            # Convert tensors to numpy in one batch of copies
+            on_device = [i for i, value in enumerate(fields) if isinstance(value, torch.Tensor)]
+            for i, array in zip(on_device, self._download([fields[i] for i in on_device])):
+                fields[i] = array
+            boxes, scores = fields[:2]
+            
+            # Columnar scores and boxes, with the usual defaults for objects missing them
+            score_arr = np.ones(n, dtype=np.float32)
+            k = min(n, len(scores))
+            score_arr[:k] = np.asarray(scores[:k], dtype=np.float32).reshape(k)
+            box_arr = np.tile(np.array([0, 0, 1, 1], dtype=np.int32), (n, 1))
+            k = min(n, len(boxes))
+            box_arr[:k] = np.asarray(boxes[:k]).reshape(k, 4)
+            
+            kept = np.flatnonzero(score_arr >= confidence_threshold)
+            if kept.size == 0:
+                return results
+            centers = (box_arr[kept, :2] + box_arr[kept, 2:]) // 2
+            
+            default_label = prompts[0] if prompts else "object"
+            columns = (
+                [labels[i] if i < len(labels) else default_label for i in kept.tolist()],
+                score_arr[kept].tolist(),
+                box_arr[kept].tolist(),
+                centers.tolist(),
+            )
+            
+            if packed_masks:
+                packed, areas, regions = fields[2:]
+                detections = [
+                    Detection.from_packed(
+                        label=label,
+                        confidence=score,
+                        bits=bits,
+                        frame_shape=frame_shape,
+                        region=tuple(region),
+                        bbox=tuple(box),
+                        center=tuple(center),
+                        area=area,
+                    )
+                    for label, score, box, center, bits, region, area in zip(
+                        *columns, packed[kept], regions[kept].tolist(), areas[kept].tolist()
+                    )
+                ]
+            else:
+                masks = fields[2]
+                # Masks are used as-is (bool or 0/1); from_mask reads them without a uint8 copy
+                placeholder = np.zeros((1, 1), dtype=np.bool_)
+                kept_masks = [
+                    masks[i] if i < len(masks) and masks[i].size > 0 else placeholder
+                    for i in kept
+                ]
+                detections = [
+                    Detection.from_mask(
+                        label=label,
+                        confidence=score,
+                        mask=mask,
+                        bbox=tuple(box),
+                        center=tuple(center),
+                        area=mask_area(mask),
+                    )
+                    for label, score, box, center, mask in zip(*columns, kept_masks)
+                ]
+            
+            # Add to appropriate prompt results. Labels map to prompts through
+            # one dict: exact matches up front, other labels resolved by
+            # substring match the first time they are seen in this frame
+            label_to_prompt: Dict[str, Optional[str]] = {prompt: prompt for prompt in prompts}
+            lowered_prompts = None
+            for detection in detections:
+                label = detection.label
+                if label not in label_to_prompt:
+                    if lowered_prompts is None:
+                        lowered_prompts = [(prompt, prompt.lower()) for prompt in prompts]
+                    lowered = label.lower()
+                    label_to_prompt[label] = next(
+                        (
+                            prompt for prompt, prompt_lower in lowered_prompts
+                            if prompt_lower in lowered or lowered in prompt_lower
+                        ),
+                        None,
+                    )
+                prompt = label_to_prompt[label]
+                if prompt is not None:
+                    results[prompt].append(detection)
             
             # Log results
             for prompt, detections in results.items():
@@ -404,9 +1097,14 @@ class SAM3Service:
                         "SAM3 found objects (streaming)",
                         prompt=prompt,
                         count=len(detections),
-                        scores=[d.confidence for d in detections],
                     )
-                else:
+                    if _DEBUG:
+                        logger.debug(
+                            "SAM3 detection scores (streaming)",
+                            prompt=prompt,
+                            scores=[d.confidence for d in detections],
+                        )
+                elif _DEBUG:
                     logger.debug("SAM3 found no objects (streaming)", prompt=prompt)
             
         except Exception as e:
@@ -416,7 +1114,7 @@ class SAM3Service:
     
     def _detect_all_prompts(
         self,
-        image: Image.Image,
+        image: Union[Image.Image, np.ndarray],
         text_prompts: List[str],
         confidence_threshold: float,
         camera_id: Optional[str] = None,
@@ -426,20 +1124,22 @@ class SAM3Service:
         
         Vision encoder runs ONCE for all prompts (saves ~300ms per extra prompt).
         """
-        with _inference_semaphore:
-            return self._detect_with_shared_vision(
-                image, text_prompts, confidence_threshold
-            )
+        return self._detect_with_shared_vision(
+            _as_rgb_array(image), text_prompts, confidence_threshold
+        )
     
     def _detect_with_shared_vision(
         self,
-        image: Image.Image,
+        frame: np.ndarray,
         text_prompts: List[str],
         confidence_threshold: float,
     ) -> Dict[str, List[Detection]]:
         """
         Detect multiple prompts with shared vision encoding.
-        Vision encoder runs ONCE, then each prompt uses the cached vision features.
+        
+        The image is preprocessed and run through the vision encoder ONCE
+        (or not at all on an embedding cache hit); prompts are tokenized
+        together and decoded against the shared vision features.
         """
         results = {prompt: [] for prompt in text_prompts}
         
@@ -447,86 +1147,288 @@ class SAM3Service:
             return results
         
         try:
-            start_time = time.time()
-            
-            with self._inference_lock:
-                # Process image with first prompt to get pixel values
-                first_inputs = self.processor(
-                    images=image,
-                    text=text_prompts[0],
-                    return_tensors="pt",
-                ).to(self.device)
+            start_time = time.perf_counter() if _DEBUG else 0.0
+            
+            cache_key, signature, cached = self._lookup_embeddings(frame)
+            if cached is None:
+                # Start the frame upload first so it overlaps the tokenization below
+                pixel_values, target_sizes = self._image_inputs(frame)
+            
+            text_inputs = self._prompt_inputs(text_prompts)
+            
+            with torch.inference_mode(), self._autocast():
+                # Run vision encoder ONCE (or not at all for a frame seen recently)
+                if cached is not None:
+                    vision_embeds, target_sizes = self._use_cached_embeddings(cached)
+                else:
+                    vision_embeds = self.model.vision_encoder(pixel_values)
+                    self._cache_embeddings(cache_key, vision_embeds, target_sizes, signature)
+                vision_done = time.perf_counter() if _DEBUG else 0.0
                 
-                with torch.inference_mode():
-                    # Run vision encoder ONCE
-                    vision_start = time.time()
-                    vision_embeds = self.model.vision_encoder(first_inputs['pixel_values'])
-                    vision_time = (time.time() - vision_start) * 1000
-                    
-                    # Process each prompt with shared vision
-                    for prompt in text_prompts:
-                        prompt_start = time.time()
-                        
-                        # Get text inputs for this prompt
-                        text_inputs = self.processor(
-                            images=image,
-                            text=prompt,
-                            return_tensors="pt",
-                        ).to(self.device)
-                        
-                        # Run model with pre-computed vision embeddings
-                        outputs = self.model(
-                            vision_embeds=vision_embeds,
-                            input_ids=text_inputs['input_ids'],
-                            attention_mask=text_inputs['attention_mask'],
-                        )
-                        
-                        # Post-process results
-                        processed = self.processor.post_process_instance_segmentation(
-                            outputs,
-                            threshold=confidence_threshold,
-                            mask_threshold=0.5,
-                            target_sizes=first_inputs.get("original_sizes").tolist(),
-                        )[0]
-                        
-                        prompt_time = (time.time() - prompt_start) * 1000
-                        
-                        # Convert to Detection objects
-                        detections = self._process_detection_results(processed, prompt, confidence_threshold)
-                        results[prompt] = detections
-                        
-                        if detections:
-                            logger.info(
-                                "SAM3 found objects (shared vision)",
-                                prompt=prompt,
-                                count=len(detections),
-                                prompt_ms=int(prompt_time),
-                            )
-                        else:
-                            logger.debug(
-                                "SAM3 found no objects",
-                                prompt=prompt,
-                                prompt_ms=int(prompt_time),
-                            )
-            
-            total_time = (time.time() - start_time) * 1000
-            logger.debug(
-                "Shared vision detection complete",
-                prompts=len(text_prompts),
-                vision_ms=int(vision_time),
-                total_ms=int(total_time),
-            )
+                # Text encoder + mask decoder for all prompts
+                processed_all = self._decode_prompts(
+                    vision_embeds,
+                    text_inputs,
+                    target_sizes,
+                    confidence_threshold,
+                )
+                decode_done = time.perf_counter() if _DEBUG else 0.0
+            
+            for prompt, processed in zip(text_prompts, processed_all):
+                # Convert to Detection objects
+                detections = self._process_detection_results(processed, prompt, confidence_threshold)
+                results[prompt] = detections
+                
+                if detections:
+                    logger.info(
+                        "SAM3 found objects (shared vision)",
+                        prompt=prompt,
+                        count=len(detections),
+                    )
+                elif _DEBUG:
+                    logger.debug("SAM3 found no objects", prompt=prompt)
+            
+            if _DEBUG:
+                # Kernel launches are asynchronous, so the vision/decode split is
+                # approximate; the total includes the final device sync
+                logger.debug(
+                    "Shared vision detection complete",
+                    prompts=len(text_prompts),
+                    vision_cached=cached is not None,
+                    vision_ms=int((vision_done - start_time) * 1000),
+                    decode_ms=int((decode_done - vision_done) * 1000),
+                    total_ms=int((time.perf_counter() - start_time) * 1000),
+                )
             
         except Exception as e:
             logger.error("Shared vision detection failed", error=str(e))
             import traceback
             traceback.print_exc()
+            if isinstance(e, torch.cuda.OutOfMemoryError):
+                # Retry with the caches dropped rather than losing the frame
+                self._release_device_memory()
             # Fall back to individual detection
             for prompt in text_prompts:
-                results[prompt] = self._detect_single_prompt(image, prompt, confidence_threshold)
+                results[prompt] = self._detect_single_prompt(frame, prompt, confidence_threshold)
         
         return results
     
+    def _decode_prompts(
+        self,
+        vision_embeds: Any,
+        text_inputs: Any,
+        target_sizes: List,
+        confidence_threshold: float,
+    ) -> List[Dict]:
+        """
+        Run the text encoder and mask decoder for every prompt on shared vision features.
+        
+        All prompts go through one forward pass as a padded batch, with the
+        vision features broadcast (not copied) along the batch dimension.
+        Models that reject batched vision features fall back to one pass per
+        prompt, and batching isn't tried again.
+        
+        Returns:
+            Post-processed results, one per prompt in tokenization order
+        """
+        num_prompts = text_inputs['attention_mask'].shape[0]
+        
+        try:
+            return self._decode_prompt_batch(vision_embeds, text_inputs, target_sizes, confidence_threshold, num_prompts)
+        except Exception as e:
+            if 'text_embeds' not in text_inputs:
+                raise
+            # The model took precomputed text features but failed on them;
+            # go back to token ids (this frame falls back in the caller)
+            self._text_features = False
+            with self._embed_cache_lock:
+                self._prompt_cache.clear()
+            logger.warning("Decoding with cached text features failed, encoding prompts per frame", error=str(e))
+            raise
+    
+    def _decode_prompt_batch(
+        self,
+        vision_embeds: Any,
+        text_inputs: Dict[str, Any],
+        target_sizes: List,
+        confidence_threshold: float,
+        num_prompts: int,
+    ) -> List[Dict]:
+        if self._batch_prompts and num_prompts > 1:
+            try:
+                outputs = self.model(
+                    vision_embeds=_expand_batch(vision_embeds, num_prompts),
+                    **text_inputs,
+                )
+                return self.processor.post_process_instance_segmentation(
+                    outputs,
+                    threshold=confidence_threshold,
+                    mask_threshold=0.5,
+                    target_sizes=target_sizes * num_prompts,
+                )
+            except Exception as e:
+                if 'text_embeds' in text_inputs:
+                    raise
+                self._batch_prompts = False
+                logger.warning("Batched prompt decoding failed, decoding per prompt", error=str(e))
+        
+        processed = []
+        for i in range(num_prompts):
+            outputs = self.model(
+                vision_embeds=vision_embeds,
+                **{name: tensor[i:i + 1] for name, tensor in text_inputs.items()},
+            )
+            processed.extend(self.processor.post_process_instance_segmentation(
+                outputs,
+                threshold=confidence_threshold,
+                mask_threshold=0.5,
+                target_sizes=target_sizes,
+            ))
+        return processed
+    
+    def _prompt_inputs(self, text_prompts: List[str]) -> Dict[str, Any]:
+        """
+        Decoder text inputs for a prompt list, cached across frames and recordings.
+        
+        Prompts are tokenized as one padded batch and uploaded once per
+        distinct prompt list. When the model accepts precomputed text
+        features, the text encoder also runs only once per list and the
+        decoder gets `text_embeds` instead of `input_ids`.
+        """
+        key = tuple(text_prompts)
+        with self._embed_cache_lock:
+            cached = self._prompt_cache.get(key)
+            if cached is not None:
+                self._prompt_cache.move_to_end(key)
+        
+        if cached is not None:
+            text_inputs, ready = cached
+            if ready is not None:
+                # The entry may have been produced on another worker's stream
+                stream = torch.cuda.current_stream()
+                stream.wait_event(ready)
+                for tensor in text_inputs.values():
+                    tensor.record_stream(stream)
+            return text_inputs
+        
+        tokens = self._to_device(self.processor(
+            text=list(text_prompts),
+            padding=True,
+            return_tensors="pt",
+        ))
+        text_inputs = {
+            'input_ids': tokens['input_ids'],
+            'attention_mask': tokens['attention_mask'],
+        }
+        
+        if self._text_features is None:
+            self._text_features = (
+                hasattr(self.model, "get_text_features")
+                and "text_embeds" in inspect.signature(self.model.forward).parameters
+            )
+        if self._text_features:
+            try:
+                with torch.inference_mode(), self._autocast():
+                    text_embeds = self.model.get_text_features(**text_inputs)
+                if isinstance(text_embeds, torch.Tensor):
+                    text_inputs = {
+                        'text_embeds': text_embeds,
+                        'attention_mask': tokens['attention_mask'],
+                    }
+                else:
+                    self._text_features = False
+            except Exception as e:
+                self._text_features = False
+                logger.warning("Text feature precomputation failed, encoding prompts per frame", error=str(e))
+        
+        ready = None
+        if self.device == "cuda":
+            ready = torch.cuda.Event()
+            ready.record()
+        
+        with self._embed_cache_lock:
+            self._prompt_cache[key] = (text_inputs, ready)
+            while len(self._prompt_cache) > _PROMPT_CACHE_SIZE:
+                self._prompt_cache.popitem(last=False)
+        return text_inputs
+    
+    @staticmethod
+    def _embed_cache_key(frame: np.ndarray) -> bytes:
+        """Content hash of a frame, so re-queried frames hit the embedding cache."""
+        # Hashed straight from the array's buffer, without a tobytes() copy
+        digest = hashlib.blake2b(memoryview(frame), digest_size=16)
+        digest.update(repr(frame.shape).encode())
+        return digest.digest()
+    
+    def _lookup_embeddings(self, frame: np.ndarray) -> Tuple[bytes, Optional[np.ndarray], Optional[Tuple]]:
+        """
+        Find cached vision embeddings for a frame.
+        
+        Exact repeats are matched by content hash. With
+        SAM3_EMBED_CACHE_TOLERANCE > 0, a same-sized frame whose coarse
+        grayscale signature is within the tolerance of a cached one also
+        hits, so static scenes skip the vision encoder.
+        
+        Returns:
+            (cache key, frame signature or None, cached entry or None)
+        """
+        key = self._embed_cache_key(frame)
+        tolerance = settings.SAM3_EMBED_CACHE_TOLERANCE
+        signature = _frame_signature(frame) if tolerance > 0 and settings.SAM3_EMBED_CACHE_SIZE > 0 else None
+        
+        with self._embed_cache_lock:
+            cached = self._embed_cache.get(key)
+            
+            if cached is None and signature is not None:
+                original_sizes = [list(frame.shape[:2])]
+                # Most recent first: consecutive frames of a camera are the likeliest match
+                for other_key, entry in reversed(self._embed_cache.items()):
+                    other_signature = entry[2]
+                    if (
+                        other_signature is not None
+                        and entry[1] == original_sizes
+                        and np.abs(other_signature - signature).max() <= tolerance
+                    ):
+                        key, cached = other_key, entry
+                        break
+            
+            if cached is not None:
+                self._embed_cache.move_to_end(key)
+        return key, signature, cached
+    
+    def _use_cached_embeddings(self, cached: Tuple) -> Tuple[Any, List]:
+        """Make a cache entry safe to use on this thread's stream; returns (vision_embeds, target_sizes)."""
+        vision_embeds, target_sizes, _, ready = cached
+        if ready is not None:
+            # The entry may have been produced on another worker's stream
+            stream = torch.cuda.current_stream()
+            stream.wait_event(ready)
+            for tensor in _iter_tensors(vision_embeds):
+                tensor.record_stream(stream)
+        return vision_embeds, target_sizes
+    
+    def _cache_embeddings(
+        self,
+        key: bytes,
+        vision_embeds: Any,
+        target_sizes: List,
+        signature: Optional[np.ndarray] = None,
+    ):
+        """Store vision encoder output, evicting the least recently used entry."""
+        if settings.SAM3_EMBED_CACHE_SIZE <= 0:
+            return
+        
+        ready = None
+        if self.device == "cuda":
+            # Marks when the encoder kernels that produce vision_embeds finish
+            ready = torch.cuda.Event()
+            ready.record()
+        
+        with self._embed_cache_lock:
+            self._embed_cache[key] = (vision_embeds, target_sizes, signature, ready)
+            while len(self._embed_cache) > settings.SAM3_EMBED_CACHE_SIZE:
+                self._embed_cache.popitem(last=False)
+    
     def _process_detection_results(
         self,
         results: Dict,
@@ -536,97 +1438,99 @@ class SAM3Service:
         """Convert post-processed results to Detection objects."""
         detections = []
         
-        num_masks = len(results.get("masks", []))
-        if "masks" not in results or num_masks == 0:
+        masks = results.get("masks")
+        boxes = results.get("boxes")
+        scores = results.get("scores")
+        if masks is None or boxes is None or scores is None or len(masks) == 0:
             return detections
         
-        masks = results["masks"].cpu().numpy()
-        boxes = results["boxes"].cpu().numpy() if "boxes" in results else []
-        scores = results["scores"].cpu().numpy() if "scores" in results else []
+        # Filter, binarize, measure and bit-pack on the device so only the
+        # kept masks, at 1 bit per pixel, are copied to the host
+        keep = scores >= confidence_threshold
+        if not bool(keep.any()):
+            return detections
         
-        for i, (mask, box, score) in enumerate(zip(masks, boxes, scores)):
-            if score >= confidence_threshold:
-                x1, y1, x2, y2 = map(int, box)
-                center = ((x1 + x2) // 2, (y1 + y2) // 2)
-                area = int(np.sum(mask))
-                
-                detections.append(Detection(
-                    label=prompt,
-                    confidence=float(score),
-                    mask=mask.astype(np.uint8),
-                    bbox=(x1, y1, x2, y2),
-                    center=center,
-                    area=area,
-                ))
+        masks = masks[keep].bool()
+        frame_shape = tuple(masks.shape[-2:])
+        packed, areas, regions, boxes, scores = self._download([
+            _pack_masks(masks),
+            masks.sum(dim=(1, 2)),
+            _mask_extents(masks),
+            boxes[keep].to(torch.int32),
+            scores[keep].float(),
+        ])
+        
+        # Centers for all boxes at once, then one conversion to Python scalars
+        centers = (boxes[:, :2] + boxes[:, 2:]) // 2
         
-        return detections
+        return [
+            Detection.from_packed(
+                label=prompt,
+                confidence=score,
+                bits=bits,
+                frame_shape=frame_shape,
+                region=tuple(region),
+                bbox=tuple(box),
+                center=tuple(center),
+                area=area,
+            )
+            for bits, region, box, center, score, area in zip(
+                packed, regions.tolist(), boxes.tolist(), centers.tolist(), scores.tolist(), areas.tolist()
+            )
+        ]
     
     def _detect_single_prompt(
         self,
-        image: Image.Image,
+        frame: np.ndarray,
         text_prompt: str,
         confidence_threshold: float,
     ) -> List[Detection]:
         """Run detection for a single text prompt (synchronous)."""
         try:
-            with self._inference_lock:
-                # Process inputs
-                inputs = self.processor(
-                    images=image,
-                    text=text_prompt,
-                    return_tensors="pt",
-                ).to(self.device)
-                
-                # Run inference
-                with torch.inference_mode():
-                    outputs = self.model(**inputs)
-                
-                # Post-process results
-                results = self.processor.post_process_instance_segmentation(
-                    outputs,
-                    threshold=confidence_threshold,
-                    mask_threshold=0.5,
-                    target_sizes=inputs.get("original_sizes").tolist(),
-                )[0]
-            
-            detections = []
-            
-            num_masks = len(results.get("masks", []))
-            logger.debug(
-                "SAM3 detection result",
-                prompt=text_prompt,
-                num_masks=num_masks,
-                has_boxes="boxes" in results,
-                has_scores="scores" in results,
-            )
+            # Process inputs
+            inputs = self._to_device(self.processor(
+                images=frame,
+                text=text_prompt,
+                return_tensors="pt",
+            ))
+            inputs['pixel_values'] = inputs['pixel_values'].to(self._inference_dtype)
             
-            if "masks" in results and num_masks > 0:
-                masks = results["masks"].cpu().numpy()
-                boxes = results["boxes"].cpu().numpy() if "boxes" in results else []
-                scores = results["scores"].cpu().numpy() if "scores" in results else []
-                
+            # Run inference
+            with torch.inference_mode(), self._autocast():
+                outputs = self.model(**inputs)
+            
+            # Post-process results
+            results = self.processor.post_process_instance_segmentation(
+                outputs,
+                threshold=confidence_threshold,
+                mask_threshold=0.5,
+                target_sizes=inputs.get("original_sizes").tolist(),
+            )[0]
+            
+            if _DEBUG:
+                logger.debug(
+                    "SAM3 detection result",
+                    prompt=text_prompt,
+                    num_masks=len(results.get("masks", [])),
+                    has_boxes="boxes" in results,
+                    has_scores="scores" in results,
+                )
+            
+            detections = self._process_detection_results(results, text_prompt, confidence_threshold)
+            
+            if detections:
                 logger.info(
                     "SAM3 found objects",
                     prompt=text_prompt,
-                    count=len(masks),
-                    scores=[float(s) for s in scores],
+                    count=len(detections),
                 )
-                
-                for i, (mask, box, score) in enumerate(zip(masks, boxes, scores)):
-                    if score >= confidence_threshold:
-                        x1, y1, x2, y2 = map(int, box)
-                        center = ((x1 + x2) // 2, (y1 + y2) // 2)
-                        area = int(np.sum(mask))
-                        
-                        detections.append(Detection(
-                            label=text_prompt,
-                            confidence=float(score),
-                            mask=mask.astype(np.uint8),
-                            bbox=(x1, y1, x2, y2),
-                            center=center,
-                            area=area,
-                        ))
-            else:
+                if _DEBUG:
+                    logger.debug(
+                        "SAM3 detection scores",
+                        prompt=text_prompt,
+                        scores=[d.confidence for d in detections],
+                    )
+            elif _DEBUG:
                 logger.debug("SAM3 found no objects", prompt=text_prompt)
             
             return detections
@@ -679,26 +1583,30 @@ class SAM3Service:
             vertical_threshold = b_center_y + int(b_height * 0.2)
             cat_in_top_portion = a_center_y <= vertical_threshold
             
-            # Check mask overlap (most reliable - means cat is actually touching counter)
-            mask_overlap = np.sum(object_a.mask & object_b.mask) > 0
+            # Check mask overlap (most reliable - means cat is actually touching counter),
+            # but only when the box tests leave the answer open
+            mask_overlap = None
+            if horizontal_overlap and not cat_in_top_portion:
+                mask_overlap = masks_overlap(object_a, object_b)
             
-            is_over = horizontal_overlap and (cat_in_top_portion or mask_overlap)
+            is_over = horizontal_overlap and (cat_in_top_portion or bool(mask_overlap))
             
-            logger.debug(
-                "Spatial 'over' check",
-                cat_center_y=a_center_y,
-                counter_center_y=b_center_y,
-                vertical_threshold=vertical_threshold,
-                cat_in_top_portion=cat_in_top_portion,
-                mask_overlap=mask_overlap,
-                horizontal_overlap=horizontal_overlap,
-                result=is_over,
-            )
+            if _DEBUG:
+                logger.debug(
+                    "Spatial 'over' check",
+                    cat_center_y=a_center_y,
+                    counter_center_y=b_center_y,
+                    vertical_threshold=vertical_threshold,
+                    cat_in_top_portion=cat_in_top_portion,
+                    mask_overlap=mask_overlap,
+                    horizontal_overlap=horizontal_overlap,
+                    result=is_over,
+                )
             
             return is_over
             
         elif relationship == "on":
-            return np.sum(object_a.mask & object_b.mask) > 0
+            return masks_overlap(object_a, object_b)
             
         elif relationship == "inside":
             return (
@@ -709,11 +1617,73 @@ class SAM3Service:
         elif relationship == "near":
             a_cx, a_cy = object_a.center
             b_cx, b_cy = object_b.center
-            distance = np.sqrt((a_cx - b_cx)**2 + (a_cy - b_cy)**2)
-            return distance < 100
+            # Compare squared distances: no sqrt, and plain ints instead of NumPy scalars
+            dx = a_cx - b_cx
+            dy = a_cy - b_cy
+            return dx * dx + dy * dy < 100 * 100
             
         return False
     
+    def spatial_relationship_matrix(
+        self,
+        objects_a: List[Detection],
+        objects_b: List[Detection],
+        relationship: str,
+        a_boxes: Optional[np.ndarray] = None,
+        b_boxes: Optional[np.ndarray] = None,
+        a_centers: Optional[np.ndarray] = None,
+        b_centers: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Vectorized check_spatial_relationship() over every (a, b) pair.
+        
+        Bounding-box tests are broadcast over all pairs at once; mask
+        overlap is only computed for pairs the box tests can't decide.
+        Callers that already hold the boxes/centers as (N, 4) / (N, 2)
+        arrays can pass them to skip rebuilding them from the detections.
+        
+        Returns:
+            Boolean array of shape (len(objects_a), len(objects_b))
+        """
+        result = np.zeros((len(objects_a), len(objects_b)), dtype=bool)
+        if result.size == 0:
+            return result
+        
+        if a_boxes is None:
+            a_boxes = np.asarray([d.bbox for d in objects_a], dtype=np.float32)
+        if b_boxes is None:
+            b_boxes = np.asarray([d.bbox for d in objects_b], dtype=np.float32)
+        if a_centers is None:
+            a_centers = np.asarray([d.center for d in objects_a], dtype=np.float32)
+        if b_centers is None:
+            b_centers = np.asarray([d.center for d in objects_b], dtype=np.float32)
+        
+        if relationship == "over":
+            box_test = spatial_kernels.over_pairs(a_centers, b_boxes)
+            result = box_test == spatial_kernels.OVER_YES
+            # Mask overlap only matters where the box test alone says no
+            needs_mask = box_test == spatial_kernels.OVER_NEEDS_MASK
+            if needs_mask.any():
+                needs_mask &= _mask_regions_intersect(objects_a, objects_b)
+                for i, j in np.argwhere(needs_mask):
+                    result[i, j] = masks_overlap(objects_a[i], objects_b[j])
+            return result
+        
+        elif relationship == "on":
+            # Pairs whose mask regions don't intersect are ruled out in one
+            # broadcast; only the rest need a pixel-level check
+            for i, j in np.argwhere(_mask_regions_intersect(objects_a, objects_b)):
+                result[i, j] = masks_overlap(objects_a[i], objects_b[j])
+            return result
+        
+        elif relationship == "inside":
+            return spatial_kernels.inside_pairs(a_boxes, b_boxes)
+        
+        elif relationship == "near":
+            return spatial_kernels.near_pairs(a_centers, b_centers, 100)
+        
+        return result
+    
     def masks_to_visualization(
         self,
         image: Image.Image,
@@ -721,28 +1691,33 @@ class SAM3Service:
         alpha: float = 0.5,
     ) -> Image.Image:
         """Create a visualization of detections overlaid on the image."""
-        import matplotlib
-        
         result = image.convert("RGBA")
         
         n_masks = len(detections)
         if n_masks == 0:
             return result
         
-        cmap = matplotlib.colormaps.get_cmap("rainbow").resampled(n_masks)
-        colors = [
-            tuple(int(c * 255) for c in cmap(i)[:3])
-            for i in range(n_masks)
-        ]
+        # n colors evenly spaced across the rainbow
+        colors = _RAINBOW_LUT[np.linspace(0, 255, n_masks).astype(np.intp)]
         
-        for detection, color in zip(detections, colors):
-            mask = detection.mask * 255
-            mask_img = Image.fromarray(mask.astype(np.uint8))
-            
-            overlay = Image.new("RGBA", result.size, color + (0,))
-            alpha_mask = mask_img.point(lambda v: int(v * alpha))
-            overlay.putalpha(alpha_mask)
-            
-            result = Image.alpha_composite(result, overlay)
+        # Index of the mask drawn on top of each pixel (-1 for none), painted
+        # from each detection's stored region only; where masks overlap the
+        # last detection's color wins (it used to be drawn on top)
+        width, height = result.size
+        top = np.full((height, width), -1, dtype=np.int32)
+        for i, detection in enumerate(detections):
+            if detection.frame_shape != (height, width):
+                continue
+            x, y = detection.mask_origin
+            h, w = detection.mask_size
+            top[y:y + h, x:x + w][detection.mask_roi] = i
         
-        return result
+        covered = top >= 0
+        if not covered.any():
+            return result
+        
+        # Blend the covered pixels in place in one pass; the frame's own alpha is kept
+        pixels = np.array(result)
+        blended = pixels[covered, :3] * (1.0 - alpha) + colors[top[covered]] * alpha
+        pixels[covered, :3] = blended.astype(np.uint8)
+        return Image.fromarray(pixels, "RGBA")
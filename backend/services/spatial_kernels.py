@@ -0,0 +1,162 @@
+"""
+Pairwise bounding-box kernels for spatial relationship rules.
+
+Each kernel compares every box/center of one detection set against every
+box/center of another and returns an (N, M) matrix. With Numba installed
+the kernels are JIT-compiled; otherwise the equivalent broadcast NumPy
+expressions are used. The matrices are tiny (a handful of detections per
+label), so the kernels are serial: they are already called from the rule
+engine's worker threads, and concurrent parallel-region launches are not
+safe on Numba's default threading layer.
+"""
+
+import os
+
+import numpy as np
+import structlog
+
+logger = structlog.get_logger()
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# over_pairs() results
+OVER_NO = 0
+OVER_YES = 1
+OVER_NEEDS_MASK = 2  # Horizontally aligned but below the top portion: decided by mask overlap
+
+
+def _over_pairs_numpy(a_centers: np.ndarray, b_boxes: np.ndarray) -> np.ndarray:
+    a_cx = a_centers[:, 0, None]
+    a_cy = a_centers[:, 1, None]
+    b_x1, b_y1, b_x2, b_y2 = (b_boxes[None, :, i] for i in range(4))
+    
+    horizontal_overlap = (b_x1 <= a_cx) & (a_cx <= b_x2)
+    vertical_threshold = (b_y1 + b_y2) // 2 + np.trunc((b_y2 - b_y1) * 0.2)
+    in_top_portion = a_cy <= vertical_threshold
+    
+    return np.where(
+        horizontal_overlap,
+        np.where(in_top_portion, OVER_YES, OVER_NEEDS_MASK),
+        OVER_NO,
+    ).astype(np.int8)
+
+
+def _inside_pairs_numpy(a_boxes: np.ndarray, b_boxes: np.ndarray) -> np.ndarray:
+    return (
+        (a_boxes[:, None, 0] >= b_boxes[None, :, 0])
+        & (a_boxes[:, None, 1] >= b_boxes[None, :, 1])
+        & (a_boxes[:, None, 2] <= b_boxes[None, :, 2])
+        & (a_boxes[:, None, 3] <= b_boxes[None, :, 3])
+    )
+
+
+def _near_pairs_numpy(a_centers: np.ndarray, b_centers: np.ndarray, max_distance: float) -> np.ndarray:
+    deltas = a_centers[:, None, :] - b_centers[None, :, :]
+    return np.sum(deltas * deltas, axis=-1) < max_distance * max_distance
+
+
+# Numba writes its on-disk cache next to this module unless NUMBA_CACHE_DIR is
+# set; skip caching on read-only installs rather than fail at import
+_JIT_CACHE = bool(os.environ.get("NUMBA_CACHE_DIR")) or os.access(os.path.dirname(os.path.abspath(__file__)), os.W_OK)
+
+if NUMBA_AVAILABLE:
+
+    @njit(cache=_JIT_CACHE)
+    def _over_pairs_jit(a_centers, b_boxes):
+        n = a_centers.shape[0]
+        m = b_boxes.shape[0]
+        out = np.zeros((n, m), dtype=np.int8)
+        for i in range(n):
+            cx = a_centers[i, 0]
+            cy = a_centers[i, 1]
+            for j in range(m):
+                x1 = b_boxes[j, 0]
+                y1 = b_boxes[j, 1]
+                x2 = b_boxes[j, 2]
+                y2 = b_boxes[j, 3]
+                if x1 <= cx and cx <= x2:
+                    threshold = np.floor((y1 + y2) / 2) + np.trunc((y2 - y1) * 0.2)
+                    out[i, j] = OVER_YES if cy <= threshold else OVER_NEEDS_MASK
+        return out
+    
+    @njit(cache=_JIT_CACHE)
+    def _inside_pairs_jit(a_boxes, b_boxes):
+        n = a_boxes.shape[0]
+        m = b_boxes.shape[0]
+        out = np.zeros((n, m), dtype=np.bool_)
+        for i in range(n):
+            for j in range(m):
+                out[i, j] = (
+                    a_boxes[i, 0] >= b_boxes[j, 0] and a_boxes[i, 1] >= b_boxes[j, 1]
+                    and a_boxes[i, 2] <= b_boxes[j, 2] and a_boxes[i, 3] <= b_boxes[j, 3]
+                )
+        return out
+    
+    @njit(cache=_JIT_CACHE)
+    def _near_pairs_jit(a_centers, b_centers, max_distance):
+        n = a_centers.shape[0]
+        m = b_centers.shape[0]
+        limit = max_distance * max_distance
+        out = np.zeros((n, m), dtype=np.bool_)
+        for i in range(n):
+            for j in range(m):
+                dx = a_centers[i, 0] - b_centers[j, 0]
+                dy = a_centers[i, 1] - b_centers[j, 1]
+                out[i, j] = dx * dx + dy * dy < limit
+        return out
+    
+    _over_pairs = _over_pairs_jit
+    _inside_pairs = _inside_pairs_jit
+    _near_pairs = _near_pairs_jit
+else:
+    _over_pairs = _over_pairs_numpy
+    _inside_pairs = _inside_pairs_numpy
+    _near_pairs = _near_pairs_numpy
+
+
+def _prepare(arr: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(arr, dtype=np.float32)
+
+
+def over_pairs(a_centers: np.ndarray, b_boxes: np.ndarray) -> np.ndarray:
+    """
+    Box part of the "over" relationship.
+    
+    Returns:
+        int8 (N, M) matrix of OVER_NO / OVER_YES / OVER_NEEDS_MASK
+    """
+    return _over_pairs(_prepare(a_centers), _prepare(b_boxes))
+
+
+def inside_pairs(a_boxes: np.ndarray, b_boxes: np.ndarray) -> np.ndarray:
+    """Boolean (N, M) matrix: box a fully contained in box b."""
+    return _inside_pairs(_prepare(a_boxes), _prepare(b_boxes))
+
+
+def near_pairs(a_centers: np.ndarray, b_centers: np.ndarray, max_distance: float) -> np.ndarray:
+    """Boolean (N, M) matrix: centers closer than max_distance."""
+    return _near_pairs(_prepare(a_centers), _prepare(b_centers), np.float32(max_distance))
+
+
+def warm_up():
+    """Trigger JIT compilation now rather than on the first alert-worthy frame."""
+    global _over_pairs, _inside_pairs, _near_pairs
+    if not NUMBA_AVAILABLE:
+        return
+    boxes = np.zeros((1, 4), dtype=np.float32)
+    centers = np.zeros((1, 2), dtype=np.float32)
+    try:
+        over_pairs(centers, boxes)
+        inside_pairs(boxes, boxes)
+        near_pairs(centers, centers, 100)
+        logger.info("Spatial kernels compiled")
+    except Exception as e:
+        # Keep rules working on the NumPy versions
+        _over_pairs = _over_pairs_numpy
+        _inside_pairs = _inside_pairs_numpy
+        _near_pairs = _near_pairs_numpy
+        logger.warning("Spatial kernel compilation failed, using NumPy", error=str(e))
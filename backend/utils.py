@@ -23,12 +23,13 @@ def to_utc_isoformat(dt: Optional[datetime]) -> Optional[str]:
     if dt is None:
         return None
     
-    # If the datetime is naive, assume it's UTC (our convention)
-    # If it's timezone-aware, convert to UTC first
-    if dt.tzinfo is not None:
-        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    # If the datetime is naive, assume it's UTC (our convention); this is
+    # every database value, so it is formatted without any conversion
+    if dt.tzinfo is None:
+        return dt.isoformat() + "Z"
     
-    return dt.isoformat() + "Z"
+    # If it's timezone-aware, convert to UTC first
+    return dt.astimezone(timezone.utc).replace(tzinfo=None).isoformat() + "Z"
 
 
 def from_utc_isoformat(iso_string: Optional[str]) -> Optional[datetime]:
@@ -60,5 +61,6 @@ def utc_now() -> datetime:
     
     This is the standard way to get "now" for database storage.
     """
-    return datetime.utcnow()
+    # datetime.utcnow() is deprecated since Python 3.12
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
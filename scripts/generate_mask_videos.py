@@ -6,7 +6,7 @@ This processes each recording through SAM3 and generates a video
 with detection masks overlaid on every frame.
 
 Usage:
-    python scripts/generate_mask_videos.py [--recording-id ID] [--limit N]
+    python scripts/generate_mask_videos.py [--recording-id ID] [--limit N] [--concurrency N] [--prefetch N]
 """
 
 import asyncio
@@ -14,16 +14,18 @@ import argparse
 import sys
 import os
 import json
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from sqlalchemy import select, text
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, text, update
 
-from backend.database import engine, AsyncSessionLocal, Recording, Alert
+from backend.database import engine, AsyncSessionLocal, Recording, Alert, Rule
 from backend.config import settings
 from backend.services.sam3_service import SAM3Service
 from backend.services.mask_video_service import MaskVideoService
@@ -33,6 +35,20 @@ import structlog
 # Progress file for UI tracking
 PROGRESS_FILE = settings.RECORDINGS_PATH / "mask_generation_progress.json"
 
+# Finished recordings are written to the database in batches of this size
+DB_FLUSH_EVERY = 16
+
+# Minimum seconds between mid-recording progress file writes
+PROGRESS_INTERVAL = 0.25
+_last_progress_write = 0.0
+
+# Recordings run concurrently, so the file reports all of them together:
+# (filename, current_frame, total_frames) per in-flight batch index, plus
+# the number already finished
+_active_progress: dict[int, tuple[str, int, int]] = {}
+_finished_recordings = 0
+_progress_lock = threading.Lock()
+
 
 def write_progress(
     current_recording: int,
@@ -42,23 +58,66 @@ def write_progress(
     total_frames: int = 0,
     status: str = "processing",
 ):
-    """Write progress to file for UI tracking."""
-    try:
-        progress = {
-            "status": status,
-            "current_recording": current_recording,
-            "total_recordings": total_recordings,
-            "current_filename": current_filename,
-            "current_frame": current_frame,
-            "total_frames": total_frames,
-            "percent_video": round(100 * current_frame / total_frames, 1) if total_frames > 0 else 0,
-            "percent_overall": round(100 * (current_recording - 1 + (current_frame / total_frames if total_frames > 0 else 0)) / total_recordings, 1) if total_recordings > 0 else 0,
-            "updated_at": datetime.utcnow().isoformat(),
-        }
-        with open(PROGRESS_FILE, 'w') as f:
-            json.dump(progress, f)
-    except Exception:
-        pass
+    """
+    Record a recording's progress and write the batch progress file for UI tracking.
+    
+    Frame counts and percentages are aggregated over every in-flight
+    recording. Per-frame updates are throttled to PROGRESS_INTERVAL; status
+    changes and the first/last frame of a recording are always written. The
+    file is replaced atomically so readers never see half-written JSON.
+    """
+    global _last_progress_write
+    with _progress_lock:
+        if status == "processing":
+            _active_progress[current_recording] = (current_filename, current_frame, total_frames)
+        
+        now = time.monotonic()
+        if (
+            status == "processing"
+            and current_frame != total_frames
+            and now - _last_progress_write < PROGRESS_INTERVAL
+        ):
+            return
+        _last_progress_write = now
+        
+        active = sorted(_active_progress.items())
+        frames_done = sum(frame for _, (_, frame, _) in active)
+        frames_total = sum(total for _, (_, _, total) in active)
+        recordings_done = _finished_recordings + sum(
+            frame / total for _, (_, frame, total) in active if total > 0
+        )
+        
+        try:
+            progress = {
+                "status": status,
+                # Recordings started so far
+                "current_recording": _finished_recordings + len(active) if active else current_recording,
+                "total_recordings": total_recordings,
+                "current_filename": ", ".join(name for _, (name, _, _) in active if name) or current_filename,
+                "current_frame": frames_done,
+                "total_frames": frames_total,
+                "percent_video": round(100 * frames_done / frames_total, 1) if frames_total > 0 else 0,
+                "percent_overall": round(100 * recordings_done / total_recordings, 1) if total_recordings > 0 else 0,
+                "active_recordings": [
+                    {"index": index, "filename": name, "current_frame": frame, "total_frames": total}
+                    for index, (name, frame, total) in active
+                ],
+                "updated_at": datetime.utcnow().isoformat(),
+            }
+            tmp_path = PROGRESS_FILE.with_suffix(".json.tmp")
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(progress))
+            os.replace(tmp_path, PROGRESS_FILE)
+        except Exception:
+            pass
+
+
+def finish_progress(current_recording: int):
+    """Move a recording from in flight to finished (success or failure) in the batch progress."""
+    global _finished_recordings
+    with _progress_lock:
+        _active_progress.pop(current_recording, None)
+        _finished_recordings += 1
 
 
 def clear_progress():
@@ -80,68 +139,102 @@ logger = structlog.get_logger()
 async def add_mask_video_column():
     """Add mask_video_path column if it doesn't exist."""
     async with engine.begin() as conn:
-        result = await conn.execute(text("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='recordings' AND column_name='mask_video_path'
-        """))
-        
-        if result.fetchone() is None:
-            await conn.execute(text(
-                'ALTER TABLE recordings ADD COLUMN mask_video_path VARCHAR'
-            ))
-            logger.info("Added mask_video_path column")
-        else:
-            logger.info("mask_video_path column already exists")
+        # One idempotent statement: no catalog lookup, and concurrent runs
+        # can't both see the column missing and race the ALTER
+        await conn.execute(text(
+            'ALTER TABLE recordings ADD COLUMN IF NOT EXISTS mask_video_path VARCHAR'
+        ))
+    logger.info("mask_video_path column ready")
+
+
+def existing_files(filepaths: list[str]) -> set[str]:
+    """
+    Return the subset of filepaths that exist (blocking).
+    
+    Lists each parent directory once instead of stat'ing every file, so
+    the syscall count scales with directories rather than recordings.
+    """
+    by_dir: dict[str, list[str]] = {}
+    for filepath in filepaths:
+        by_dir.setdefault(os.path.dirname(filepath), []).append(filepath)
+    
+    existing = set()
+    for directory, paths in by_dir.items():
+        try:
+            with os.scandir(directory or ".") as entries:
+                present = {entry.name for entry in entries}
+        except OSError:
+            continue
+        existing.update(p for p in paths if os.path.basename(p) in present)
+    return existing
 
 
-async def get_recordings_to_process(recording_id: str = None, limit: int = None):
+async def get_recordings_to_process(session, recording_id: str = None, limit: int = None):
     """Get recordings that need mask video generation."""
-    async with AsyncSessionLocal() as session:
-        query = (
-            select(Recording)
-            .options(
-                selectinload(Recording.alert).selectinload(Alert.rule)
-            )
-            .where(Recording.mask_video_path == None)
+    # Only the columns the batch needs, in one query; recordings without
+    # an alert or rule still come back (with null rule columns)
+    query = (
+        select(
+            Recording.id,
+            Recording.filepath,
+            Recording.filename,
+            Recording.alert_id,
+            Rule.id.label("rule_id"),
+            Rule.name.label("rule_name"),
+            Rule.primary_target,
+            Rule.secondary_target,
         )
-        
-        if recording_id:
-            query = query.where(Recording.id == recording_id)
-        
-        if limit:
-            query = query.limit(limit)
-        
-        result = await session.execute(query)
-        recordings = result.unique().scalars().all()
-        
-        # Detach from session so we can use them later
-        return [
-            {
-                "id": r.id,
-                "filepath": r.filepath,
-                "filename": r.filename,
-                "alert_id": r.alert_id,
-                "rule_name": r.alert.rule.name if r.alert and r.alert.rule else "Unknown",
-                "primary_target": r.alert.rule.primary_target if r.alert and r.alert.rule else "cat",
-                "secondary_target": r.alert.rule.secondary_target if r.alert and r.alert.rule else None,
-            }
-            for r in recordings
-            if r.filepath and Path(r.filepath).exists()
-        ]
+        .outerjoin(Alert, Recording.alert_id == Alert.id)
+        .outerjoin(Rule, Alert.rule_id == Rule.id)
+        .where(Recording.mask_video_path == None)
+        .where(Recording.filepath != None)
+    )
+    
+    if recording_id:
+        query = query.where(Recording.id == recording_id)
+    
+    if limit:
+        query = query.limit(limit)
+    
+    result = await session.execute(query)
+    candidates = [
+        {
+            "id": row["id"],
+            "filepath": row["filepath"],
+            "filename": row["filename"],
+            "alert_id": row["alert_id"],
+            # No rule (or no alert): same defaults as before
+            "rule_name": row["rule_name"] if row["rule_id"] is not None else "Unknown",
+            "primary_target": row["primary_target"] if row["rule_id"] is not None else "cat",
+            "secondary_target": row["secondary_target"],
+        }
+        for row in result.mappings()
+    ]
+    # End the read transaction so the connection goes back to the pool
+    # while the (long) batch runs
+    await session.commit()
+    
+    existing = await asyncio.to_thread(existing_files, [r["filepath"] for r in candidates])
+    # Group recordings with the same targets so SAM3's cached prompt
+    # encodings are reused back to back instead of evicted and rebuilt
+    return sorted(
+        (r for r in candidates if r["filepath"] in existing),
+        key=lambda r: (r["primary_target"] or "", r["secondary_target"] or ""),
+    )
 
 
-async def update_recording_mask_path(recording_id: str, mask_video_path: str):
-    """Update the recording with the mask video path."""
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(Recording).where(Recording.id == recording_id)
-        )
-        recording = result.scalar_one_or_none()
-        if recording:
-            recording.mask_video_path = mask_video_path
-            await session.commit()
-            logger.info("Updated recording", recording_id=recording_id, mask_video_path=mask_video_path)
+async def update_recording_mask_paths(session, updates: list[tuple[str, str]]):
+    """Set mask_video_path for a batch of (recording_id, mask_video_path) pairs in one transaction."""
+    if not updates:
+        return
+    
+    # ORM bulk UPDATE by primary key: one executemany, no SELECT
+    await session.execute(
+        update(Recording),
+        [{"id": recording_id, "mask_video_path": path} for recording_id, path in updates],
+    )
+    await session.commit()
+    logger.info("Updated recordings", count=len(updates))
 
 
 async def process_recording(
@@ -149,8 +242,15 @@ async def process_recording(
     recording: dict,
     index: int,
     total: int,
-):
-    """Process a single recording to generate mask video."""
+    prefetch: int = 4,
+) -> Optional[str]:
+    """
+    Process a single recording to generate mask video.
+    
+    Returns:
+        Path to the mask video, or None if generation failed. The caller
+        records it in the database.
+    """
     video_path = Path(recording["filepath"])
     output_path = video_path.with_stem(video_path.stem + "_mask")
     
@@ -180,28 +280,33 @@ async def process_recording(
         secondary_target=recording["secondary_target"],
         rule_name=recording["rule_name"],
         progress_callback=progress_callback,
+        prefetch=prefetch,
     )
     
     elapsed = (datetime.now() - start_time).total_seconds()
     
     if result:
-        await update_recording_mask_path(recording["id"], result)
         logger.info(
             "Recording processed successfully",
             recording_id=recording["id"],
             time_seconds=f"{elapsed:.1f}",
             output=result,
         )
-        return True
     else:
         logger.error(
             "Failed to process recording",
             recording_id=recording["id"],
         )
-        return False
+    return result
 
 
-async def main(recording_id: str = None, limit: int = None):
+async def main(
+    recording_id: str = None,
+    limit: int = None,
+    concurrency: int = 2,
+    prefetch: int = 4,
+    compile_model: bool = True,
+):
     """Main entry point for batch processing."""
     
     print("=" * 70)
@@ -212,38 +317,69 @@ async def main(recording_id: str = None, limit: int = None):
     # Ensure database column exists
     await add_mask_video_column()
     
-    # Initialize SAM3 service
+    # Initialize SAM3 service. Autocast and TF32 are already on for CUDA;
+    # a batch run amortizes the one-off compile (and its warm-up pass), so
+    # compile the vision encoder here regardless of the server's setting
     logger.info("Initializing SAM3 model...")
+    settings.SAM3_USE_COMPILE = compile_model
     sam3_service = SAM3Service()
     await sam3_service.initialize()
     
     mask_service = MaskVideoService(sam3_service)
     
-    # Get recordings to process
-    logger.info("Fetching recordings to process...")
-    recordings = await get_recordings_to_process(recording_id, limit)
-    
-    if not recordings:
-        logger.info("No recordings found that need mask video generation")
-        return
-    
-    logger.info(f"Found {len(recordings)} recordings to process")
-    
-    # Process each recording
-    success_count = 0
-    error_count = 0
-    total_start = datetime.now()
-    
-    for i, recording in enumerate(recordings, 1):
+    async with AsyncSessionLocal() as session:
+        # Get recordings to process
+        logger.info("Fetching recordings to process...")
+        recordings = await get_recordings_to_process(session, recording_id, limit)
+        
+        if not recordings:
+            logger.info("No recordings found that need mask video generation")
+            return
+        
+        logger.info(f"Found {len(recordings)} recordings to process")
+        
+        # Process several recordings at once: while one waits on SAM3, the
+        # others decode, encode, transcode or write to the database. SAM3Service
+        # schedules the concurrent inference calls on its own worker threads.
+        total_start = datetime.now()
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        pending_updates: list[tuple[str, str]] = []
+        # The batch shares one session, which can't run statements concurrently
+        db_lock = asyncio.Lock()
+        
+        async def flush(batch: list[tuple[str, str]]):
+            async with db_lock:
+                await update_recording_mask_paths(session, batch)
+        
+        async def run(recording: dict, index: int) -> bool:
+            async with semaphore:
+                try:
+                    result = await process_recording(mask_service, recording, index, len(recordings), prefetch)
+                except Exception as e:
+                    logger.error(f"Error processing recording: {e}")
+                    return False
+                finally:
+                    finish_progress(index)
+            
+            if not result:
+                return False
+            pending_updates.append((recording["id"], result))
+            if len(pending_updates) >= DB_FLUSH_EVERY:
+                # Take the batch before awaiting so concurrent runs start a new one
+                batch = pending_updates.copy()
+                pending_updates.clear()
+                await flush(batch)
+            return True
+        
         try:
-            success = await process_recording(mask_service, recording, i, len(recordings))
-            if success:
-                success_count += 1
-            else:
-                error_count += 1
-        except Exception as e:
-            logger.error(f"Error processing recording: {e}")
-            error_count += 1
+            outcomes = await asyncio.gather(*(
+                run(recording, i) for i, recording in enumerate(recordings, 1)
+            ))
+        finally:
+            # Record whatever finished, even if the batch was interrupted
+            await flush(pending_updates)
+    success_count = sum(outcomes)
+    error_count = len(outcomes) - success_count
     
     total_elapsed = (datetime.now() - total_start).total_seconds()
     
@@ -275,8 +411,32 @@ if __name__ == "__main__":
         type=int,
         help="Limit the number of recordings to process"
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=2,
+        help="Number of recordings to process at the same time (default: 2)"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=4,
+        help="Frames buffered between the decode, inference and encode stages (default: 4)"
+    )
+    parser.add_argument(
+        "--compile",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="torch.compile the SAM3 vision encoder before the batch (CUDA only, default: on)"
+    )
     
     args = parser.parse_args()
     
-    asyncio.run(main(recording_id=args.recording_id, limit=args.limit))
+    asyncio.run(main(
+        recording_id=args.recording_id,
+        limit=args.limit,
+        concurrency=args.concurrency,
+        prefetch=args.prefetch,
+        compile_model=args.compile,
+    ))
 
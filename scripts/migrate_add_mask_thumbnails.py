@@ -6,6 +6,9 @@ Migration script to:
 """
 
 import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor
+import mmap
 import sys
 import os
 
@@ -15,11 +18,25 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import cv2
 import numpy as np
 from pathlib import Path
-from sqlalchemy import text, select
-from sqlalchemy.orm import selectinload
+from typing import Optional
+from sqlalchemy import text, select, update
 
-from backend.database import engine, AsyncSessionLocal, Recording, Alert
+from backend.database import engine, AsyncSessionLocal, Recording, Alert, Rule
 from backend.config import settings
+from backend.services.frame_pool import FramePool
+
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    _turbo_jpeg = TurboJPEG()
+except Exception:
+    # Module or libturbojpeg missing: encode with OpenCV
+    _turbo_jpeg = None
+
+# Generated thumbnails are committed in batches of this size
+COMMIT_EVERY = 16
+
+# Overlay and blend-mask scratch buffers, reused across recordings
+_scratch_pool = FramePool(max_buffers=2)
 
 
 async def add_column():
@@ -27,166 +44,300 @@ async def add_column():
     print("Adding mask_thumbnail_path column to recordings table...")
     
     async with engine.begin() as conn:
-        # Check if column exists
-        result = await conn.execute(text("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='recordings' AND column_name='mask_thumbnail_path'
-        """))
-        
-        if result.fetchone() is None:
-            await conn.execute(text(
-                'ALTER TABLE recordings ADD COLUMN mask_thumbnail_path VARCHAR'
-            ))
-            print("✓ Column added successfully")
-        else:
-            print("✓ Column already exists")
+        await conn.execute(text(
+            'ALTER TABLE recordings ADD COLUMN IF NOT EXISTS mask_thumbnail_path VARCHAR'
+        ))
+    print("✓ Column ready")
 
 
-async def generate_mask_thumbnail_for_recording(recording: Recording, alert: Alert) -> str:
+@functools.lru_cache(maxsize=4096)
+def _label_size(label: str) -> tuple:
+    """(width, height) of a detection label; labels like "cat: 90%" repeat across recordings."""
+    return cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
+
+
+def _read_image(path: str):
     """
-    Generate a mask thumbnail for an existing recording using stored detection data.
+    Decode an image file straight from a read-only mapping of it.
     
-    Since we don't have the original segmentation masks, we draw bounding boxes
-    from the stored detected_objects data.
+    Avoids imread's read into a private buffer; repeated runs are served
+    from the page cache. Returns None if the file is empty or undecodable.
     """
-    # Check if thumbnail exists to use as base image
-    if not recording.thumbnail_path or not Path(recording.thumbnail_path).exists():
-        # Try to extract frame from video
-        video_path = Path(recording.filepath)
-        if not video_path.exists():
-            return None
-        
-        cap = cv2.VideoCapture(str(video_path))
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        # Seek to ~1 second in
-        cap.set(cv2.CAP_PROP_POS_FRAMES, int(fps))
-        ret, frame = cap.read()
-        if not ret:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            ret, frame = cap.read()
-        cap.release()
-        
-        if not ret:
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
             return None
+    with mapped:
+        buf = np.frombuffer(mapped, dtype=np.uint8)
+        try:
+            return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        finally:
+            # The mapping can't close while the array still exports it
+            del buf
+
+
+async def _extract_frame(video_path: Path, seconds: float) -> Optional[bytes]:
+    """
+    Grab one frame at a timestamp with ffmpeg, as BMP bytes (None if there is none).
+    
+    Input-side -ss seeks via the container index to the nearest keyframe,
+    and BMP over the pipe avoids a second lossy encode/decode. Runs as a
+    subprocess, off the event loop.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-loglevel', 'error',
+        '-ss', str(seconds),
+        '-i', str(video_path),
+        '-frames:v', '1',
+        '-f', 'image2pipe',
+        '-vcodec', 'bmp',
+        '-',
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    data, _ = await proc.communicate()
+    if proc.returncode != 0 or not data:
+        return None
+    return data
+
+
+def _write_jpeg(path: Path, image: np.ndarray):
+    """Encode a BGR image as JPEG (libjpeg-turbo SIMD when available) and write it."""
+    if _turbo_jpeg is None:
+        cv2.imwrite(str(path), image)
+        return
+    # Same quality and 4:2:0 subsampling as OpenCV's defaults (TurboJPEG defaults to 4:2:2)
+    data = _turbo_jpeg.encode(image, quality=95, jpeg_subsample=TJSAMP_420)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _draw_labeled_box(
+    overlay: np.ndarray,
+    touched: np.ndarray,
+    obj: dict,
+    color: tuple,
+    label_below: bool = False,
+):
+    """Draw a detection's bbox and confidence label, marking the pixels drawn in `touched`."""
+    x1, y1, x2, y2 = obj['bbox']
+    cv2.rectangle(overlay, (x1, y1), (x2, y2), color, 3)
+    label = f"{obj.get('label', 'object')}: {obj.get('confidence', 0):.0%}"
+    label_size = _label_size(label)
+    if label_below:
+        cv2.rectangle(overlay, (x1, y2), (x1 + label_size[0] + 10, y2 + label_size[1] + 10), color, -1)
+        cv2.putText(overlay, label, (x1 + 5, y2 + label_size[1] + 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        label_top, label_bottom = y2, y2 + label_size[1] + 10
     else:
-        # Read existing thumbnail
-        frame = cv2.imread(str(recording.thumbnail_path))
-        if frame is None:
-            return None
+        cv2.rectangle(overlay, (x1, y1 - label_size[1] - 10), (x1 + label_size[0] + 10, y1), color, -1)
+        cv2.putText(overlay, label, (x1 + 5, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        label_top, label_bottom = y1 - label_size[1] - 10, y1
+    
+    # Box plus its 3px outline, and the label (with room for descenders)
+    touched[max(y1 - 2, 0):y2 + 3, max(x1 - 2, 0):x2 + 3] = True
+    touched[max(label_top - 4, 0):label_bottom + 5, max(x1 - 4, 0):x1 + label_size[0] + 15] = True
+
+
+def _init_worker():
+    # One OpenCV thread per process; the pool already spreads work over the cores
+    cv2.setNumThreads(1)
+
+
+def _render_mask_thumbnail(job: dict) -> Optional[str]:
+    """
+    Draw stored detections onto a recording's base image and save it.
+    
+    Runs in a worker process. `job` holds plain values (no ORM objects):
+    filepath, thumbnail_path, frame_bmp (extracted frame, or None to read
+    the thumbnail), detected_objects, rule_name and timestamp.
+    """
+    if job["frame_bmp"] is not None:
+        frame = cv2.imdecode(np.frombuffer(job["frame_bmp"], dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        frame = _read_image(job["thumbnail_path"])
+    if frame is None:
+        return None
     
     height, width = frame.shape[:2]
-    overlay = frame.copy()
+    overlay = _scratch_pool.copy(frame)
+    # Pixels the drawing can change; only these are blended
+    touched = _scratch_pool.acquire((height, width), dtype=bool)
+    touched.fill(False)
     
     # Color scheme
     primary_color = (0, 100, 255)  # Orange-red in BGR
     secondary_color = (255, 150, 0)  # Blue in BGR
     
-    detected_objects = alert.detected_objects or []
-    
-    for obj in detected_objects:
+    for obj in job["detected_objects"]:
         # Handle spatial relationship objects (primary/secondary structure)
         if 'primary' in obj and 'secondary' in obj:
             # Draw primary
             primary = obj['primary']
             if 'bbox' in primary:
-                x1, y1, x2, y2 = primary['bbox']
                 # Scale bbox if needed (thumbnail might be resized)
-                cv2.rectangle(overlay, (x1, y1), (x2, y2), primary_color, 3)
-                label = f"{primary.get('label', 'object')}: {primary.get('confidence', 0):.0%}"
-                label_size, _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-                cv2.rectangle(overlay, (x1, y1 - label_size[1] - 10), (x1 + label_size[0] + 10, y1), primary_color, -1)
-                cv2.putText(overlay, label, (x1 + 5, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+                _draw_labeled_box(overlay, touched, primary, primary_color)
             
             # Draw secondary
             secondary = obj['secondary']
             if 'bbox' in secondary:
-                x1, y1, x2, y2 = secondary['bbox']
-                cv2.rectangle(overlay, (x1, y1), (x2, y2), secondary_color, 3)
-                label = f"{secondary.get('label', 'object')}: {secondary.get('confidence', 0):.0%}"
-                label_size, _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-                cv2.rectangle(overlay, (x1, y2), (x1 + label_size[0] + 10, y2 + label_size[1] + 10), secondary_color, -1)
-                cv2.putText(overlay, label, (x1 + 5, y2 + label_size[1] + 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+                _draw_labeled_box(overlay, touched, secondary, secondary_color, label_below=True)
         
         # Handle simple detection objects
         elif 'bbox' in obj:
-            x1, y1, x2, y2 = obj['bbox']
-            cv2.rectangle(overlay, (x1, y1), (x2, y2), primary_color, 3)
-            label = f"{obj.get('label', 'object')}: {obj.get('confidence', 0):.0%}"
-            label_size, _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-            cv2.rectangle(overlay, (x1, y1 - label_size[1] - 10), (x1 + label_size[0] + 10, y1), primary_color, -1)
-            cv2.putText(overlay, label, (x1 + 5, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+            _draw_labeled_box(overlay, touched, obj, primary_color)
     
-    # Blend overlay
-    result = cv2.addWeighted(frame, 0.4, overlay, 0.6, 0)
+    # Blend overlay only where something was drawn; everywhere else the
+    # 0.4/0.6 blend of two identical images is the frame itself
+    if touched.any():
+        frame[touched] = cv2.addWeighted(frame[touched], 0.4, overlay[touched], 0.6, 0)
+    result = frame
+    _scratch_pool.release(overlay)
+    _scratch_pool.release(touched)
     
     # Add header info
-    rule_name = alert.rule.name if alert.rule else "Unknown Rule"
-    cv2.putText(result, f"Rule: {rule_name}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-    
-    timestamp = alert.triggered_at.strftime("%Y-%m-%d %H:%M:%S UTC") if alert.triggered_at else ""
-    cv2.putText(result, timestamp, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
+    cv2.putText(result, f"Rule: {job['rule_name']}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+    cv2.putText(result, job["timestamp"], (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
     
     # Add "Backfilled" indicator
     cv2.putText(result, "[Backfilled - Bounding Boxes Only]", (10, height - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 200, 255), 1)
     
     # Save mask thumbnail
-    video_path = Path(recording.filepath)
+    video_path = Path(job["filepath"])
     mask_filename = video_path.stem + "_mask.jpg"
     mask_path = settings.RECORDINGS_PATH / mask_filename
     
-    cv2.imwrite(str(mask_path), result)
+    _write_jpeg(mask_path, result)
     
     return str(mask_path)
 
 
+async def generate_mask_thumbnail_for_recording(
+    recording: dict,
+    executor: Optional[Executor] = None,
+) -> Optional[str]:
+    """
+    Generate a mask thumbnail for an existing recording using stored detection data.
+    
+    Since we don't have the original segmentation masks, we draw bounding boxes
+    from the stored detected_objects data. `recording` is a row from the
+    backfill query (recording, alert and rule columns). Decoding, drawing
+    and encoding run on `executor` (a process pool in the backfill).
+    """
+    # Check if thumbnail exists to use as base image
+    frame_bmp = None
+    if not recording["thumbnail_path"] or not Path(recording["thumbnail_path"]).exists():
+        # Try to extract frame from video
+        video_path = Path(recording["filepath"])
+        if not video_path.exists():
+            return None
+        
+        # ~1 second in, or the first frame for shorter clips
+        frame_bmp = await _extract_frame(video_path, 1.0) or await _extract_frame(video_path, 0.0)
+        if frame_bmp is None:
+            return None
+    
+    triggered_at = recording["triggered_at"]
+    job = {
+        "filepath": recording["filepath"],
+        "thumbnail_path": recording["thumbnail_path"],
+        "frame_bmp": frame_bmp,
+        "detected_objects": recording["detected_objects"] or [],
+        "rule_name": recording["rule_name"] if recording["rule_id"] is not None else "Unknown Rule",
+        "timestamp": triggered_at.strftime("%Y-%m-%d %H:%M:%S UTC") if triggered_at else "",
+    }
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, _render_mask_thumbnail, job)
+
+
 async def backfill_mask_thumbnails():
     """Generate mask thumbnails for all existing recordings that don't have them."""
     print("\nBackfilling mask thumbnails for existing recordings...")
     
     async with AsyncSessionLocal() as session:
-        # Get all recordings without mask thumbnails, with their alerts
+        # Get all recordings without mask thumbnails, with the alert and rule
+        # columns the drawing needs, in one query
         query = (
-            select(Recording)
-            .options(selectinload(Recording.alert).selectinload(Alert.rule))
+            select(
+                Recording.id,
+                Recording.filename,
+                Recording.filepath,
+                Recording.thumbnail_path,
+                Alert.id.label("alert_id"),
+                Alert.detected_objects,
+                Alert.triggered_at,
+                Rule.id.label("rule_id"),
+                Rule.name.label("rule_name"),
+            )
+            .outerjoin(Alert, Recording.alert_id == Alert.id)
+            .outerjoin(Rule, Alert.rule_id == Rule.id)
             .where(Recording.mask_thumbnail_path == None)
         )
         
         result = await session.execute(query)
-        recordings = result.unique().scalars().all()
+        recordings = result.mappings().all()
         
         print(f"Found {len(recordings)} recordings without mask thumbnails")
         
         success_count = 0
         skip_count = 0
         error_count = 0
+        pending_updates = []
+        
+        async def flush():
+            if pending_updates:
+                # ORM bulk UPDATE by primary key: one executemany, no SELECT
+                await session.execute(update(Recording), pending_updates)
+                pending_updates.clear()
+            await session.commit()
         
-        for i, recording in enumerate(recordings):
+        workers = os.cpu_count() or 1
+        # Bounds the ffmpeg extractions and queued frames in flight
+        semaphore = asyncio.Semaphore(workers * 2)
+        
+        async def generate(i: int, recording):
             try:
-                if not recording.alert:
-                    print(f"  [{i+1}/{len(recordings)}] {recording.filename}: No alert data, skipping")
+                async with semaphore:
+                    mask_path = await generate_mask_thumbnail_for_recording(recording, executor)
+                return i, recording, mask_path, None
+            except Exception as e:
+                return i, recording, None, e
+        
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            tasks = []
+            for i, recording in enumerate(recordings):
+                if recording["alert_id"] is None:
+                    print(f"  [{i+1}/{len(recordings)}] {recording['filename']}: No alert data, skipping")
                     skip_count += 1
                     continue
                 
-                if not recording.alert.detected_objects:
-                    print(f"  [{i+1}/{len(recordings)}] {recording.filename}: No detection data, skipping")
+                if not recording["detected_objects"]:
+                    print(f"  [{i+1}/{len(recordings)}] {recording['filename']}: No detection data, skipping")
                     skip_count += 1
                     continue
                 
-                mask_path = await generate_mask_thumbnail_for_recording(recording, recording.alert)
-                
-                if mask_path:
-                    recording.mask_thumbnail_path = mask_path
-                    await session.commit()
-                    print(f"  [{i+1}/{len(recordings)}] {recording.filename}: ✓ Generated mask thumbnail")
+                tasks.append(asyncio.create_task(generate(i, recording)))
+            
+            # Results are applied (and committed in batches) as they finish
+            for next_done in asyncio.as_completed(tasks):
+                i, recording, mask_path, error = await next_done
+                if error is not None:
+                    print(f"  [{i+1}/{len(recordings)}] {recording['filename']}: Error - {error}")
+                    error_count += 1
+                elif mask_path:
+                    pending_updates.append({"id": recording["id"], "mask_thumbnail_path": mask_path})
+                    print(f"  [{i+1}/{len(recordings)}] {recording['filename']}: ✓ Generated mask thumbnail")
                     success_count += 1
+                    if success_count % COMMIT_EVERY == 0:
+                        await flush()
                 else:
-                    print(f"  [{i+1}/{len(recordings)}] {recording.filename}: Failed to generate (no source image)")
+                    print(f"  [{i+1}/{len(recordings)}] {recording['filename']}: Failed to generate (no source image)")
                     skip_count += 1
-                    
-            except Exception as e:
-                print(f"  [{i+1}/{len(recordings)}] {recording.filename}: Error - {e}")
-                error_count += 1
+        
+        # Commit the last partial batch
+        await flush()
         
         print(f"\nBackfill complete:")
         print(f"  ✓ Success: {success_count}")
@@ -0,0 +1,58 @@
+import asyncio
+from unittest import mock
+
+from backend.database import Rule, RuleConditionType
+from backend.services.pipeline_manager import PipelineManager, PipelineState
+
+
+def _rule(rule_id: str) -> Rule:
+    return Rule(
+        id=rule_id,
+        camera_id="cam1",
+        name="cat rule",
+        enabled=True,
+        primary_target="cat",
+        condition_type=RuleConditionType.OBJECT_DETECTED,
+        condition_params={},
+        cooldown_seconds=0,
+        on_alert_end_actions=[],
+    )
+
+
+def _manager_recording_alert():
+    """A manager whose rule r1 is in alert a1 with recording rec1 in progress."""
+    manager = PipelineManager(sam3_service=None)
+    rule = _rule("r1")
+    manager.rule_engine.register_rule(rule)
+    state = manager.rule_engine._rule_states["r1"]
+    state.is_in_alert = True
+    state.current_alert_id = "a1"
+    
+    camera_stream = mock.Mock(stop=mock.AsyncMock())
+    pipeline = PipelineState(camera_id="cam1", camera_stream=camera_stream, rules=[rule], is_running=True)
+    pipeline.active_alerts["a1"] = "rec1"
+    manager._pipelines["cam1"] = pipeline
+    manager.recording_service.stop_recording = mock.AsyncMock(return_value=None)
+    return manager, pipeline
+
+
+def test_removing_rule_during_recording_stops_it():
+    manager, pipeline = _manager_recording_alert()
+    
+    with mock.patch("backend.services.pipeline_manager.AsyncSessionLocal", side_effect=RuntimeError("no db")):
+        asyncio.run(manager.remove_rule("r1", "cam1"))
+    
+    manager.recording_service.stop_recording.assert_awaited_once_with("rec1", None)
+    assert pipeline.active_alerts == {}
+    assert "r1" not in manager.rule_engine._rule_states
+
+
+def test_removing_camera_during_recording_stops_it():
+    manager, pipeline = _manager_recording_alert()
+    
+    with mock.patch("backend.services.pipeline_manager.AsyncSessionLocal", side_effect=RuntimeError("no db")):
+        asyncio.run(manager.remove_camera("cam1"))
+    
+    manager.recording_service.stop_recording.assert_awaited_once_with("rec1", 0)
+    pipeline.camera_stream.stop.assert_awaited_once()
+    assert "cam1" not in manager._pipelines
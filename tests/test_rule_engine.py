@@ -0,0 +1,42 @@
+import asyncio
+from unittest import mock
+
+from backend.database import Rule, RuleConditionType
+from backend.services.rule_engine import RuleEngine
+
+
+def _rule(rule_id: str, primary_target: str) -> Rule:
+    return Rule(
+        id=rule_id,
+        camera_id="cam1",
+        name=f"{primary_target} rule",
+        enabled=True,
+        primary_target=primary_target,
+        condition_type=RuleConditionType.OBJECT_DETECTED,
+        condition_params={},
+        cooldown_seconds=0,
+    )
+
+
+def test_empty_detection_lists_skip_evaluation():
+    engine = RuleEngine(sam3_service=None)
+    engine.register_rule(_rule("r1", "cat"))
+    
+    with mock.patch.object(engine, "_evaluate_single_rule") as evaluate:
+        results = asyncio.run(engine.evaluate_rules("cam1", {"cat": []}))
+    
+    assert results == []
+    evaluate.assert_not_called()
+
+
+def test_rule_with_empty_primary_list_is_skipped():
+    engine = RuleEngine(sam3_service=None)
+    engine.register_rule(_rule("r1", "cat"))
+    engine.register_rule(_rule("r2", "dog"))
+    dog = mock.Mock(label="dog", confidence=0.9, bbox=(0, 0, 10, 10), center=(5, 5))
+    
+    with mock.patch.object(engine, "_evaluate_single_rule") as evaluate:
+        evaluate.return_value = mock.Mock(triggered=False)
+        asyncio.run(engine.evaluate_rules("cam1", {"cat": [], "dog": [dog]}))
+    
+    assert [call.args[1].primary_target for call in evaluate.call_args_list] == ["dog"]